@@ -0,0 +1,67 @@
+"""Harness of the startup benchmarks of the asset banks (bench_sound_startup, bench_image_startup).
+
+- direct: every asset decoded in turn, as the game did
+- bank, cold: preload() in the thread pool, decoding and filling an emptied cache
+- bank, warm: a new bank reading the cache of the previous launch
+- startup wait: how long preload() blocks the caller
+
+Every variant runs REPEATS times and the median is reported."""
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+from GameEngine.asset_bank import AssetBank
+
+REPEATS = 5
+
+
+def median_ms(run, repeats: int = REPEATS) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1e3
+
+def require_assets(paths: list[Path], kind: str):
+    """Exits if an asset is missing, they are not all in the repository"""
+    missing = [path for path in paths if not path.exists()]
+    if missing:
+        sys.exit(f"Missing {kind} assets, e.g. {missing[0]}")
+
+def run_startup(load_direct: Callable[[], object], make_bank: Callable[[Path], AssetBank],
+                preload: Callable[[AssetBank], None], fetch: Callable[[AssetBank], None], check: Callable[[AssetBank], bool]) -> bool:
+    """Prints the timings of the variants, then returns check() of a bank loaded from the warm cache
+
+    make_bank(cache_dir) builds a bank, preload(bank) starts its loading, and fetch(bank) gets every asset."""
+    def load_bank(cache_dir: Path) -> AssetBank:
+        bank = make_bank(cache_dir)
+        preload(bank)
+        fetch(bank)
+        bank.close()
+        return bank
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache_dir = Path(directory)
+        def cold():
+            for cached in cache_dir.iterdir():
+                cached.unlink()
+            load_bank(cache_dir)
+
+        direct = median_ms(load_direct)
+        print(f"{'direct':>12}: {direct:8.1f} ms")
+        cold_ms = median_ms(cold)
+        print(f"{'bank, cold':>12}: {cold_ms:8.1f} ms ({direct / cold_ms:.1f}x)")
+        warm_ms = median_ms(lambda: load_bank(cache_dir))
+        print(f"{'bank, warm':>12}: {warm_ms:8.1f} ms ({direct / warm_ms:.1f}x)")
+        starts = []
+        for _ in range(REPEATS):
+            bank = make_bank(cache_dir)
+            start = time.perf_counter()
+            preload(bank)
+            starts.append(time.perf_counter() - start)
+            bank.close()
+        print(f"{'startup wait':>12}: {statistics.median(starts) * 1e3:8.2f} ms for preload() to return")
+        return check(load_bank(cache_dir))
@@ -0,0 +1,63 @@
+"""Benchmark of the per-frame arrow position update.
+
+Compares the old one-object-per-arrow update() loop with the vectorized
+ArrowStore.update_positions() pass, at 1k, 10k and 100k live arrows.
+
+Run from the repository root: python -m Benchmarks.bench_arrow_store"""
+import time
+import numpy as np
+from GameEngine.arrow_store import ArrowStore
+from GameEngine.constants import ARROW_SIZE, HEIGHT, MEASURE_MARGIN, ZERO_Y, DESPAWN_Y
+
+ARROW_COUNTS = [1_000, 10_000, 100_000]
+FRAMES = 50
+BPM = 120
+SCROLL_SPEED = 350
+
+
+class LegacyArrow:
+    """Arrow as it was updated before the ArrowStore: one Python object per arrow"""
+
+    def __init__(self, spawn_time: float):
+        self.spawn_time = spawn_time
+        self.y = 0
+
+    def update(self, current_time, height: int, scroll_speed: int, BPM: int):
+        time_1_measure = 4*60/BPM
+        speed = scroll_speed
+        spawn_y = ZERO_Y + MEASURE_MARGIN * time_1_measure * speed
+
+        t = current_time - self.spawn_time
+        self.y = ZERO_Y + (spawn_y - ZERO_Y)*(1 - t / (MEASURE_MARGIN * time_1_measure)) - ARROW_SIZE//2
+
+def bench_legacy(spawn_times: np.ndarray) -> float:
+    arrows = [LegacyArrow(t) for t in spawn_times.tolist()]
+    t0 = time.perf_counter()
+    for frame in range(FRAMES):
+        current_time = frame / 60
+        visible = []
+        for arrow in arrows:
+            arrow.update(current_time, HEIGHT, SCROLL_SPEED, BPM)
+            if DESPAWN_Y <= arrow.y < HEIGHT:
+                visible.append(arrow)
+    return (time.perf_counter() - t0) / FRAMES
+
+def bench_store(spawn_times: np.ndarray) -> float:
+    store = ArrowStore()
+    for i, spawn_time in enumerate(spawn_times.tolist()):
+        spawn_beat = spawn_time * BPM / 60
+        store.add(spawn_beat, spawn_beat + 4 * MEASURE_MARGIN, i % 4, i % 9)
+    t0 = time.perf_counter()
+    for frame in range(FRAMES):
+        store.update_positions(frame / 60 * BPM / 60, SCROLL_SPEED * 60 / BPM)
+    return (time.perf_counter() - t0) / FRAMES
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    print(f"{'arrows':>8} {'objects (ms/frame)':>20} {'store (ms/frame)':>18} {'speedup':>8}")
+    for count in ARROW_COUNTS:
+        spawn_times = np.sort(rng.uniform(0, 2, count))
+        legacy = bench_legacy(spawn_times)
+        store = bench_store(spawn_times)
+        print(f"{count:>8} {legacy*1e3:>20.3f} {store*1e3:>18.3f} {legacy/store:>7.1f}x")
@@ -0,0 +1,74 @@
+"""Benchmark of beat sound onset error, frame loop against AudioScheduler.
+
+The frame loop plays a beat when a 60 FPS loop sees its time has passed (the
+old BeatSoundMaker path); the AudioScheduler gets the beats queued ahead by the
+same loop and plays them from its thread. Sounds are silent stand-ins, so the
+error measured is the one of the play() call, without the mixer latency.
+
+Run from the repository root: python -m Benchmarks.bench_audio_jitter"""
+import time
+import numpy as np
+from GameAudio.audio_scheduler import AudioScheduler
+from GameEngine.tempo_map import TempoMap
+
+BPMS = (60, 97, 128, 173, 240) # not synced with the frames, as with a real song
+SECONDS_PER_BPM = 4.0
+START_DELAY = 0.0537 # seconds before beat 0, not a whole number of frames
+FPS = 60
+LOOKAHEAD = 0.1
+
+
+class SilentSound:
+    """Stand-in for pygame.mixer.Sound"""
+    def play(self, loops: int = 0, maxtime: int = 0, fade_ms: int = 0):
+        pass
+
+def frame_loop(seconds: float, on_frame):
+    """Calls on_frame(now) at FPS frames per second, sleeping like pygame.time.Clock.tick()"""
+    start = time.perf_counter()
+    next_frame = start
+    while True:
+        now = time.perf_counter()
+        if now - start > seconds:
+            return
+        on_frame(now)
+        next_frame += 1 / FPS
+        time.sleep(max(0.0, next_frame - time.perf_counter()))
+
+def bench_frame_loop(bpm: float) -> np.ndarray:
+    tempo_map = TempoMap(((0, bpm),), origin_time=time.perf_counter() + START_DELAY)
+    errors = []
+    next_beat = 0
+    def on_frame(now: float):
+        nonlocal next_beat
+        while tempo_map.time_to_beat(now) >= next_beat:
+            SilentSound().play()
+            errors.append(time.perf_counter() - tempo_map.beat_to_time(next_beat))
+            next_beat += 1
+    frame_loop(SECONDS_PER_BPM, on_frame)
+    return np.array(errors)
+
+def bench_scheduler(bpm: float) -> np.ndarray:
+    scheduler = AudioScheduler()
+    scheduler.start()
+    tempo_map = TempoMap(((0, bpm),), origin_time=time.perf_counter() + START_DELAY)
+    sound = SilentSound()
+    next_beat = 0
+    def on_frame(now: float):
+        nonlocal next_beat
+        while tempo_map.beat_to_time(next_beat) <= now + LOOKAHEAD:
+            scheduler.schedule(tempo_map.beat_to_time(next_beat), sound, tag=bpm)
+            next_beat += 1
+    frame_loop(SECONDS_PER_BPM, on_frame)
+    time.sleep(LOOKAHEAD) # let the queued beats play
+    scheduler.stop()
+    return np.array(scheduler.onset_errors[bpm])
+
+def describe(errors: np.ndarray) -> str:
+    errors_ms = np.abs(errors) * 1e3
+    return f"{len(errors):>4} beats, mean {errors_ms.mean():6.3f} ms, p99 {np.percentile(errors_ms, 99):6.3f} ms"
+
+
+if __name__ == "__main__":
+    for bpm in BPMS:
+        print(f"{bpm:>3} BPM   frame loop: {describe(bench_frame_loop(bpm))}   scheduler: {describe(bench_scheduler(bpm))}")
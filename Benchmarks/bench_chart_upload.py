@@ -0,0 +1,139 @@
+"""Benchmark of the chart upload against an emulated controller.
+
+The ChartUploader writes to a loopback.ControllerEmulator (player1.ino) through
+a LoopbackTransport, which models the connection events and TX buffer of a BLE
+link: writes without response are dropped when the buffer is full, and writes
+the characteristic's properties (those of player1.ino) do not allow are
+rejected.
+
+Throughput is measured on one burst of arrow times, uploaded with one write with
+response per frame (as BluetoothClient.send_message_bytes does), pipelined
+without flow control, and pipelined with the ChartUploader's flow control.
+Write latency (queued -> written) and slack (arrow time - decoded) are
+measured while a GameEngine streams random notes through a ChartUploader.
+The bench fails if a write is rejected, or if the flow-controlled strategies
+or the stream lose arrow times.
+
+Run from the repository root: python -m Benchmarks.bench_chart_upload"""
+import asyncio
+import sys
+import threading
+import time
+import numpy as np
+from types import SimpleNamespace
+from BluetoothImplementation.chart_upload import ChartUploader, DEFAULT_MTU, MAX_IN_FLIGHT, pack_lane_frames
+from BluetoothImplementation.clock_sync import ClockSyncEstimator
+from BluetoothImplementation.loopback import CONNECTION_INTERVAL, PACKETS_PER_EVENT, TX_BUFFER, PLAYER1_RX_UUID, ControllerEmulator, LoopbackTransport
+from GameEngine.chart_stream import ChartScheduler, random_notes
+from GameEngine.game_engine import GameEngine, PerfCounterClock
+
+BURST_TIMES = 1200 # arrow times of the throughput burst
+STREAM_DURATION = 8.0 # seconds of gameplay streamed
+STREAM_FPS = 60
+STREAM_BPM = 180
+LARGE_MTU = 247
+
+
+def start_loop() -> asyncio.AbstractEventLoop:
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+def emulated_client(loop: asyncio.AbstractEventLoop, mtu: int) -> SimpleNamespace:
+    """A BluetoothClient connected to a ControllerEmulator logging the uploads"""
+    emulator = ControllerEmulator()
+    emulator.arrow_log = []
+    transport = LoopbackTransport(emulator, mtu_size=mtu)
+    asyncio.run_coroutine_threadsafe(transport.connect(), loop).result()
+    return SimpleNamespace(client=transport, loop=loop, CHARACTERISTIC_UUID_TX=PLAYER1_RX_UUID)
+
+def received_times(emulator: ControllerEmulator) -> int:
+    return sum(len(times) for _, _, times in emulator.arrow_log)
+
+async def write_each_with_response(client: SimpleNamespace, frames: list[bytes]):
+    for frame in frames:
+        try:
+            await client.client.write_gatt_char(client.CHARACTERISTIC_UUID_TX, frame, response=True)
+        except PermissionError: # counted by the transport
+            pass
+
+async def write_all_without_response(client: SimpleNamespace, frames: list[bytes]):
+    for frame in frames:
+        try:
+            await client.client.write_gatt_char(client.CHARACTERISTIC_UUID_TX, frame, response=False)
+        except PermissionError:
+            pass
+    await asyncio.sleep(CONNECTION_INTERVAL * (TX_BUFFER // PACKETS_PER_EVENT + 2)) # let the buffer drain
+
+def burst(loop: asyncio.AbstractEventLoop, mtu: int, strategy: str) -> tuple[float, int, int, int]:
+    """Uploads BURST_TIMES times, returns (seconds, times received, frames dropped, frames rejected)"""
+    client = emulated_client(loop, mtu)
+    times_us = np.arange(BURST_TIMES, dtype=np.float64) * 1e5
+    frames = [frame for column in range(4) for frame in pack_lane_frames(column, times_us[column::4], mtu)]
+    t0 = time.perf_counter()
+    if strategy == "uploader":
+        uploader = ChartUploader(client, None)
+        uploader.start()
+        uploader.queue_frames(frames)
+        while uploader.frames_sent + uploader.frames_failed < len(frames):
+            time.sleep(0.001)
+        uploader.stop()
+    else:
+        write = write_each_with_response if strategy == "response" else write_all_without_response
+        asyncio.run_coroutine_threadsafe(write(client, frames), loop).result()
+    elapsed = time.perf_counter() - t0
+    loop.call_soon_threadsafe(client.client.drop_link)
+    return elapsed, received_times(client.client.emulator), client.client.dropped_writes, client.client.rejected_writes
+
+def stream(loop: asyncio.AbstractEventLoop, mtu: int) -> tuple[ChartUploader, int, np.ndarray, np.ndarray]:
+    """Plays STREAM_DURATION seconds of random notes, returns the uploader, the times received, the latencies and the slacks (seconds)"""
+    engine = GameEngine(PerfCounterClock())
+    engine.BPM = STREAM_BPM
+    engine.chart_scheduler = ChartScheduler(random_notes(np.random.RandomState(0)))
+    engine.start()
+    client = emulated_client(loop, mtu)
+    emulator = client.client.emulator
+    estimator = ClockSyncEstimator()
+    estimator.add_sample(emulator.boot_time, 0.0, emulator.boot_time) # exact, the emulator has no drift
+    uploader = ChartUploader(client, SimpleNamespace(estimator=estimator))
+    uploader.start()
+    frame_time = engine.start_time
+    while engine.time - engine.start_time < STREAM_DURATION:
+        engine.update()
+        uploader.update(engine)
+        frame_time += 1 / STREAM_FPS
+        time.sleep(max(0.0, frame_time - time.perf_counter()))
+    time.sleep(0.1)
+    uploader.stop()
+    loop.call_soon_threadsafe(client.client.drop_link)
+    slacks = [time_us * 1e-6 + emulator.boot_time - receipt_time for receipt_time, _, times in emulator.arrow_log for time_us in times.astype(np.float64)]
+    return uploader, received_times(emulator), np.array(uploader.latencies), np.array(slacks)
+
+def percentiles_ms(values: np.ndarray) -> str:
+    p50, p99 = np.percentile(values * 1e3, [50, 99])
+    return f"p50 {p50:7.2f} ms, p99 {p99:7.2f} ms, min {values.min() * 1e3:7.2f} ms"
+
+
+if __name__ == "__main__":
+    loop = start_loop()
+    print(f"Connection interval {CONNECTION_INTERVAL * 1e3:.1f} ms, {PACKETS_PER_EVENT} packets per event, TX buffer {TX_BUFFER} packets, max in flight {MAX_IN_FLIGHT}")
+    print(f"{'strategy':>22} {'MTU':>4} {'seconds':>8} {'times/s':>10} {'received':>9} {'dropped':>8} {'rejected':>9}")
+    ok = True
+    for mtu in (DEFAULT_MTU, LARGE_MTU):
+        for strategy in ("response", "no flow control", "uploader"):
+            elapsed, received, dropped, rejected = burst(loop, mtu, strategy)
+            print(f"{strategy:>22} {mtu:>4} {elapsed:>8.3f} {received / elapsed:>10,.0f} {received:>9} {dropped:>8} {rejected:>9}")
+            ok &= rejected == 0 and (strategy == "no flow control" or received == BURST_TIMES) # dropping is the point of no flow control
+
+    print(f"Streaming {STREAM_DURATION:.0f} s of random notes at {STREAM_BPM} BPM, {STREAM_FPS} FPS")
+    for mtu in (DEFAULT_MTU, LARGE_MTU):
+        uploader, received, latencies, slacks = stream(loop, mtu)
+        print(f"MTU {mtu:>3}: {uploader.times_sent} times in {uploader.frames_sent} frames ({uploader.bytes_sent} bytes), {received} received, {uploader.frames_failed} frames failed")
+        if len(latencies):
+            print(f"  latency queued -> written {percentiles_ms(latencies)}")
+        if len(slacks):
+            print(f"  slack arrow time - device {percentiles_ms(slacks)}")
+        ok &= uploader.frames_failed == 0 and received == uploader.times_sent
+    loop.call_soon_threadsafe(loop.stop)
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,97 @@
+"""Overhead of the frame profiler on a frame loop shaped like Stepmania.start().
+
+The same synthetic frame (twelve phases of a little NumPy work) is run without
+any instrumentation, with the instrumentation of stepmania.py and the profiler
+disabled (profiler is None), with no-op profiler methods instead of the tests,
+and with the profiler enabled. The loops only differ by their instrumentation.
+Each variant is timed REPEATS times, interleaved, and the best run is kept; the
+overhead is given per frame and as a share of a 60 FPS frame.
+
+A disabled profiler costs the GUARDS_PER_FRAME 'profiler is not None' tests of
+the frame loop, a few ns each, far below the run-to-run noise of the loops, so
+that cost is also timed on its own and reported as the accepted overhead.
+
+Run from the repository root: python -m Benchmarks.bench_frame_profiler"""
+import timeit
+import time
+import numpy as np
+from GameRendering import frame_profiler as fp
+
+FRAMES = 20_000
+REPEATS = 7
+FRAME_BUDGET = 1 / 60
+GUARDS_PER_FRAME = 14 # 'if profiler is not None' tests in Stepmania.start() per frame
+GUARD_TESTS = 2_000_000
+
+work = np.zeros(64)
+
+def phase():
+    work.sum()
+
+
+class NoOpProfiler:
+    """The alternative to the tests: a disabled profiler whose methods do nothing"""
+    def begin_frame(self): pass
+    def lap(self, phase: int): pass
+    def end_frame(self): pass
+
+
+def run_plain(frames: int, profiler: None):
+    for _ in range(frames):
+        for index in range(len(fp.FRAME_PHASES)):
+            phase()
+
+def run_instrumented(frames: int, profiler: fp.FrameProfiler):
+    for _ in range(frames):
+        if profiler is not None:
+            profiler.begin_frame()
+        for index in range(len(fp.FRAME_PHASES)):
+            phase()
+            if profiler is not None:
+                profiler.lap(index)
+        if profiler is not None:
+            profiler.end_frame()
+
+def run_no_op(frames: int, profiler: NoOpProfiler):
+    for _ in range(frames):
+        profiler.begin_frame()
+        for index in range(len(fp.FRAME_PHASES)):
+            phase()
+            profiler.lap(index)
+        profiler.end_frame()
+
+def time_frame(run, profiler) -> float:
+    """Seconds per frame of one run"""
+    start = time.perf_counter()
+    run(FRAMES, profiler)
+    return (time.perf_counter() - start) / FRAMES
+
+def guard_cost() -> float:
+    """Seconds of one 'profiler is not None' test with the profiler disabled, above an empty statement"""
+    namespace = {"profiler": None}
+    test = min(timeit.repeat("if profiler is not None: pass", globals=namespace, number=GUARD_TESTS, repeat=REPEATS))
+    empty = min(timeit.repeat("pass", globals=namespace, number=GUARD_TESTS, repeat=REPEATS))
+    return max(0.0, test - empty) / GUARD_TESTS
+
+
+if __name__ == "__main__":
+    variants = {
+        "no instrumentation": (run_plain, None),
+        "profiler disabled": (run_instrumented, None),
+        "no-op methods": (run_no_op, NoOpProfiler()),
+        "profiler enabled": (run_instrumented, fp.FrameProfiler()),
+    }
+    best = {name: float("inf") for name in variants}
+    for _ in range(REPEATS):
+        for name, (run, profiler) in variants.items():
+            best[name] = min(best[name], time_frame(run, profiler))
+    baseline = best["no instrumentation"]
+    print(f"{len(fp.FRAME_PHASES)} phases, {FRAMES} frames, best of {REPEATS}")
+    for name, frame_time in best.items():
+        overhead = frame_time - baseline
+        print(f"{name:>20}: {frame_time * 1e6:7.2f} us/frame, overhead {overhead * 1e6:+6.2f} us ({overhead / FRAME_BUDGET:+.4%} of a 60 FPS frame)")
+    guard = guard_cost()
+    print(f"Accepted cost when disabled: {GUARDS_PER_FRAME} tests x {guard * 1e9:.1f} ns = {GUARDS_PER_FRAME * guard * 1e6:.3f} us/frame"
+          f" ({GUARDS_PER_FRAME * guard / FRAME_BUDGET:.5%} of a 60 FPS frame)")
+    profiler = variants["profiler enabled"][1]
+    print(f"Ring buffer: {profiler.durations.nbytes + profiler.frame_times.nbytes} bytes for the last {len(profiler.frame_times)} of {profiler.frames} frames")
@@ -0,0 +1,53 @@
+"""Startup time of the game images, decoded and scaled one by one or through the ImageBank.
+
+- direct: pygame.image.load() and pygame.transform.scale() of every asset in turn, as the game did
+- bank, cold: ImageBank.preload() in the thread pool, decoding, scaling and filling the RGBA cache
+- bank, warm: a new ImageBank reading the RGBA cache of the previous launch with frombuffer()
+- startup wait: how long preload() blocks the caller, the rest overlaps the pygame and display startup
+
+The harness is in Benchmarks.asset_startup, and the cached pixels are checked
+against a direct decoding. Run it on the Pi, from the repository root:
+python -m Benchmarks.bench_image_startup"""
+import argparse
+import sys
+import pygame
+from pathlib import Path
+from GameEngine.constants import ARROW_SIZE
+from GameRendering.image_bank import ImageBank, IMAGE_WORKERS
+from Benchmarks.asset_startup import REPEATS, require_assets, run_startup
+
+ARROW_FILES = [f"Arrow{color}.png" for color in ("Blue", "Red", "Green", "Yellow", "Purple", "Magenta", "Cyan", "Pink", "White", "Marker", "Spawn")] # as stepmania.py
+PLAYER_FILES = ["Player1.png", "Player2.png"]
+PLAYER_SIZE = 50 # PlayerBtMarker.SIZE
+
+
+def load_direct(requests: list[tuple[list[Path], tuple[int, int]]]) -> list[pygame.Surface]:
+    return [pygame.transform.scale(pygame.image.load(path), size) for paths, size in requests for path in paths]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Image loading startup benchmark")
+    parser.add_argument("--resources", type=Path, default=Path("./Resources/"), help="directory of the game assets")
+    parser.add_argument("--workers", type=int, default=IMAGE_WORKERS)
+    args = parser.parse_args()
+    requests = [([(args.resources / name).absolute() for name in ARROW_FILES], (ARROW_SIZE, ARROW_SIZE)),
+                ([(args.resources / name).absolute() for name in PLAYER_FILES], (PLAYER_SIZE, PLAYER_SIZE))]
+    keys = [(path, size) for paths, size in requests for path in paths] # in the order of load_direct()
+    require_assets([path for path, _ in keys], "image")
+    print(f"{len(keys)} images, {args.workers} decoding threads, median of {REPEATS}")
+
+    def preload(bank: ImageBank):
+        for paths, size in requests:
+            bank.preload(paths, size)
+
+    def check(bank: ImageBank) -> bool:
+        same = all(pygame.image.tobytes(bank.get(*key), "RGBA") == pygame.image.tobytes(image, "RGBA") for key, image in zip(keys, load_direct(requests)))
+        print(f"Cached pixels identical to a direct decoding: {same} ({bank.cache_hits} read from the cache)")
+        return same
+
+    same = run_startup(lambda: load_direct(requests),
+                       lambda cache_dir: ImageBank(cache_dir, args.workers),
+                       preload,
+                       lambda bank: [bank.get(*key) for key in keys],
+                       check)
+    sys.exit(0 if same else 1)
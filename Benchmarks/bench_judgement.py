@@ -0,0 +1,105 @@
+"""Throughput of the tiered judgement, headless.
+
+- scalar: ScoreRecorder.judge_hit(), the live path, one hit at a time
+- batch: Judge.judge_many() and JudgementStats.record_many() on known offsets
+- lanes: Judge.match_hits() on whole lanes of arrows with jittered and stray presses
+
+The batch statistics are checked against the scalar ones, and match_hits()
+against a LaneTimeline replay of the rule of GameEngine.do_arrow_hit().
+
+Run from the repository root: python -m Benchmarks.bench_judgement"""
+import math
+import sys
+import time
+import numpy as np
+from GameEngine.game_engine import ScoreRecorder
+from GameEngine.judgement import Judge, JudgementStats
+from GameEngine.lane_timeline import LaneTimeline
+
+SCALAR_HITS = 1_000_000
+BATCH_HITS = 10_000_000
+LANE_ARROWS = 1_000_000 # per lane
+CHECK_ARROWS = 20_000
+JITTER = 0.03 # seconds, standard deviation of the presses around their arrow
+STRAY_FRACTION = 0.1 # presses with no arrow in mind
+
+
+def make_lane(rng: np.random.Generator, arrows: int) -> tuple[np.ndarray, np.ndarray]:
+    """(target times, sorted press times) of a lane with close arrows, late and early presses and stray presses"""
+    targets = np.cumsum(rng.uniform(0.05, 0.5, arrows))
+    presses = targets[rng.random(arrows) < 0.95] # some arrows are skipped
+    presses = presses + rng.normal(0.0, JITTER, len(presses))
+    strays = rng.uniform(0, targets[-1], int(arrows * STRAY_FRACTION))
+    return targets, np.sort(np.concatenate((presses, strays)))
+
+def match_reference(judge: Judge, targets: np.ndarray, hits: np.ndarray) -> np.ndarray:
+    """Index of the arrow taken by each hit, one hit at a time as GameEngine.do_arrow_hit()"""
+    lane = LaneTimeline()
+    for index, target in enumerate(targets.tolist()):
+        lane.insert(target, index)
+    window = judge.window
+    matched = []
+    for hit in hits.tolist():
+        index = lane.find_first_between(hit - window, hit + window)
+        while index is not None and lane.times[index] <= hit - window:
+            index = lane.find_first_between(math.nextafter(lane.times[index], math.inf), hit + window)
+        if index is None or judge.judge(hit - lane.times[index]) == judge.miss:
+            matched.append(-1)
+        else:
+            matched.append(lane.remove_at(index))
+    return np.array(matched)
+
+def rate(count: int, seconds: float) -> str:
+    return f"{count / seconds / 1e6:6.2f} M judgements/s"
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    ok = True
+
+    offsets = rng.normal(0.0, JITTER, SCALAR_HITS)
+    lanes = rng.integers(0, 4, SCALAR_HITS)
+    recorder = ScoreRecorder()
+    offset_list, lane_list = offsets.tolist(), lanes.tolist()
+    start = time.perf_counter()
+    for lane, offset in zip(lane_list, offset_list):
+        recorder.judge_hit(lane, offset)
+    print(f"scalar: {rate(SCALAR_HITS, time.perf_counter() - start)}  ({recorder.stats.summary()})")
+
+    stats = JudgementStats(recorder.judge)
+    start = time.perf_counter()
+    stats.record_many(lanes, recorder.judge.judge_many(offsets), offsets)
+    same = (stats.tier_counts[:-1] == recorder.stats.tier_counts[:-1] and stats.histogram == recorder.stats.histogram
+            and math.isclose(stats.mean, recorder.stats.mean, abs_tol=1e-12) and math.isclose(stats.stddev(), recorder.stats.stddev(), rel_tol=1e-9))
+    print(f"batch ({SCALAR_HITS:,} hits) matches scalar statistics: {same}")
+    ok &= same
+
+    offsets = rng.normal(0.0, JITTER, BATCH_HITS)
+    lanes = rng.integers(0, 4, BATCH_HITS)
+    stats = JudgementStats(recorder.judge)
+    start = time.perf_counter()
+    stats.record_many(lanes, recorder.judge.judge_many(offsets), offsets)
+    print(f"batch: {rate(BATCH_HITS, time.perf_counter() - start)}  (statistics in {len(stats.histogram) + len(stats.tier_counts) + 2 * len(stats.lane_counts) + 3} numbers)")
+
+    judge = Judge()
+    targets, hits = make_lane(rng, CHECK_ARROWS)
+    same = np.array_equal(judge.match_hits(targets, hits)[0], match_reference(judge, targets, hits))
+    print(f"match_hits() on {len(hits):,} presses matches the engine rule: {same}")
+    ok &= same
+
+    elapsed, judged = 0.0, 0
+    stats = JudgementStats(judge)
+    for lane in range(4):
+        targets, hits = make_lane(rng, LANE_ARROWS)
+        start = time.perf_counter()
+        matched, offsets = judge.match_hits(targets, hits)
+        offsets = offsets[matched >= 0] # stray presses are not judged
+        missed = len(targets) - len(offsets) # arrows nobody took
+        tiers = np.concatenate((judge.judge_many(offsets), np.full(missed, judge.miss)))
+        stats.record_many(np.full(len(tiers), lane), tiers, np.concatenate((offsets, np.full(missed, np.nan))))
+        elapsed += time.perf_counter() - start
+        judged += len(hits)
+    print(f"lanes: {rate(judged, elapsed)}  ({stats.summary()})")
+
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
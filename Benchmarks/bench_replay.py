@@ -0,0 +1,105 @@
+"""Cost of recording replays, exactness of the replays, and speed of re-scoring them.
+
+Sessions of random arrows are played headless by a jittery autoplayer (early
+and late timestamped hits, stray presses, BPM and speed changes) with uneven
+frame times, recorded with a ReplayWriter. The benchmark reports the recording
+cost per frame, checks that every replay ends with the live scores (of the same
+type) and judgements, then re-scores all the replays in one process and across
+the CPU cores with GameEngine.replay.rescore_many().
+
+Run from the repository root: python -m Benchmarks.bench_replay --replays 2000"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from pathlib import Path
+from GameEngine.game_engine import GameEngine, GameInput, ManualClock
+from GameEngine.chart_stream import ChartScheduler, random_notes
+from GameEngine.replay import ReplayWriter, rescore, rescore_many
+
+FRAME_TIME = 1 / 60
+JITTER = 0.015 # seconds, standard deviation of the hits around their arrow
+BPM_RANGE = (60, 240) # the random BPM changes stay within
+
+
+def play_session(seed: int, duration: float, path: Path = None) -> tuple[GameEngine, float, int]:
+    """Plays 'duration' seconds, recorded into 'path' if given. Returns the engine, the seconds spent stepping it and the frames."""
+    rng = np.random.default_rng(seed)
+    engine = GameEngine(ManualClock(1000.0 + seed))
+    engine.chart_scheduler = ChartScheduler(random_notes(np.random.RandomState(seed)))
+    if path is not None:
+        engine.recorder = ReplayWriter(path, seed)
+    engine.start()
+    step_time = 0.0
+    frames = 0
+    while engine.time - engine.start_time < duration:
+        dt = FRAME_TIME * rng.uniform(0.8, 1.5) # frames are late now and then
+        frame_time = engine.time + dt
+        inputs = []
+        for dir_index, lane in enumerate(engine.arrows):
+            index = lane.peek()
+            if index is not None:
+                target_time = engine.tempo_map.beat_to_time(lane.times[index])
+                if target_time <= frame_time + 2 * JITTER:
+                    inputs.append(GameInput("hit", dir_index, time=target_time + rng.normal(0.0, JITTER)))
+        if rng.random() < 0.02:
+            inputs.append(GameInput("hit", int(rng.integers(4)), time=frame_time)) # stray press
+        if rng.random() < 0.002:
+            inputs.append(GameInput("spawn", int(rng.integers(4)), 1))
+        if rng.random() < 0.001:
+            steps = [step for step in (-20, 20) if BPM_RANGE[0] <= engine.BPM + step <= BPM_RANGE[1]]
+            inputs.append(GameInput("bpm", value=float(rng.choice(steps))))
+        if rng.random() < 0.001:
+            inputs.append(GameInput("speed", value=float(rng.choice((0.9, 1.1)))))
+        start = time.perf_counter()
+        engine.step(dt, inputs)
+        step_time += time.perf_counter() - start
+        frames += 1
+    if engine.recorder is not None:
+        engine.recorder.close()
+    return engine, step_time, frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recording and re-scoring benchmark")
+    parser.add_argument("--replays", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds of play per replay")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [Path(directory) / f"session{seed}.smr" for seed in range(args.replays)]
+        ok = True
+        checked = min(10, args.replays)
+        recorded_time = plain_time = 0.0
+        records = checked_frames = 0
+        for seed, path in enumerate(paths):
+            engine, step_time, frames = play_session(seed, args.duration, path)
+            records += engine.recorder.records
+            if seed < checked: # the recording cost, against the same sessions unrecorded
+                recorded_time += step_time
+                checked_frames += frames
+                plain_time += play_session(seed, args.duration)[1]
+                result = rescore(path)
+                same = (repr(result["score"]) == repr(engine.score_recorder.score) and repr(result["score_p2"]) == repr(engine.score_recorder_p2.score)
+                        and list(result["tier_counts"].values()) == engine.score_recorder.stats.tier_counts)
+                ok &= same
+                if not same:
+                    print(f"Replay {path.name} differs: {result['score']!r}, {result['score_p2']!r} vs {engine.score_recorder.score!r}, {engine.score_recorder_p2.score!r}")
+        size = sum(path.stat().st_size for path in paths)
+        print(f"Recorded {args.replays} sessions of {args.duration:.0f} s: {records} records, {size / args.replays / 1024:.1f} KiB per replay")
+        print(f"Engine step {plain_time / checked_frames * 1e6:.1f} us/frame, {recorded_time / checked_frames * 1e6:.1f} us/frame when recording"
+              f" ({(recorded_time - plain_time) / checked_frames * 1e6:+.2f} us)")
+        print(f"{checked} replays end with the live score and judgements: {ok}")
+
+        played = args.replays * args.duration
+        for processes in sorted({1, args.processes}):
+            start = time.perf_counter()
+            results = rescore_many(paths, processes=processes)
+            elapsed = time.perf_counter() - start
+            print(f"Re-scored {len(results)} replays on {processes} process(es) in {elapsed:.2f} s: {played / elapsed:,.0f}x realtime, {len(results) / elapsed:.1f} replays/s")
+
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,41 @@
+"""Startup time of the game sounds, decoded one by one or through the SoundBank.
+
+- direct: pygame.mixer.Sound() of every asset in turn, as the game did
+- bank, cold: SoundBank.preload() in the thread pool, decoding and filling the PCM cache
+- bank, warm: a new SoundBank reading the PCM cache of the previous launch
+- startup wait: how long preload() blocks the caller, the rest overlaps the image loading
+
+The harness is in Benchmarks.asset_startup, and the cached samples are checked
+against a direct decoding. Run it on the Pi, from the repository root:
+python -m Benchmarks.bench_sound_startup"""
+import argparse
+import sys
+import pygame
+from pathlib import Path
+from GameAudio.sound_bank import SoundBank, SOUND_WORKERS
+from Benchmarks.asset_startup import REPEATS, require_assets, run_startup
+
+SOUND_FILES = ["GameplayAssist clap.ogg", "Tic.ogg", "Tac.ogg"] + [f"piano/jobro__piano-ff-{i:03}.ogg" for i in (28, 35, 40, 44, 47, 52, 56, 59, 64)] # as stepmania.py
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sound loading startup benchmark")
+    parser.add_argument("--resources", type=Path, default=Path("./Resources/"), help="directory of the game assets")
+    parser.add_argument("--workers", type=int, default=SOUND_WORKERS)
+    args = parser.parse_args()
+    paths = [(args.resources / name).absolute() for name in SOUND_FILES]
+    require_assets(paths, "sound")
+    pygame.mixer.init()
+    print(f"{len(paths)} sounds, mixer {pygame.mixer.get_init()}, {args.workers} decoding threads, median of {REPEATS}")
+
+    def check(bank: SoundBank) -> bool:
+        same = all(bank.get(path).get_raw() == pygame.mixer.Sound(path).get_raw() for path in paths)
+        print(f"Cached samples identical to a direct decoding: {same} ({bank.cache_hits} read from the cache)")
+        return same
+
+    same = run_startup(lambda: [pygame.mixer.Sound(path) for path in paths],
+                       lambda cache_dir: SoundBank(cache_dir, args.workers),
+                       lambda bank: bank.preload(paths),
+                       lambda bank: [bank.get(path) for path in paths],
+                       check)
+    sys.exit(0 if same else 1)
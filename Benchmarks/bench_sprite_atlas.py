@@ -0,0 +1,56 @@
+"""Benchmark of arrow spawning and blitting with and without the SpriteAtlas.
+
+Spawn rate: rotating the arrow image on every spawn (the old Arrow.__init__)
+against adding a row to the ArrowStore and looking the sprite up in the atlas.
+Blit rate: blitting the loaded image as is against the display-converted atlas sprite.
+
+Run from the repository root: python -m Benchmarks.bench_sprite_atlas
+(set SDL_VIDEODRIVER=dummy to run without a screen)"""
+import time
+import pygame
+from pathlib import Path
+from GameEngine.game_engine import GameEngine
+from GameEngine.constants import ARROW_SIZE, WIDTH, HEIGHT, COLORS, COLOR_IDS
+from GameRendering.sprite_atlas import SpriteAtlas, ROTATIONS
+
+RESOURCE_PATH = Path("./Resources/").absolute()
+SPAWNS = 20_000
+BLITS = 20_000
+
+
+def rate(count: int, seconds: float) -> str:
+    return f"{count / seconds:>12,.0f}/s"
+
+def bench_spawn_rotate(img: pygame.Surface) -> float:
+    t0 = time.perf_counter()
+    for i in range(SPAWNS):
+        arrow_img = pygame.transform.rotate(img, ROTATIONS[i % 4])
+    return time.perf_counter() - t0
+
+def bench_spawn_atlas(atlas: SpriteAtlas) -> float:
+    engine = GameEngine()
+    color_id = COLOR_IDS["red"]
+    t0 = time.perf_counter()
+    for i in range(SPAWNS):
+        engine.spawn_arrow(("left", "down", "up", "right")[i % 4], "red", i * 1e-3)
+        arrow_img = atlas.arrow(color_id, i % 4)
+    return time.perf_counter() - t0
+
+def bench_blit(screen: pygame.Surface, img: pygame.Surface) -> float:
+    t0 = time.perf_counter()
+    for i in range(BLITS):
+        screen.blit(img, (100 * (1 + i % 4), i % (HEIGHT - ARROW_SIZE)))
+    return time.perf_counter() - t0
+
+
+if __name__ == "__main__":
+    pygame.init()
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    img = pygame.transform.scale(pygame.image.load(RESOURCE_PATH / "ArrowRed.png"), (ARROW_SIZE, ARROW_SIZE))
+    atlas = SpriteAtlas({color: img for color in COLORS}, img, img)
+
+    print(f"spawn, rotate per arrow: {rate(SPAWNS, bench_spawn_rotate(img))}")
+    print(f"spawn, atlas lookup:     {rate(SPAWNS, bench_spawn_atlas(atlas))}")
+    print(f"blit, loaded image:      {rate(BLITS, bench_blit(screen, pygame.transform.rotate(img, 90)))}")
+    print(f"blit, atlas sprite:      {rate(BLITS, bench_blit(screen, atlas.arrow(COLOR_IDS['red'], 1)))}")
+    pygame.quit()
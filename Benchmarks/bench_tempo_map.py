@@ -0,0 +1,76 @@
+"""Benchmark of TempoMap lookups for maps with many BPM changes and stops.
+
+Scalar lookups (one bisect) are compared with walking the segments from the
+start of the song, and the vectorized lookups are timed on a batch of beats.
+
+Run from the repository root: python -m Benchmarks.bench_tempo_map"""
+import time
+import numpy as np
+from GameEngine.tempo_map import TempoMap
+
+SEGMENT_COUNTS = (10, 1_000, 10_000)
+LOOKUPS = 20_000
+BATCH = 10_000
+BATCH_REPEATS = 100
+
+
+def random_tempo(segment_count: int, rng: np.random.Generator) -> tuple[list, list]:
+    """BPM changes every few beats, one stop for every four changes"""
+    change_beats = np.cumsum(rng.uniform(0.5, 8, segment_count))
+    bpms = [(0.0, 120.0)] + list(zip(change_beats.tolist(), rng.uniform(60, 300, segment_count).tolist()))
+    stop_beats = rng.choice(change_beats, segment_count // 4, replace=False)
+    stops = list(zip(stop_beats.tolist(), rng.uniform(0.05, 1, len(stop_beats)).tolist()))
+    return bpms, stops
+
+def walk_beat_to_time(bpms: list, beat: float) -> float:
+    """Beat to time without the precomputed tables, walking every BPM change before 'beat' (no stops)"""
+    time = 0.0
+    for (start, bpm), (end, _) in zip(bpms, bpms[1:] + [(np.inf, 0)]):
+        if beat <= end:
+            return time + (beat - start) * 60 / bpm
+        time += (end - start) * 60 / bpm
+    return time
+
+def rate(count: int, seconds: float) -> str:
+    return f"{count / seconds:>14,.0f}/s"
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    print(f"{'segments':>8} {'beat_to_time':>16} {'time_to_beat':>16} {'walk':>16} {'beats_to_times':>16} {'times_to_beats':>16}")
+    for count in SEGMENT_COUNTS:
+        bpms, stops = random_tempo(count, rng)
+        tempo_map = TempoMap(bpms, stops)
+        last_beat = tempo_map.beats[-1]
+        beats = rng.uniform(0, last_beat, LOOKUPS).tolist()
+        times = [tempo_map.beat_to_time(beat) for beat in beats]
+
+        t0 = time.perf_counter()
+        for beat in beats:
+            tempo_map.beat_to_time(beat)
+        beat_to_time = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for t in times:
+            tempo_map.time_to_beat(t)
+        time_to_beat = time.perf_counter() - t0
+
+        walk_count = max(LOOKUPS * 10 // count, 10)
+        t0 = time.perf_counter()
+        for beat in beats[:walk_count]:
+            walk_beat_to_time(bpms, beat)
+        walk = time.perf_counter() - t0
+
+        beat_batch = rng.uniform(0, last_beat, BATCH)
+        time_batch = tempo_map.beats_to_times(beat_batch)
+        t0 = time.perf_counter()
+        for _ in range(BATCH_REPEATS):
+            tempo_map.beats_to_times(beat_batch)
+        beats_to_times = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for _ in range(BATCH_REPEATS):
+            tempo_map.times_to_beats(time_batch)
+        times_to_beats = time.perf_counter() - t0
+
+        print(f"{len(tempo_map):>8} {rate(LOOKUPS, beat_to_time)} {rate(LOOKUPS, time_to_beat)} {rate(walk_count, walk)}"
+              f" {rate(BATCH * BATCH_REPEATS, beats_to_times)} {rate(BATCH * BATCH_REPEATS, times_to_beats)}")
@@ -0,0 +1,94 @@
+"""Checks the ClockSyncEstimator against simulated drifting controller clocks.
+
+A simulated ESP32 clock has an offset and a drift of a few tens of ppm, and
+each ping crosses a link with random one-way delays and occasional retries
+(tens of milliseconds in one direction only). After each ping the device-to-host
+conversion is compared with the true one over the next second of presses, and
+the check fails if the 99th percentile error is above 2 ms.
+
+A ClockSyncService then pings a loopback.ControllerEmulator through a
+LoopbackTransport, which rejects writes the characteristic's properties do not
+allow. The check fails if pings are rejected or too few PONGs come back.
+
+Run from the repository root: python -m Benchmarks.check_clock_sync"""
+import asyncio
+import sys
+import threading
+import time
+import numpy as np
+from types import SimpleNamespace
+from BluetoothImplementation.clock_sync import ClockSyncEstimator, ClockSyncService, PING_INTERVAL
+from BluetoothImplementation.loopback import PLAYER1_RX_UUID, PLAYER1_TX_UUID, ControllerEmulator, LoopbackTransport
+
+PINGS = 600
+MAX_P99_ERROR = 2e-3 # seconds, a fraction of a frame and of the BLE connection interval, once the estimator has a full window
+SCENARIOS = { # name: (offset s, drift ppm, mean one-way delay s, retry probability)
+    "steady link": (123.4, 20, 0.004, 0.0),
+    "fast drift": (-50.0, -80, 0.004, 0.0),
+    "busy link": (7.0, 40, 0.008, 0.2),
+}
+LOOPBACK_PING_INTERVAL = 0.02 # seconds, faster than the game to keep the check short
+LOOPBACK_DURATION = 1.0
+MIN_PONG_RATIO = 0.9 # PONGs received per ping sent
+
+
+class SimulatedDevice:
+    """Device clock: device_time = (host_time - offset) / (1 + drift)"""
+
+    def __init__(self, offset: float, drift_ppm: float):
+        self.offset = offset
+        self.rate = 1 + drift_ppm * 1e-6
+
+    def device_time(self, host_time: float) -> float:
+        return (host_time - self.offset) / self.rate
+
+    def host_time(self, device_time: float) -> float:
+        return device_time * self.rate + self.offset
+
+def run(offset: float, drift_ppm: float, delay: float, retry_p: float, rng: np.random.Generator) -> tuple[np.ndarray, float]:
+    """Returns (conversion errors after warmup, estimated drift in ppm)"""
+    device = SimulatedDevice(offset, drift_ppm)
+    estimator = ClockSyncEstimator()
+    errors = []
+    for i in range(PINGS):
+        send_time = 1000.0 + i * PING_INTERVAL
+        up = rng.exponential(delay) + (rng.uniform(0.01, 0.06) if rng.random() < retry_p else 0)
+        down = rng.exponential(delay) + (rng.uniform(0.01, 0.06) if rng.random() < retry_p else 0)
+        estimator.add_sample(send_time, device.device_time(send_time + up), send_time + up + down)
+        if i >= estimator.samples.maxlen:
+            press_device_times = device.device_time(send_time + rng.uniform(0, 1, 16))
+            errors += [abs(estimator.device_to_host(t) - device.host_time(t)) for t in press_device_times]
+    return np.array(errors), estimator.drift_ppm()
+
+def run_loopback(drift_ppm: float) -> tuple[int, int, int]:
+    """Pings an emulated controller for LOOPBACK_DURATION, returns (pings sent, PONGs, pings rejected)"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    transport = LoopbackTransport(ControllerEmulator(drift_ppm))
+    client = SimpleNamespace(client=transport, loop=loop, CHARACTERISTIC_UUID_TX=PLAYER1_RX_UUID, recv_message_callback=None)
+    service = ClockSyncService(client, LOOPBACK_PING_INTERVAL)
+    asyncio.run_coroutine_threadsafe(transport.connect(), loop).result()
+    asyncio.run_coroutine_threadsafe(transport.start_notify(PLAYER1_TX_UUID, lambda _, data: client.recv_message_callback(data)), loop).result()
+    service.start()
+    time.sleep(LOOPBACK_DURATION)
+    service.stop()
+    asyncio.run_coroutine_threadsafe(transport.disconnect(), loop).result()
+    asyncio.run_coroutine_threadsafe(asyncio.sleep(0), loop).result() # lets the cancelled tasks finish
+    loop.call_soon_threadsafe(loop.stop)
+    return service.sequence, len(service.estimator.samples), transport.rejected_writes
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    ok = True
+    for name, (offset, drift_ppm, delay, retry_p) in SCENARIOS.items():
+        errors, estimated_drift = run(offset, drift_ppm, delay, retry_p, rng)
+        p99 = np.percentile(errors, 99)
+        print(f"{name:>12}: drift {drift_ppm:+} ppm estimated {estimated_drift:+.1f} ppm,"
+              f" conversion error mean {errors.mean()*1e3:.3f} ms, p99 {p99*1e3:.3f} ms, max {errors.max()*1e3:.3f} ms")
+        ok &= p99 <= MAX_P99_ERROR
+    pings, pongs, rejected = run_loopback(SCENARIOS["steady link"][1])
+    print(f"{'loopback':>12}: {pings} pings, {pongs} PONGs, {rejected} rejected by the controller")
+    ok &= rejected == 0 and pongs >= MIN_PONG_RATIO * pings
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,86 @@
+"""Checks with tracemalloc that steady-state engine steps do not allocate per frame.
+
+Engine step only: a frame here is GameEngine.step() and the visible_* masks.
+The render path is not covered and still allocates every frame, in proportion
+to the arrows on screen: Arrow.draw_store() and MeasureLine.draw_store() build
+the blit list from .tolist() of the on-screen columns, and pygame returns a
+Rect per blit.
+
+The same block of arrows is spawned every measure and missed, so arrows are
+created and recycled at a steady rate, while a preloaded chart far in the
+future makes the store large. Tracing starts before the engine is built, so a
+resized buffer stays one block. The check fails if:
+
+- the engine's block count drifts from its start by more than MAX_BLOCK_DRIFT
+  at the end of any window of FRAMES frames. The engine replaces its Python
+  numbers (time, beat, scores, counters) and the last frame's GameEvents rather
+  than mutating them, so the count moves by a few blocks either way, but a leak
+  of one block every few hundred frames shows up
+- a quiet frame (no event, no expiry) briefly allocates more than
+  RESIDUAL_BYTES, or a different amount with more arrows. The NumPy passes
+  allocate nothing, what is left is interpreter bookkeeping: the iterator of
+  the lane loop in GameEngine.step() and, inside it, the int of len() on a lane
+  longer than 256 entries (CPython caches the smaller ones), one lane at a time
+
+Run from the repository root: python -m Benchmarks.check_frame_allocations"""
+import sys
+import tracemalloc
+from GameEngine.game_engine import GameEngine, FIXED_DT
+from GameEngine.constants import DIR_DICT
+
+WARMUP_FRAMES = 300
+FRAMES = 3000
+WINDOWS = 3
+MAX_BLOCK_DRIFT = 16 # replaced Python numbers and GameEvents, see above
+RESIDUAL_BYTES = sys.getsizeof(iter(())) + sys.getsizeof(2**20) # a loop iterator and a large int, 48 + 28 B on CPython 3.11
+STEADY_BLOCK = [(True, False, False, False), (False, True, False, False), (False, False, True, False), (False, False, False, True)]
+ENGINE_FILTER = tracemalloc.Filter(True, "*GameEngine*")
+
+
+def make_engine(arrow_count: int) -> GameEngine:
+    engine = GameEngine()
+    engine.do_measure = lambda: engine.arrow_block_queue.append(STEADY_BLOCK)
+    engine.start()
+    for i in range(arrow_count):
+        engine.spawn_arrow(DIR_DICT[i % 4], "red", 1e6 + i * 0.05)
+    return engine
+
+def play_frame(engine: GameEngine):
+    engine.step(FIXED_DT)
+    engine.visible_arrows()
+    engine.visible_measure_lines()
+
+def engine_blocks() -> int:
+    return sum(stat.count for stat in tracemalloc.take_snapshot().filter_traces([ENGINE_FILTER]).statistics("filename"))
+
+def measure(arrow_count: int) -> tuple[list[int], int]:
+    """Returns (engine block drift at the end of each window, max transient bytes of a quiet frame)"""
+    tracemalloc.start()
+    engine = make_engine(arrow_count)
+    for _ in range(WARMUP_FRAMES):
+        play_frame(engine)
+    start_blocks = engine_blocks()
+    drifts = []
+    max_frame_bytes = 0
+    for _ in range(WINDOWS):
+        for _ in range(FRAMES):
+            measure_lines = len(engine.measure_line_store)
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak() # after reading 'current', the tuple of the reading is not counted
+            play_frame(engine)
+            after, peak = tracemalloc.get_traced_memory()
+            if not engine.events and len(engine.measure_line_store) == measure_lines: # GameEvents and the expired list allocate
+                max_frame_bytes = max(max_frame_bytes, peak - max(current, after))
+        drifts.append(engine_blocks() - start_blocks)
+    tracemalloc.stop()
+    return drifts, max_frame_bytes
+
+
+if __name__ == "__main__":
+    results = {count: measure(count) for count in (1_000, 40_000)}
+    ok = len({max_frame_bytes for _, max_frame_bytes in results.values()}) == 1 # independent of the number of arrows
+    for count, (drifts, max_frame_bytes) in results.items():
+        print(f"{count:>6} arrows: engine block drift {drifts} after each {FRAMES} frames, quiet frames allocated at most {max_frame_bytes} B (residual {RESIDUAL_BYTES} B)")
+        ok &= max(map(abs, drifts)) <= MAX_BLOCK_DRIFT and max_frame_bytes <= RESIDUAL_BYTES
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,62 @@
+"""Measures the judgement error of hits with and without input timestamps.
+
+Synthetic presses happen at known times around each arrow's target time, then
+are delivered at the end of the 60 FPS frame they happened in, like inputs
+read once per frame. With timestamps the engine must judge every press at its
+exact time; without them a press is judged up to one frame late, and late
+presses near the edge of the hit window turn into misses.
+
+Run from the repository root: python -m Benchmarks.check_input_timing"""
+import sys
+import numpy as np
+from GameEngine.game_engine import GameEngine, GameInput, ManualClock, FIXED_DT
+from GameEngine.chart_stream import ChartScheduler, random_notes
+
+DURATION = 600 # seconds of play
+MAX_PRESS_OFFSET = 0.09 # presses are uniformly spread this far around the target time
+MAX_TIMESTAMPED_ERROR = 1e-9
+
+
+def play(timestamped: bool) -> tuple[np.ndarray, int, int]:
+    """Returns (judgement errors of the hits, hits, presses)"""
+    engine = GameEngine(ManualClock())
+    engine.chart_scheduler = ChartScheduler(random_notes(np.random.RandomState(0)))
+    engine.start()
+    rng = np.random.default_rng(1)
+    press_times: dict[tuple[int, float], float] = {} # (slot, target beat) -> planned press time
+    errors = []
+    presses = 0
+    while engine.time < DURATION:
+        frame_end = engine.time + FIXED_DT
+        inputs = []
+        pressed = {}
+        for dir_index, lane in enumerate(engine.arrows):
+            index = lane.peek()
+            if index is None:
+                continue
+            key = (lane.items[index], lane.times[index])
+            if key not in press_times:
+                press_times[key] = engine.tempo_map.beat_to_time(lane.times[index]) + rng.uniform(-MAX_PRESS_OFFSET, MAX_PRESS_OFFSET)
+            press_time = press_times[key]
+            if press_time is not None and press_time <= frame_end:
+                inputs.append(GameInput("hit", dir_index, time=press_time if timestamped else None))
+                pressed[dir_index] = press_time
+                press_times[key] = None # pressed once
+                presses += 1
+        for event in engine.step(FIXED_DT, inputs):
+            if event.kind == "hit":
+                errors.append(event.time - pressed[event.dir_index])
+    return np.array(errors), len(errors), presses
+
+
+if __name__ == "__main__":
+    ok = True
+    for timestamped in (False, True):
+        errors, hits, presses = play(timestamped)
+        errors_ms = np.abs(errors) * 1e3
+        print(f"{'timestamped' if timestamped else 'frame time':>12}: {hits}/{presses} presses hit,"
+              f" judgement error mean {errors_ms.mean():.3f} ms, max {errors_ms.max():.3f} ms")
+        if timestamped:
+            ok = hits == presses and errors_ms.max() <= MAX_TIMESTAMPED_ERROR * 1e3
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,131 @@
+"""Load test of the controller input path with emulated controllers.
+
+Every virtual controller is a loopback.ControllerEmulator connected through a
+LoopbackTransport to a BluetoothClient, all on one BluetoothManager, with clock
+sync running as in the game. Each controller presses a random lane at random
+times (Poisson, --rate per second). The received frames are decoded as in
+stepmania.py and the hits are judged by a GameEngine stepped at --fps.
+
+Reported per controller count: presses, hits judged, records lost (as counted
+by the decoders), notifications dropped by the links (PONGs included), and the
+latency percentiles from the press to the receiving callback (link) and from
+the callback to the judgement.
+
+Run from the repository root: python -m Benchmarks.load_controllers --controllers 1 16 64 --rate 8"""
+import argparse
+import asyncio
+import struct
+import time
+import numpy as np
+from collections import deque
+from BluetoothImplementation.bluetooth_definition import BluetoothClient, BluetoothManager, wait_connected
+from BluetoothImplementation.clock_sync import ClockSyncService
+from BluetoothImplementation.loopback import ControllerEmulator, LoopbackNetwork
+from BluetoothImplementation.wire_codec import FrameDecoder, MSG_HIT
+from GameEngine.game_engine import GameEngine, GameInput, PerfCounterClock
+from stepmania import device_time_to_engine
+
+CONNECT_TIMEOUT = 10.0
+SYNC_TIMEOUT = 5.0
+
+
+class VirtualPlayer:
+    """Host side of one emulated controller, as stepmania.py handles player 1"""
+
+    def __init__(self, address: str, network: LoopbackNetwork, manager: BluetoothManager, pending: deque):
+        self.emulator = network.add_controller(address, ControllerEmulator())
+        self.client = BluetoothClient(address, DEBUG=False, transport_factory=network.transport)
+        self.client.recv_message_callback = self._recv_message_callback
+        self.clock_sync = ClockSyncService(self.client)
+        self.decoder = FrameDecoder()
+        self.pending = pending # (input, callback time) for the game loop
+        self.link_latencies: list[float] = [] # press -> callback, seconds
+        manager.add(self.client)
+
+    def _recv_message_callback(self, data: bytearray):
+        receipt_time = time.perf_counter()
+        try:
+            records = self.decoder.decode(data)
+        except (ValueError, struct.error) as e:
+            print(f"Error parsing frame: {e}")
+            return
+        for record in records:
+            if record.message_type == MSG_HIT:
+                press_time = self.emulator.boot_time + record.time_us * 1e-6 # the emulator has no drift
+                self.link_latencies.append(receipt_time - press_time)
+                hit_time = device_time_to_engine(self.clock_sync, record.time_us, receipt_time, wrapped=True)
+                self.pending.append((GameInput("hit", record.lane, time=hit_time), receipt_time))
+
+
+async def press_randomly(emulator: ControllerEmulator, rate: float, stop_time: float, rng: np.random.Generator):
+    """Presses a random lane at Poisson times until 'stop_time'"""
+    while True:
+        await asyncio.sleep(rng.exponential(1 / rate))
+        if time.perf_counter() >= stop_time:
+            return
+        emulator.press((int(rng.integers(4)),))
+
+def percentiles_ms(values) -> str:
+    if len(values) == 0:
+        return "no samples"
+    p50, p99, p999 = np.percentile(np.asarray(values) * 1e3, [50, 99, 99.9])
+    return f"p50 {p50:6.2f} ms, p99 {p99:6.2f} ms, p99.9 {p999:6.2f} ms, max {max(values) * 1e3:6.2f} ms"
+
+def run(controller_count: int, rate: float, duration: float, fps: float, seed: int = 0):
+    manager = BluetoothManager(cache_path=None, DEBUG=False)
+    network = LoopbackNetwork()
+    pending: deque[tuple[GameInput, float]] = deque()
+    players = [VirtualPlayer(f"00:00:00:00:{i // 256:02X}:{i % 256:02X}", network, manager, pending) for i in range(controller_count)]
+    if not wait_connected([player.client for player in players], CONNECT_TIMEOUT):
+        print(f"{controller_count} controllers: not all connected after {CONNECT_TIMEOUT} s")
+        manager.stop()
+        return
+    for player in players:
+        player.clock_sync.start()
+    deadline = time.perf_counter() + SYNC_TIMEOUT
+    while not all(player.clock_sync.estimator.ready() for player in players) and time.perf_counter() < deadline:
+        time.sleep(0.01)
+
+    engine = GameEngine(PerfCounterClock())
+    engine.start()
+    stop_time = time.perf_counter() + duration
+    rngs = np.random.default_rng(seed).spawn(controller_count)
+    presses = [asyncio.run_coroutine_threadsafe(press_randomly(player.emulator, rate, stop_time, rng), manager.loop) for player, rng in zip(players, rngs)]
+    judgement_latencies: list[float] = []
+    frame_time = time.perf_counter()
+    while time.perf_counter() < stop_time + 0.1 or pending: # drain the link after the last presses
+        inputs, receipt_times = [], []
+        while pending:
+            game_input, receipt_time = pending.popleft()
+            inputs.append(game_input)
+            receipt_times.append(receipt_time)
+        engine.update(inputs)
+        judged_time = time.perf_counter()
+        judgement_latencies += [judged_time - receipt_time for receipt_time in receipt_times]
+        frame_time += 1 / fps
+        time.sleep(max(0.0, frame_time - time.perf_counter()))
+        if time.perf_counter() > stop_time + 2:
+            break
+    for press in presses:
+        press.result()
+
+    pressed = sum(player.emulator.encoder.sequence for player in players)
+    received = sum(player.decoder.received for player in players)
+    lost = sum(player.decoder.lost for player in players)
+    _, dropped = network.dropped()
+    print(f"{controller_count} controllers x {rate:g} presses/s for {duration:g} s: {pressed} presses, {len(judgement_latencies)} judged,"
+          f" {received} received, {lost} lost, {dropped} notifications dropped")
+    print(f"  press -> callback     {percentiles_ms([l for player in players for l in player.link_latencies])}")
+    print(f"  callback -> judgement {percentiles_ms(judgement_latencies)}")
+    manager.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of the input path with emulated controllers")
+    parser.add_argument("--controllers", type=int, nargs="+", default=[1, 16, 64], help="numbers of virtual controllers to run")
+    parser.add_argument("--rate", type=float, default=8.0, help="presses per second per controller")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds of pressing per run")
+    parser.add_argument("--fps", type=float, default=60.0, help="game loop frequency")
+    args = parser.parse_args()
+    for controller_count in args.controllers:
+        run(controller_count, args.rate, args.duration, args.fps)
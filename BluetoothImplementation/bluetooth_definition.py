@@ -1,14 +1,17 @@
-import bluetooth
 import asyncio
-from bleak import BleakClient, BleakError, BleakGATTCharacteristic
+from bleak import BleakClient, BleakError, BleakGATTCharacteristic, BleakScanner
 import time
+import json
+import re
 import threading
-from uuid import uuid4
-import array
-import struct
-from typing import Callable, Optional
+from pathlib import Path
+from typing import Callable, Literal, Optional
+from BluetoothImplementation.client_manager import ClientManager, reconnect_delay, wait_connected
 
-background_tasks = set()
+SERVICE_UUID = "19b10000-e8f2-537e-4f6c-d104768a1214" # advertised by the controllers
+ADDRESS_CACHE_PATH = Path("./.bluetooth_cache.json").absolute() # address -> name of the controllers found before
+CACHED_ADDRESS_ATTEMPTS = 3 # failed connections to a cached address before scanning for the name again
+MAC_ADDRESS_PATTERN = re.compile(r"^([0-9A-Fa-f]{2}:){5}[0-9A-Fa-f]{2}$")
 class BluetoothDeviceFinder:
     """Class to find the bluetooth device"""
 
@@ -16,12 +19,41 @@ class BluetoothDeviceFinder:
         pass
 
     def browse_devices(self):
+        import bluetooth # classic discovery only, the game scans with BLE
         return bluetooth.discover_devices(
             duration=8, lookup_names=True, flush_cache=True, lookup_class=False)
 
+def load_address_cache(path: Path = ADDRESS_CACHE_PATH) -> dict[str, str]:
+    """address -> name of the controllers found by previous launches"""
+    try:
+        with open(path) as f:
+            return dict(json.load(f))
+    except (OSError, ValueError):
+        return {}
+
+def save_address_cache(cache: dict[str, str], path: Path = ADDRESS_CACHE_PATH):
+    try:
+        with open(path, "w") as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+    except OSError as e:
+        print(f"Could not save the bluetooth address cache: {e}")
+
+def is_mac_address(device: str) -> bool:
+    return MAC_ADDRESS_PATTERN.match(device) is not None
+
+
 class BluetoothClient:
-    def __init__(self, device_mac_address: str, DEBUG: bool = True):
+    def __init__(self, device_mac_address: Optional[str] = None, DEBUG: bool = True, name: Optional[str] = None,
+                 on_connected: Optional[Callable[["BluetoothClient"], None]] = None, transport_factory: Callable[..., BleakClient] = BleakClient):
+        """Client of the controller at 'device_mac_address', or of the one advertising 'name' if the address is None
+
+        'on_connected' is called from the event loop thread every time the controller (re)connects.
+        'transport_factory' makes the BleakClient of each connection, e.g. loopback.LoopbackNetwork.transport to run without hardware."""
         self.device_mac_address = device_mac_address
+        self.name = name
+        self.on_connected = on_connected
+        self.transport_factory = transport_factory
+        self.manager: Optional["BluetoothManager"] = None
         self.client = None
         self.CHARACTERISTIC_UUID_RX = "19B10001-E8F2-537E-4F6C-D104768A1214" # TX of ESP32
         self.CHARACTERISTIC_UUID_TX = "19B10002-E8F2-537E-4F6C-D104768A1214" # RX of ESP32
@@ -29,39 +61,100 @@ class BluetoothClient:
         self.recv_message_callback: Optional[Callable[[bytearray], None]] = None # Callback function to receive data
 
         # Background task handling
-        self.loop = None # Separate event loop for Bluetooth
-        self.thread = None
+        self.loop = None # Event loop of the BluetoothManager running this client
+        self.state: Literal["idle", "connecting", "connected", "backoff", "stopped"] = "idle"
+        self.attempt = 0 # failed connection attempts since the last connection
+        self.disconnected: Optional[asyncio.Event] = None # set by bleak when the link drops
+        self.stopping = False
+        self.connected = threading.Event() # set while connected, for threads that need to wait
+
+    def is_connected(self) -> bool:
+        return self.state == "connected"
 
     async def connect(self):
-        self.client = BleakClient(self.device_mac_address)
-        # Set the callback function to receive data*
-        while True:
+        """Connects and reconnects until disconnect() is called"""
+        self.disconnected = asyncio.Event()
+        cached_address = False
+        while not self.stopping:
+            if self.device_mac_address is None:
+                self.state = "connecting"
+                try:
+                    self.device_mac_address, cached_address = await self.manager.resolve_address(self.name)
+                except asyncio.CancelledError:
+                    if self.stopping: # disconnect() called while scanning
+                        break
+                    raise
+            self.state = "connecting"
+            self.disconnected.clear()
+            self.client = self.transport_factory(self.device_mac_address, disconnected_callback=self._disconnected_callback)
             try:
                 if self.DEBUG:
                     print(f"Connecting to {self.device_mac_address}...")
                 await self.client.connect()
-                break
+                await self.client.start_notify(self.CHARACTERISTIC_UUID_RX, self._recv_message_callback)
             except Exception as e:
+                try:
+                    await self.client.disconnect() # connect() may have succeeded before start_notify() failed
+                except Exception:
+                    pass # never connected, or already gone
+                if not self.stopping:
+                    self.disconnected.clear() # set by the disconnection above, it would cut the backoff short
+                self.attempt += 1
+                delay = reconnect_delay(self.attempt)
                 if self.DEBUG:
-                    print(f"failed to connect ! {e}")            
-    
-        if self.DEBUG:
-            print(f"Connected to {self.device_mac_address}")
-        await self.client.start_notify(self.CHARACTERISTIC_UUID_RX, self._recv_message_callback)
-        try:
-            while self.client.is_connected:
-                await asyncio.sleep(1)  # Check every second
-            if self.DEBUG:
-                print("Device disconnected. Attempting to reconnect...")
-        except BleakError as e:
+                    print(f"failed to connect to {self.device_mac_address} ! {e} (retrying in {delay:.1f} s)")
+                if cached_address and self.attempt >= CACHED_ADDRESS_ATTEMPTS: # the name may have moved to another device
+                    self.manager.forget_address(self.device_mac_address)
+                    self.device_mac_address, cached_address = None, False
+                self.state = "backoff"
+                await self._wait_stopping(delay)
+                continue
+
+            self.attempt = 0
+            self.state = "connected"
+            self.connected.set()
             if self.DEBUG:
-                print(f"Error while monitoring connection: {e}")
-        finally:
-            await self.connect()  # Start reconnection attempts
+                print(f"Connected to {self.device_mac_address}")
+            if self.name is not None:
+                self.manager.remember_address(self.device_mac_address, self.name)
+            if self.on_connected:
+                try:
+                    self.on_connected(self)
+                except Exception as e:
+                    print(f"on_connected callback of {self.device_mac_address} failed: {e}")
+            await self.disconnected.wait()
+            self.connected.clear()
+            if self.DEBUG and not self.stopping:
+                print(f"{self.device_mac_address} disconnected. Attempting to reconnect...")
+        self.state = "stopped"
+
+    async def disconnect(self):
+        """Stops reconnecting and closes the connection"""
+        self.stopping = True
+        if self.disconnected is not None:
+            self.disconnected.set()
+        if self.device_mac_address is None and self.manager is not None:
+            self.manager.cancel_resolve(self.name)
+        if self.client is not None:
+            try:
+                await self.client.disconnect()
+            except BleakError as e:
+                if self.DEBUG:
+                    print(f"Error while disconnecting {self.device_mac_address}: {e}")
+
+    async def _wait_stopping(self, timeout: float):
+        """Sleeps 'timeout' seconds, less if disconnect() is called meanwhile"""
+        try:
+            await asyncio.wait_for(self.disconnected.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _disconnected_callback(self, client: BleakClient):
+        if client is self.client and self.disconnected is not None:
+            self.disconnected.set()
 
     async def async_send_message_bytes(self, message: bytearray):
         """Send a message (bytearray) to the device. Ex: b'\x00\x01\x02\x03' """
-        # THIS_UUID = uuid4()
         THIS_UUID = self.CHARACTERISTIC_UUID_TX
         await self.client.write_gatt_char(THIS_UUID, message, response=True)
         if self.DEBUG:
@@ -83,63 +176,107 @@ class BluetoothClient:
         #     encoded.extend(struct.pack('f', value))  # Convert float to bytes
         # await self.async_send_message_bytes(encoded)
 
-    async def _run(self):
-        # Run the connection process asynchronously
-        await self.connect()
-
-    def _start_loop(self):
-        """Runs an asyncio event loop in a separate thread."""
-        # Create and set the new event loop for the thread
-        self.loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(self.loop)
-        # Run the _run coroutine inside the event loop
-        self.loop.run_until_complete(self._run())
-
-    def connect_in_background(self):
-        """Starts the Bluetooth client in a background thread."""
-        self.thread = threading.Thread(target=self._start_loop, daemon=True)
-        self.thread.start()
-
-def setup_bluetooth(*ESP32_BT_NAMES: str, use_mac_addresses: bool = False, DEBUG: bool = True) -> list[BluetoothClient]:
-    """Setup the bluetooth clients and returns them.
-    
-    If use_mac_addresses = True: """
+    def connect_in_background(self, manager: "BluetoothManager" = None):
+        """Starts the Bluetooth client on the event loop of 'manager', the shared one by default."""
+        (manager or shared_manager()).add(self)
+
+
+class BluetoothManager(ClientManager):
+    """Runs the connections of any number of BluetoothClients on one event loop thread
+
+    Clients given a name instead of an address get it from the address cache,
+    or from a BLE scan for the controllers' service shared by all of them."""
+
+    def __init__(self, cache_path: Optional[Path] = ADDRESS_CACHE_PATH, DEBUG: bool = True):
+        self.cache_path = cache_path
+        self.address_cache = load_address_cache(cache_path) if cache_path is not None else {}
+        self.pending_names: dict[str, list[asyncio.Future]] = {} # names being scanned for -> futures of their address
+        self.scan_task: Optional[asyncio.Task] = None
+        super().__init__(DEBUG, thread_name="BluetoothManager")
+
+    async def resolve_address(self, name: str) -> tuple[str, bool]:
+        """(address, whether it comes from the cache) of the controller advertising 'name'"""
+        for address, cached_name in self.address_cache.items():
+            if cached_name == name:
+                return address, True
+        future = self.loop.create_future()
+        self.pending_names.setdefault(name, []).append(future)
+        if self.scan_task is None or self.scan_task.done():
+            self.scan_task = self.loop.create_task(self._scan())
+        return await future, False
+
+    def cancel_resolve(self, name: str):
+        for future in self.pending_names.pop(name, ()):
+            future.cancel()
+
+    def remember_address(self, address: str, name: str):
+        if self.address_cache.get(address) != name:
+            self.address_cache = {a: n for a, n in self.address_cache.items() if n != name}
+            self.address_cache[address] = name
+            self._save_cache()
+
+    def forget_address(self, address: str):
+        if self.address_cache.pop(address, None) is not None:
+            self._save_cache()
+
+    def _save_cache(self):
+        if self.cache_path is not None:
+            save_address_cache(self.address_cache, self.cache_path)
+
+    async def _scan(self):
+        """Scans for the controllers' service until every pending name is found"""
+        if self.DEBUG:
+            print(f"Scanning for {list(self.pending_names)}...")
+        while self.pending_names:
+            try:
+                async with BleakScanner(detection_callback=self._detection_callback, service_uuids=[SERVICE_UUID]):
+                    while self.pending_names:
+                        await asyncio.sleep(0.1)
+            except BleakError as e:
+                delay = reconnect_delay(1)
+                if self.DEBUG:
+                    print(f"Scan failed: {e} (retrying in {delay:.1f} s)")
+                await asyncio.sleep(delay)
+
+    def _detection_callback(self, device, advertisement_data):
+        name = advertisement_data.local_name or device.name
+        futures = self.pending_names.pop(name, None)
+        if futures is None:
+            return
+        if self.DEBUG:
+            print(f"Found: {device.address} - {name}")
+        self.remember_address(device.address, name)
+        for future in futures:
+            if not future.done():
+                future.set_result(device.address)
+
+_shared_manager: Optional[BluetoothManager] = None
+
+def shared_manager() -> BluetoothManager:
+    """BluetoothManager of the clients started without one"""
+    global _shared_manager
+    if _shared_manager is None:
+        _shared_manager = BluetoothManager()
+    return _shared_manager
+
+def setup_bluetooth(*ESP32_BT_NAMES: str, use_mac_addresses: bool = False, DEBUG: bool = True, manager: BluetoothManager = None,
+                    on_connected: Optional[Callable[[BluetoothClient], None]] = None, transport_factory: Callable[..., BleakClient] = BleakClient) -> list[BluetoothClient]:
+    """Setup the bluetooth clients and returns them right away, they connect concurrently in the background.
+
+    If use_mac_addresses = True: ESP32_BT_NAMES are addresses. Otherwise entries that look like
+    addresses are used as such and the others are advertised names, looked up in the address cache or
+    scanned for. 'on_connected' is called with the client each time one (re)connects. See BluetoothClient
+    for 'transport_factory'."""
     if DEBUG:
         print(f"Setting up bluetooth connections for {ESP32_BT_NAMES}")
-    mac_addresses: list[str] = []
     clients: list[BluetoothClient] = []
-
-    if use_mac_addresses:
-        mac_addresses = ESP32_BT_NAMES
-    else:
-        # Browse nearby Bluetooth clients
-        device_finder = BluetoothDeviceFinder()
-        nearby_devices = device_finder.browse_devices()
-        if DEBUG:
-            for addr, name in nearby_devices:
-                print(f"Found: {addr} - {name}")
-
-        # Find Bluetooth devices by given names
-        for esp32_bt_name in ESP32_BT_NAMES:
-            for addr, name in nearby_devices:
-                if name == esp32_bt_name:
-                    mac_addresses.append(addr)
-
-    # Setup Bluetooth connections
-    for mac_address in mac_addresses:
-        client = BluetoothClient(mac_address)
+    for device in ESP32_BT_NAMES:
+        if use_mac_addresses or is_mac_address(device):
+            client = BluetoothClient(device, DEBUG, on_connected=on_connected, transport_factory=transport_factory)
+        else:
+            client = BluetoothClient(None, DEBUG, name=device, on_connected=on_connected, transport_factory=transport_factory)
         clients.append(client)
-        client.connect_in_background()  # This will run _start_loop in a background thread
-
-    # Wait for Bluetooth connections to be established
-    waiting = True
-    while waiting:
-        waiting = False
-        for client in clients:
-            if client.client and not client.client.is_connected:
-                waiting = True
-        time.sleep(1)
-    
+        client.connect_in_background(manager)  # All the clients share the manager's event loop thread
     return clients
 
 class P1BtClient(BluetoothClient):
@@ -162,6 +299,7 @@ if __name__ == "__main__":
     # connect to a device
     client = BluetoothClient("E8:31:CD:CB:2F:EE")
     client.connect_in_background()
+    wait_connected([client])
     while True:
         client.send_message_bytes(b"Hello, ESP32!")
         time.sleep(1)
\ No newline at end of file
@@ -0,0 +1,138 @@
+"""Streams the upcoming arrow times to a controller so it can judge hits itself.
+
+The firmware takes float32 arrays [column, t1, t2, ...] on its RX characteristic
+and pushes the times (esp_timer microseconds) into the column's min-heap. The
+ChartUploader converts the arrows coming within 'lookahead' seconds to device
+time with the clock sync estimate, packs each lane's times into frames filling
+the ATT payload, and writes them without response from the client's event loop.
+Writes without response are not flow controlled by the link, so every
+'max_in_flight' frames one write is made with response, which waits for the
+controller to have taken everything sent before it."""
+import asyncio
+import struct
+import time
+import numpy as np
+from collections import deque
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from BluetoothImplementation.client_manager import ControllerClient
+    from BluetoothImplementation.clock_sync import ClockSyncService
+    from GameEngine.game_engine import GameEngine
+
+DEFAULT_MTU = 23 # BLE default, the ESP32 negotiates more
+ATT_HEADER = 3 # bytes of the MTU used by the write opcode and handle
+UPLOAD_LOOKAHEAD = 1.0 # seconds of arrows uploaded ahead of the playhead
+MAX_IN_FLIGHT = 8 # writes without response between two acknowledged writes
+MAX_LATENCY_SAMPLES = 4096
+
+
+def pack_lane_frames(column: int, times_us: "np.ndarray | list[float]", mtu: int = DEFAULT_MTU) -> list[bytes]:
+    """Packs a lane's arrow times into [column, t1, t2, ...] float32 frames of at most mtu - ATT_HEADER bytes"""
+    per_frame = (mtu - ATT_HEADER) // 4 - 1
+    if per_frame < 1:
+        raise ValueError(f"MTU {mtu} too small for a frame")
+    times = np.asarray(times_us, dtype=np.float32)
+    frames = []
+    for begin in range(0, len(times), per_frame):
+        chunk = times[begin:begin + per_frame]
+        frames.append(struct.pack("<f", column) + chunk.astype("<f4").tobytes())
+    return frames
+
+
+class ChartUploader:
+    """Uploads the arrows of a GameEngine to a controller ahead of the playhead
+
+    update() is called from the game loop; the writes happen on the client's event loop."""
+
+    def __init__(self, client: "ControllerClient", clock_sync: "ClockSyncService", lookahead: float = UPLOAD_LOOKAHEAD,
+                 max_in_flight: int = MAX_IN_FLIGHT):
+        self.client = client
+        self.clock_sync = clock_sync
+        self.lookahead = lookahead
+        self.max_in_flight = max_in_flight
+        self.uploaded_until: list[Optional[float]] = [None] * 4 # furthest beat each lane was uploaded to
+        self.uploaded: list[set[tuple[int, int]]] = [set() for _ in range(4)] # (slot, generation) of the uploaded arrows still ahead
+        self.pending: deque[tuple[bytes, float]] = deque() # (frame, time queued), filled by update()
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task = None
+        self.frames_sent = 0
+        self.frames_failed = 0 # writes that raised, e.g. rejected by the controller
+        self.bytes_sent = 0
+        self.times_sent = 0
+        self.latencies: deque[float] = deque(maxlen=MAX_LATENCY_SAMPLES) # queued -> written, seconds
+
+    def start(self):
+        if self.client.loop is not None:
+            self.task = asyncio.run_coroutine_threadsafe(self._run(), self.client.loop)
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def reset(self):
+        """Uploads the whole lookahead again, e.g. after the controller reconnected with empty heaps"""
+        self.uploaded_until = [None] * 4
+        self.uploaded = [set() for _ in range(4)]
+
+    def mtu(self) -> int:
+        return getattr(self.client.client, "mtu_size", None) or DEFAULT_MTU
+
+    def update(self, engine: "GameEngine"):
+        """Queues the arrows within the lookahead that were not uploaded yet
+
+        Arrows can be added inside the window already uploaded (player 2 spawns
+        target the next beat), so every update checks the whole window from the
+        playhead, and an arrow is known by its slot and the slot's generation."""
+        estimator = self.clock_sync.estimator
+        if not estimator.ready():
+            return
+        tempo_map, store = engine.tempo_map, engine.arrow_store
+        horizon_beat = tempo_map.time_to_beat(engine.time + self.lookahead)
+        generation = store.generation
+        frames = []
+        for dir_index, lane in enumerate(engine.arrows):
+            end_beat = max(self.uploaded_until[dir_index] or horizon_beat, horizon_beat) # never shrinks, a slower BPM would upload again
+            uploaded, window = self.uploaded[dir_index], set()
+            slots = []
+            for slot in lane.iter_between(engine.beat, end_beat):
+                key = (slot, int(generation[slot]))
+                window.add(key)
+                if key not in uploaded:
+                    slots.append(slot)
+            self.uploaded[dir_index] = window # arrows behind the playhead never come back
+            self.uploaded_until[dir_index] = end_beat
+            if slots:
+                host_times = tempo_map.beats_to_times(store.target_beat[slots])
+                frames += pack_lane_frames(dir_index, estimator.host_to_device(host_times) * 1e6, self.mtu())
+                self.times_sent += len(slots)
+        if frames:
+            self.queue_frames(frames)
+
+    def queue_frames(self, frames: list[bytes]):
+        """Queues frames to write, from any thread"""
+        now = time.perf_counter()
+        self.pending.extend((frame, now) for frame in frames)
+        if self.wakeup is not None:
+            self.client.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def _run(self):
+        self.wakeup = asyncio.Event()
+        in_flight = 0
+        while True:
+            if not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            frame, queued_time = self.pending.popleft()
+            acknowledged = in_flight + 1 >= self.max_in_flight or not self.pending # last frame of a burst: make sure it got there
+            try:
+                await self.client.client.write_gatt_char(self.client.CHARACTERISTIC_UUID_TX, frame, response=acknowledged)
+            except Exception as e:
+                print(f"Chart upload write failed: {e}")
+                self.frames_failed += 1
+                continue
+            in_flight = 0 if acknowledged else in_flight + 1
+            self.frames_sent += 1
+            self.bytes_sent += len(frame)
+            self.latencies.append(time.perf_counter() - queued_time)
@@ -0,0 +1,106 @@
+"""Transport-independent side of the controller clients, with no bleak dependency.
+
+ControllerClient is the interface shared by bluetooth_definition.BluetoothClient
+and mqtt_transport.MqttClient, which ClockSyncService, ChartUploader and the
+game rely on. ClientManager runs the connect() loops of any number of clients
+on one event loop thread; BluetoothManager extends it with the BLE scanning and
+address cache, MQTT clients use it as is."""
+import asyncio
+import random
+import threading
+import time
+from typing import Callable, Optional, Protocol
+
+RECONNECT_MIN_DELAY = 0.5 # seconds before the first reconnection attempt
+RECONNECT_MAX_DELAY = 30.0
+RECONNECT_JITTER = 0.5 # fraction of the delay drawn at random, so controllers do not retry in lockstep
+
+def reconnect_delay(attempt: int, rng: random.Random = random) -> float:
+    """Exponential backoff with jitter: delay before the reconnection attempt number 'attempt' (1 for the first)"""
+    delay = min(RECONNECT_MAX_DELAY, RECONNECT_MIN_DELAY * 2 ** (attempt - 1))
+    return delay * (1 - RECONNECT_JITTER * rng.random())
+
+
+class ControllerClient(Protocol):
+    """A controller connection kept up by a ClientManager"""
+    name: Optional[str]
+    CHARACTERISTIC_UUID_RX: str # where the controller's messages come from
+    CHARACTERISTIC_UUID_TX: str # where the messages to the controller go
+    client: object # link with is_connected, mtu_size and async write_gatt_char(), None before the first connection
+    recv_message_callback: Optional[Callable[[bytearray], None]]
+    on_connected: Optional[Callable[["ControllerClient"], None]] # called from the event loop every time the controller (re)connects
+    loop: Optional[asyncio.AbstractEventLoop] # event loop of the ClientManager running this client
+    manager: Optional["ClientManager"]
+    connected: threading.Event # set while connected, for threads that need to wait
+
+    def is_connected(self) -> bool: ...
+
+    async def connect(self):
+        """Connects and reconnects until disconnect() is called"""
+
+    async def disconnect(self): ...
+
+    def send_message_bytes(self, message: bytearray): ...
+
+ConnectedCallback = Callable[[ControllerClient], None]
+
+
+class ClientManager:
+    """Runs the connections of any number of ControllerClients on one event loop thread"""
+
+    def __init__(self, DEBUG: bool = True, thread_name: str = "ClientManager"):
+        self.loop = asyncio.new_event_loop()
+        self.clients: list[ControllerClient] = []
+        self.tasks: dict[ControllerClient, "asyncio.Future"] = {} # connect() task of each client
+        self.DEBUG = DEBUG
+        self.thread = threading.Thread(target=self._run_loop, name=thread_name, daemon=True)
+        self.thread.start()
+
+    def add(self, client: ControllerClient):
+        """Connects 'client' and keeps it connected, without blocking"""
+        client.loop = self.loop
+        client.manager = self
+        self.clients.append(client)
+        self.tasks[client] = asyncio.run_coroutine_threadsafe(client.connect(), self.loop)
+
+    def remove(self, client: ControllerClient, timeout: float = 5.0):
+        """Disconnects 'client' and stops reconnecting it"""
+        asyncio.run_coroutine_threadsafe(client.disconnect(), self.loop).result(timeout)
+        self.tasks.pop(client).result(timeout)
+        self.clients.remove(client)
+
+    def stop(self, timeout: float = 5.0):
+        """Disconnects every client and stops the event loop"""
+        for client in list(self.clients):
+            self.remove(client, timeout)
+        asyncio.run_coroutine_threadsafe(self._cancel_tasks(), self.loop).result(timeout) # e.g. the clock sync pings
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+
+    async def _cancel_tasks(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+_shared_client_manager: Optional[ClientManager] = None
+
+def shared_client_manager() -> ClientManager:
+    """ClientManager of the non-bluetooth clients started without one"""
+    global _shared_client_manager
+    if _shared_client_manager is None:
+        _shared_client_manager = ClientManager()
+    return _shared_client_manager
+
+def wait_connected(clients: list[ControllerClient], timeout: Optional[float] = None) -> bool:
+    """Blocks until every client is connected, returns False on timeout"""
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    for client in clients:
+        remaining = None if deadline is None else max(0.0, deadline - time.perf_counter())
+        if not client.connected.wait(remaining):
+            return False
+    return True
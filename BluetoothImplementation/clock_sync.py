@@ -0,0 +1,144 @@
+"""Clock synchronization between the host and the ESP32 controllers.
+
+The host periodically sends a ping ("P" + uint32 sequence number) and the
+controller answers "PONG <seq> <esp_timer_get_time() us>". Each exchange gives
+a sample (device time, host time at the middle of the round trip, round-trip
+time). Samples with a large RTT are the ones where one direction was delayed,
+so only the fastest ones of a sliding window are kept, and a linear regression
+of host time on device time over them gives the offset and the drift."""
+import asyncio
+import struct
+import time
+import numpy as np
+from collections import deque
+from typing import TYPE_CHECKING, Callable, Optional
+
+if TYPE_CHECKING: # the estimator does not need the bluetooth stack
+    from BluetoothImplementation.client_manager import ControllerClient
+
+SYNC_WINDOW = 128 # samples kept for the regression
+SYNC_RTT_QUANTILE = 0.1 # fraction of the window with the lowest RTT used for the fit
+MIN_DRIFT_SAMPLES = 8 # below this, only the offset is estimated
+PING_INTERVAL = 0.5 # seconds between pings
+PING_FORMAT = struct.Struct("<cI")
+
+
+class ClockSyncEstimator:
+    """Estimates host_time = device_time * (1 + drift) + offset from ping samples"""
+
+    def __init__(self, window: int = SYNC_WINDOW, rtt_quantile: float = SYNC_RTT_QUANTILE):
+        self.rtt_quantile = rtt_quantile
+        self.samples: deque[tuple[float, float, float]] = deque(maxlen=window) # (device time, host time, rtt)
+        self.origin = 0.0 # device time the fit is centered on, for precision
+        self.slope = 1.0
+        self.intercept = 0.0 # host time at 'origin'
+        self.n_fitted = 0
+
+    def add_sample(self, host_send_time: float, device_time: float, host_recv_time: float):
+        """Adds a ping exchange: sent at 'host_send_time', stamped 'device_time' by the device, answered at 'host_recv_time'"""
+        rtt = host_recv_time - host_send_time
+        self.samples.append((device_time, (host_send_time + host_recv_time) / 2, rtt))
+        self._fit()
+
+    def ready(self) -> bool:
+        return self.n_fitted > 0
+
+    def device_to_host(self, device_time: float) -> Optional[float]:
+        """Host time of 'device_time', None before the first sample"""
+        if not self.n_fitted:
+            return None
+        return self.intercept + (device_time - self.origin) * self.slope
+
+    def host_to_device(self, host_time: float) -> Optional[float]:
+        """Device time of 'host_time', None before the first sample"""
+        if not self.n_fitted:
+            return None
+        return self.origin + (host_time - self.intercept) / self.slope
+
+    def offset(self) -> float:
+        """host time - device time, at the latest sample"""
+        return self.device_to_host(self.samples[-1][0]) - self.samples[-1][0] if self.n_fitted else 0.0
+
+    def drift_ppm(self) -> float:
+        return (self.slope - 1) * 1e6
+
+    def _fit(self):
+        samples = np.array(self.samples)
+        device_times, host_times, rtts = samples[:, 0], samples[:, 1], samples[:, 2]
+        keep = max(1, int(len(samples) * self.rtt_quantile))
+        fastest = np.argsort(rtts, kind="stable")[:keep]
+        device_times, host_times = device_times[fastest], host_times[fastest]
+        self.origin = device_times.mean()
+        self.intercept = host_times.mean()
+        self.n_fitted = len(fastest)
+        if self.n_fitted < MIN_DRIFT_SAMPLES or np.ptp(device_times) == 0:
+            self.slope = 1.0
+            self.intercept = (host_times - device_times).mean() + self.origin
+            return
+        centered = device_times - self.origin
+        self.slope = float(np.dot(centered, host_times - self.intercept) / np.dot(centered, centered))
+
+
+class ClockSyncService:
+    """Pings a controller client periodically and keeps a ClockSyncEstimator of its clock
+
+    The service sits in front of the client's recv_message_callback: PONG
+    messages are consumed, every other message is forwarded."""
+
+    def __init__(self, client: "ControllerClient", interval: float = PING_INTERVAL, clock: Callable[[], float] = time.perf_counter):
+        self.client = client
+        self.interval = interval
+        self.clock = clock
+        self.estimator = ClockSyncEstimator()
+        self.sequence = 0
+        self.pending_pings: dict[int, float] = {} # sequence number -> send time
+        self.forward_callback = client.recv_message_callback
+        client.recv_message_callback = self._recv_message_callback
+        self.task = None
+
+    def start(self):
+        """Starts pinging from the client's event loop"""
+        if self.client.loop is not None:
+            self.task = asyncio.run_coroutine_threadsafe(self._run(), self.client.loop)
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def reset(self):
+        """Drops the samples, e.g. after the controller reconnected (and maybe rebooted)"""
+        self.estimator = ClockSyncEstimator()
+        self.pending_pings.clear()
+
+    def device_to_host(self, device_time: float) -> Optional[float]:
+        return self.estimator.device_to_host(device_time)
+
+    def handle_message(self, data: bytearray, receipt_time: float) -> bool:
+        """Adds the sample of a PONG message. Returns False if 'data' is not a PONG."""
+        if not data.startswith(b"PONG "):
+            return False
+        try:
+            _, sequence, device_time_us = data.decode("ascii").split(" ")
+            send_time = self.pending_pings.pop(int(sequence))
+        except (ValueError, KeyError) as e:
+            print(f"Ignoring invalid PONG {data}: {e}")
+            return True
+        self.estimator.add_sample(send_time, int(device_time_us) * 1e-6, receipt_time)
+        return True
+
+    async def _run(self):
+        while True:
+            if self.client.client is not None and self.client.client.is_connected:
+                self.sequence += 1
+                self.pending_pings = {sequence: t for sequence, t in self.pending_pings.items() if sequence > self.sequence - SYNC_WINDOW}
+                self.pending_pings[self.sequence] = self.clock()
+                try:
+                    await self.client.client.write_gatt_char(self.client.CHARACTERISTIC_UUID_TX, PING_FORMAT.pack(b"P", self.sequence), response=False)
+                except Exception as e:
+                    print(f"Clock sync ping failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def _recv_message_callback(self, data: bytearray):
+        receipt_time = self.clock()
+        if not self.handle_message(data, receipt_time) and self.forward_callback:
+            self.forward_callback(data)
@@ -0,0 +1,218 @@
+"""In-process stand-in for the BLE link and the player1.ino controller, to run
+the input path without hardware.
+
+A LoopbackTransport has the interface of the BleakClient used by
+BluetoothClient, so it is plugged in with BluetoothClient(transport_factory=
+network.transport). It models the link layer of a connection: every connection
+interval, at most PACKETS_PER_EVENT packets go each way out of TX buffers of
+TX_BUFFER packets. Writes without response and notifications that find their
+buffer full are dropped and counted, a write with response waits for room and
+returns one connection interval after its packet got through. Like a real
+GATT server, the link rejects a write or a subscription that the
+characteristic's properties do not allow.
+
+A ControllerEmulator behaves like player1.ino: it answers the clock sync pings,
+pushes the [column, t1, ...] float arrays it receives into per-lane min-heaps,
+and notifies binary HIT frames (see wire_codec) when buttons are pressed."""
+import asyncio
+import heapq
+import inspect
+import time
+import numpy as np
+from typing import Callable, Iterable, Optional
+from BluetoothImplementation.wire_codec import FrameEncoder, MSG_HIT
+
+CONNECTION_INTERVAL = 0.0075 # seconds
+PACKETS_PER_EVENT = 6 # packets each way per connection event
+TX_BUFFER = 10 # packets queued each way before dropping
+LOOPBACK_MTU = 247
+PLAYER1_RX_UUID = "19b10002-e8f2-537e-4f6c-d104768a1214" # written by the host, its CHARACTERISTIC_UUID_TX
+PLAYER1_TX_UUID = "19b10001-e8f2-537e-4f6c-d104768a1214" # notified to the host, its CHARACTERISTIC_UUID_RX
+PLAYER1_PROPERTIES = { # as created in setup() of player1.ino, with the names bleak uses
+    PLAYER1_RX_UUID: ("write", "write-without-response"),
+    PLAYER1_TX_UUID: ("read", "notify"),
+}
+
+
+class ControllerEmulator:
+    """Emulates the GATT behaviour of player1/player1.ino"""
+
+    def __init__(self, drift_ppm: float = 0.0, clock: Callable[[], float] = time.perf_counter,
+                 properties: dict[str, tuple[str, ...]] = PLAYER1_PROPERTIES):
+        self.clock = clock
+        self.properties = properties # characteristic uuid (lowercase) -> GATT properties
+        self.boot_time = clock() # esp_timer counts from here
+        self.rate = 1 + drift_ppm * 1e-6
+        self.heaps: list[list[float]] = [[] for _ in range(4)] # arrow times (device us) of each lane
+        self.encoder = FrameEncoder()
+        self.transport: Optional["LoopbackTransport"] = None # connected host, if any
+        self.rejected_writes = 0 # writes whose length is not a multiple of 4
+        self.arrow_log: Optional[list[tuple[float, int, np.ndarray]]] = None # (host time, column, times) of the uploads, if a list
+
+    def time_us(self) -> int:
+        """esp_timer_get_time()"""
+        return int((self.clock() - self.boot_time) * self.rate * 1e6)
+
+    def on_write(self, data: bytes):
+        """onWrite of the RX characteristic"""
+        if len(data) == 5 and data[0] == ord("P"): # clock sync ping
+            sequence = int.from_bytes(data[1:5], "little")
+            self.notify(f"PONG {sequence} {self.time_us()}".encode("ascii"))
+            return
+        if len(data) % 4 != 0:
+            self.rejected_writes += 1
+            return
+        values = np.frombuffer(data, "<f4")
+        column, times = int(values[0]), values[1:]
+        for arrow_time in times.tolist():
+            heapq.heappush(self.heaps[column], arrow_time)
+        if self.arrow_log is not None:
+            self.arrow_log.append((self.clock(), column, times))
+
+    def press(self, lanes: Iterable[int]) -> Optional[bytes]:
+        """ButtonEvent with 'lanes' pressed: pops their next arrows and notifies one HIT frame"""
+        time_us = self.time_us()
+        records = []
+        for lane in lanes:
+            if self.heaps[lane]:
+                heapq.heappop(self.heaps[lane])
+            records.append((MSG_HIT, lane, time_us))
+        if not records:
+            return None
+        frame = self.encoder.encode(records)
+        self.notify(frame)
+        return frame
+
+    def notify(self, data: bytes):
+        if self.transport is not None:
+            self.transport.notify(data)
+
+
+class LoopbackTransport:
+    """BleakClient stand-in connected to a ControllerEmulator through a simulated link"""
+
+    def __init__(self, emulator: Optional[ControllerEmulator], disconnected_callback: Optional[Callable[["LoopbackTransport"], None]] = None,
+                 mtu_size: int = LOOPBACK_MTU):
+        self.emulator = emulator
+        self.disconnected_callback = disconnected_callback
+        self.mtu_size = mtu_size
+        self.is_connected = False
+        self.notify_callback = None
+        self.to_device: list[tuple[bytes, Optional[asyncio.Future]]] = [] # (write, future of a write with response)
+        self.to_host: list[bytes] = []
+        self.dropped_writes = 0
+        self.dropped_notifications = 0
+        self.rejected_writes = 0 # writes the characteristic's properties do not allow
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.task = None
+
+    async def connect(self):
+        if self.emulator is None:
+            raise ConnectionError("No controller at this address")
+        await asyncio.sleep(CONNECTION_INTERVAL)
+        self.loop = asyncio.get_running_loop()
+        self.is_connected = True
+        self.emulator.transport = self
+        self.task = self.loop.create_task(self._connection_events())
+
+    async def disconnect(self):
+        self._close()
+
+    def drop_link(self):
+        """Simulates a link loss, from the event loop thread"""
+        self._close()
+
+    async def start_notify(self, uuid: str, callback: Callable):
+        self._check_property(uuid, "notify")
+        self.notify_callback = callback
+
+    async def write_gatt_char(self, uuid: str, data: bytes, response: bool = False):
+        if not self.is_connected:
+            raise ConnectionError("Not connected")
+        try:
+            self._check_property(uuid, "write" if response else "write-without-response")
+        except PermissionError:
+            self.rejected_writes += 1
+            raise
+        if len(data) > self.mtu_size - 3:
+            raise ValueError(f"{len(data)} bytes do not fit the MTU {self.mtu_size}")
+        if not response:
+            if len(self.to_device) >= TX_BUFFER:
+                self.dropped_writes += 1
+            else:
+                self.to_device.append((bytes(data), None))
+            await asyncio.sleep(0) # the backend hands the packet over and returns
+            return
+        while len(self.to_device) >= TX_BUFFER: # an ATT request waits for room instead of being dropped
+            await asyncio.sleep(CONNECTION_INTERVAL / 4)
+        delivered = self.loop.create_future()
+        self.to_device.append((bytes(data), delivered))
+        await delivered
+        await asyncio.sleep(CONNECTION_INTERVAL) # the response comes back on the next connection event
+
+    def notify(self, data: bytes):
+        """Queues a notification from the controller, from the event loop thread"""
+        if len(self.to_host) >= TX_BUFFER:
+            self.dropped_notifications += 1
+        else:
+            self.to_host.append(bytes(data))
+
+    def _check_property(self, uuid: str, gatt_property: str):
+        properties = self.emulator.properties.get(uuid.lower())
+        if properties is None:
+            raise ValueError(f"No characteristic {uuid} on the controller")
+        if gatt_property not in properties:
+            raise PermissionError(f"Characteristic {uuid} does not allow {gatt_property} (properties: {', '.join(properties)})")
+
+    def _close(self):
+        if not self.is_connected:
+            return
+        self.is_connected = False
+        if self.emulator.transport is self:
+            self.emulator.transport = None
+        if self.task is not None:
+            self.task.cancel()
+        for _, delivered in self.to_device:
+            if delivered is not None and not delivered.done():
+                delivered.set_exception(ConnectionError("Disconnected"))
+        self.to_device, self.to_host = [], []
+        if self.disconnected_callback:
+            self.disconnected_callback(self)
+
+    async def _connection_events(self):
+        while True:
+            await asyncio.sleep(CONNECTION_INTERVAL)
+            writes, self.to_device = self.to_device[:PACKETS_PER_EVENT], self.to_device[PACKETS_PER_EVENT:]
+            for data, delivered in writes:
+                self.emulator.on_write(data)
+                if delivered is not None and not delivered.done():
+                    delivered.set_result(None)
+            notifications, self.to_host = self.to_host[:PACKETS_PER_EVENT], self.to_host[PACKETS_PER_EVENT:]
+            for data in notifications:
+                if self.notify_callback is not None:
+                    result = self.notify_callback("loopback", bytearray(data))
+                    if inspect.isawaitable(result):
+                        await result
+
+
+class LoopbackNetwork:
+    """Addresses of the emulated controllers, hands out the transports connecting to them"""
+
+    def __init__(self):
+        self.emulators: dict[str, ControllerEmulator] = {}
+        self.transports: list[LoopbackTransport] = []
+
+    def add_controller(self, address: str, emulator: Optional[ControllerEmulator] = None) -> ControllerEmulator:
+        emulator = emulator if emulator is not None else ControllerEmulator()
+        self.emulators[address] = emulator
+        return emulator
+
+    def transport(self, address: str, disconnected_callback: Optional[Callable[[LoopbackTransport], None]] = None) -> LoopbackTransport:
+        """transport_factory of BluetoothClient"""
+        transport = LoopbackTransport(self.emulators.get(address), disconnected_callback)
+        self.transports.append(transport)
+        return transport
+
+    def dropped(self) -> tuple[int, int]:
+        """(writes, notifications) dropped on every link so far"""
+        return sum(t.dropped_writes for t in self.transports), sum(t.dropped_notifications for t in self.transports)
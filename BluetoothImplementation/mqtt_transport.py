@@ -0,0 +1,254 @@
+"""MQTT transport for the controllers, an alternative to BLE for players on Wi-Fi.
+
+Every player has three topics: the controller publishes on "stepmania/<player>/tx"
+(HIT frames, PONGs) and reads "stepmania/<player>/rx" (clock sync pings, chart
+uploads), with the same binary payloads as the BLE characteristics. All players
+share one persistent MqttConnection at QoS 0; paho reconnects it by itself.
+
+A reachable broker says nothing about the controller, so a player is connected
+while its retained "stepmania/<player>/status" reads "online <boot id>": the
+controller publishes it after connecting, with "offline" as its last will. The
+broker publishes the will when the controller drops, and a new boot id means
+it rebooted with empty heaps, so on_connected runs again either way.
+
+An MqttClient has the interface of a BluetoothClient (recv_message_callback,
+on_connected, is_connected(), a 'client' with is_connected and write_gatt_char,
+and the event 'loop' of a ClientManager), so ClockSyncService and ChartUploader
+work over it unchanged. Messages are handed from paho's network thread to the
+manager's event loop, where the callbacks run as for BLE. Nothing here needs
+bleak."""
+import asyncio
+import random
+import threading
+from paho.mqtt import client as mqtt_client
+from typing import Callable, Literal, Optional
+from BluetoothImplementation.client_manager import ClientManager, RECONNECT_MAX_DELAY, shared_client_manager
+
+MQTT_BROKER = "192.168.0.103"
+MQTT_PORT = 1883
+MQTT_KEEPALIVE = 60 # seconds
+MQTT_MTU = 512 # bytes per write, sizes the chart upload frames
+TOPIC_PREFIX = "stepmania"
+STATUS_ONLINE = b"online" # followed by the boot id of the controller
+
+
+class MqttConnection:
+    """One persistent connection to the broker, shared by the MqttClients of every player"""
+
+    def __init__(self, host: str = MQTT_BROKER, port: int = MQTT_PORT, client_id: Optional[str] = None, DEBUG: bool = True):
+        self.host = host
+        self.port = port
+        self.DEBUG = DEBUG
+        self.client = mqtt_client.Client(mqtt_client.CallbackAPIVersion.VERSION2, client_id=client_id or f"stepmania-{random.randint(0, 1_000_000)}")
+        self.client.reconnect_delay_set(min_delay=1, max_delay=int(RECONNECT_MAX_DELAY))
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+        self.subscribers: dict[str, "MqttClient"] = {} # topic -> client reading it, two per client
+        self.lock = threading.Lock() # subscribers are changed from the event loop and read from the network thread
+        self.is_connected = False
+        self.started = False
+
+    def start(self):
+        """Connects in paho's network thread, without blocking"""
+        if not self.started:
+            self.started = True
+            self.client.connect_async(self.host, self.port, MQTT_KEEPALIVE)
+            self.client.loop_start()
+
+    def stop(self):
+        if self.started:
+            self.client.disconnect()
+            self.client.loop_stop()
+            self.started = False
+            self.is_connected = False
+
+    def add(self, client: "MqttClient"):
+        with self.lock:
+            for topic in client.topics():
+                self.subscribers[topic] = client
+        if self.is_connected:
+            self.client.subscribe([(topic, 0) for topic in client.topics()])
+        self.start()
+
+    def remove(self, client: "MqttClient"):
+        with self.lock:
+            for topic in client.topics():
+                self.subscribers.pop(topic, None)
+            last = not self.subscribers
+        if last: # the connection lives as long as one of its players
+            self.stop()
+        elif self.is_connected:
+            self.client.unsubscribe(list(client.topics()))
+
+    def publish(self, topic: str, data: bytes):
+        """Queues a QoS 0 message, paho sends it from its network thread"""
+        self.client.publish(topic, bytes(data), qos=0)
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            if self.DEBUG:
+                print(f"MQTT connection to {self.host}:{self.port} refused: {reason_code}")
+            return
+        self.is_connected = True
+        if self.DEBUG:
+            print(f"Connected to MQTT broker {self.host}:{self.port}")
+        with self.lock:
+            topics = list(self.subscribers)
+        if topics: # subscriptions do not survive a clean session, renew them on every connection (the retained statuses come back)
+            client.subscribe([(topic, 0) for topic in topics])
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        self.is_connected = False
+        if self.DEBUG:
+            print(f"Disconnected from MQTT broker {self.host}:{self.port}: {reason_code}")
+        with self.lock:
+            subscribers = set(self.subscribers.values())
+        for subscriber in subscribers:
+            subscriber._set_status_threadsafe(None) # unknown until the broker sends the retained status again
+
+    def _on_message(self, client, userdata, message: mqtt_client.MQTTMessage):
+        with self.lock:
+            subscriber = self.subscribers.get(message.topic)
+        if subscriber is None:
+            return
+        if message.topic == subscriber.status_topic:
+            subscriber._set_status_threadsafe(message.payload)
+        else:
+            subscriber._post(message.payload)
+
+
+class MqttLink:
+    """The part of a BleakClient used by BluetoothClient users, over an MqttConnection"""
+    mtu_size = MQTT_MTU
+
+    def __init__(self, client: "MqttClient"):
+        self.owner = client
+        self.connection = client.connection
+
+    @property
+    def is_connected(self) -> bool:
+        """Whether the controller is there, not only the broker"""
+        return self.owner.is_connected()
+
+    async def write_gatt_char(self, topic: str, data: bytes, response: bool = False):
+        """Publishes 'data' on 'topic' at QoS 0, 'response' is ignored (there is no acknowledgment)"""
+        if not self.connection.is_connected:
+            raise ConnectionError(f"Not connected to {self.connection.host}:{self.connection.port}")
+        self.connection.publish(topic, data)
+
+
+class MqttClient:
+    """Controller of 'player' reached through an MQTT broker, with the interface of BluetoothClient"""
+
+    def __init__(self, player: str, connection: MqttConnection, DEBUG: bool = True,
+                 on_connected: Optional[Callable[["MqttClient"], None]] = None):
+        self.name = player
+        self.device_mac_address = f"mqtt://{connection.host}:{connection.port}/{player}"
+        self.connection = connection
+        self.CHARACTERISTIC_UUID_RX = f"{TOPIC_PREFIX}/{player}/tx" # TX of ESP32
+        self.CHARACTERISTIC_UUID_TX = f"{TOPIC_PREFIX}/{player}/rx" # RX of ESP32
+        self.status_topic = f"{TOPIC_PREFIX}/{player}/status" # retained "online <boot id>" or "offline"
+        self.client = MqttLink(self)
+        self.DEBUG = DEBUG
+        self.recv_message_callback: Optional[Callable[[bytearray], None]] = None
+        self.on_connected = on_connected
+
+        self.loop = None # Event loop of the ClientManager running this client
+        self.manager: Optional[ClientManager] = None
+        self.state: Literal["idle", "connecting", "connected", "stopped"] = "idle"
+        self.status: Optional[bytes] = None # last status of the controller, None while unknown
+        self.session: Optional[bytes] = None # status of the controller session on_connected ran for
+        self.link_changed: Optional[asyncio.Event] = None # set when the status changes
+        self.stopping = False
+        self.connected = threading.Event()
+
+    def is_connected(self) -> bool:
+        return self.state == "connected"
+
+    def topics(self) -> tuple[str, str]:
+        """Topics read from the broker"""
+        return self.CHARACTERISTIC_UUID_RX, self.status_topic
+
+    async def connect(self):
+        """Follows the status of the controller until disconnect() is called"""
+        self.link_changed = asyncio.Event()
+        self.state = "connecting"
+        self.connection.add(self)
+        while not self.stopping:
+            self.link_changed.clear()
+            online = self.status is not None and self.status.startswith(STATUS_ONLINE)
+            session = self.status if online else None
+            if session != self.session:
+                if self.session is not None: # gone, or back with another boot id
+                    self.state = "connecting"
+                    self.connected.clear()
+                    if self.DEBUG:
+                        print(f"{self.device_mac_address} disconnected. Waiting for the controller...")
+                self.session = session
+                if session is not None:
+                    self.state = "connected"
+                    self.connected.set()
+                    if self.DEBUG:
+                        print(f"Connected to {self.device_mac_address} ({session.decode(errors='replace')})")
+                    if self.on_connected:
+                        try:
+                            self.on_connected(self)
+                        except Exception as e:
+                            print(f"on_connected callback of {self.device_mac_address} failed: {e}")
+            await self.link_changed.wait()
+        self.state = "stopped"
+
+    async def disconnect(self):
+        self.stopping = True
+        self.connection.remove(self)
+        self.connected.clear()
+        if self.link_changed is not None:
+            self.link_changed.set()
+
+    async def async_send_message_bytes(self, message: bytearray):
+        await self.client.write_gatt_char(self.CHARACTERISTIC_UUID_TX, message)
+        if self.DEBUG:
+            print(f"Sent {message}")
+
+    def send_message_bytes(self, message: bytearray):
+        """Non-blocking wrapper to call send_message_bytes() from a non-async function."""
+        if self.loop:
+            asyncio.run_coroutine_threadsafe(self.async_send_message_bytes(message), self.loop)
+
+    def connect_in_background(self, manager: ClientManager = None):
+        """Starts the client on the event loop of 'manager', the shared one by default."""
+        (manager or shared_client_manager()).add(self)
+
+    def _post(self, payload: bytes):
+        """Hands a message from the network thread to the event loop"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._deliver, bytearray(payload))
+
+    def _set_status_threadsafe(self, status: Optional[bytes]):
+        """Hands a status of the controller (None: unknown) from the network thread to the event loop"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._set_status, None if status is None else bytes(status))
+
+    def _set_status(self, status: Optional[bytes]):
+        self.status = status
+        if self.link_changed is not None:
+            self.link_changed.set()
+
+    def _deliver(self, data: bytearray):
+        if self.DEBUG:
+            print(f"Received message from {self.CHARACTERISTIC_UUID_RX}: {data}")
+        if self.recv_message_callback:
+            self.recv_message_callback(data)
+
+
+def setup_mqtt(*players: str, host: str = MQTT_BROKER, port: int = MQTT_PORT, DEBUG: bool = True, manager: ClientManager = None,
+               on_connected: Optional[Callable[[MqttClient], None]] = None) -> list[MqttClient]:
+    """Setup the MQTT clients of 'players' on one connection and returns them right away, as setup_bluetooth()"""
+    if DEBUG:
+        print(f"Setting up MQTT connections for {players} through {host}:{port}")
+    connection = MqttConnection(host, port, DEBUG=DEBUG)
+    clients = [MqttClient(player, connection, DEBUG, on_connected) for player in players]
+    for client in clients:
+        client.connect_in_background(manager)
+    return clients
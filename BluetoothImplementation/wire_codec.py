@@ -0,0 +1,103 @@
+"""Binary wire format of the controller messages.
+
+A frame is a 2-byte header (format version, record count) followed by 8-byte
+records (message type, lane, sequence number, device time), little endian:
+
+    version u8 | count u8 | type u8, lane u8, sequence u16, time_us u32 | ...
+
+Several presses share one notification by sharing one frame. Sequence numbers
+increase by one per record, so a jump between frames counts the records lost on
+the way. The device time is the low 32 bits of esp_timer_get_time(); it wraps
+every 71 minutes and is unwrapped against a reference time with
+unwrap_time_us(). The first byte of a frame is never printable, so binary frames
+and the older ASCII messages ("HIT 1 ...") can share a characteristic."""
+import struct
+from typing import Iterable, NamedTuple
+
+WIRE_VERSION = 1
+HEADER = struct.Struct("<BB") # version, record count
+RECORD = struct.Struct("<BBHI") # message type, lane, sequence number, device time (us, 32 bits)
+HEADER_AND_SEQUENCE = struct.Struct("<BBxxH") # header and sequence number of the first record
+MAX_RECORDS = 255
+SEQUENCE_MOD = 1 << 16
+TIME_MOD = 1 << 32
+
+MSG_HIT = 1 # player 1 pressed 'lane' (0-based, as dir_index)
+MSG_SPAWN = 2 # player 2 spawns an arrow in 'lane'
+
+
+class WireMessage(NamedTuple):
+    """A decoded record"""
+    message_type: int
+    lane: int
+    sequence: int
+    time_us: int # low 32 bits of the device time
+
+
+def is_wire_frame(data: bytes) -> bool:
+    """True for a binary frame, False for an ASCII message"""
+    return len(data) >= HEADER.size and data[0] == WIRE_VERSION
+
+def unwrap_time_us(time_us: int, reference_us: float) -> int:
+    """Full device time of a 32-bit 'time_us', the one closest to 'reference_us' (e.g. the device time estimated by clock sync)"""
+    wraps = round((reference_us - time_us) / TIME_MOD)
+    return time_us + wraps * TIME_MOD
+
+
+class FrameEncoder:
+    """Packs records into frames, numbering them"""
+
+    def __init__(self, first_sequence: int = 0):
+        self.sequence = first_sequence
+
+    def encode(self, records: Iterable[tuple[int, int, int]]) -> bytes:
+        """Encodes (message type, lane, device time us) records into one frame"""
+        records = list(records)
+        if len(records) > MAX_RECORDS:
+            raise ValueError(f"At most {MAX_RECORDS} records per frame, got {len(records)}")
+        frame = bytearray(HEADER.size + RECORD.size * len(records))
+        HEADER.pack_into(frame, 0, WIRE_VERSION, len(records))
+        for i, (message_type, lane, time_us) in enumerate(records):
+            RECORD.pack_into(frame, HEADER.size + i * RECORD.size, message_type, lane, self.sequence, time_us % TIME_MOD)
+            self.sequence = (self.sequence + 1) % SEQUENCE_MOD
+        return bytes(frame)
+
+
+class FrameDecoder:
+    """Decodes the frames of one controller, counting the records lost between frames"""
+
+    def __init__(self):
+        self.next_sequence = None # expected sequence number of the next record
+        self.received = 0
+        self.lost = 0
+        self.out_of_order = 0 # records older than expected (duplicated or reordered)
+
+    def decode(self, data: bytes) -> list[WireMessage]:
+        """Decodes a frame, without copying its records"""
+        return list(map(WireMessage._make, self.iter_records(data)))
+
+    def iter_records(self, data: bytes) -> Iterable[tuple[int, int, int, int]]:
+        """Decodes a frame into (message type, lane, sequence, time us) tuples, the fast path of decode()"""
+        version, count = HEADER.unpack_from(data) # raises on a truncated header
+        if version != WIRE_VERSION:
+            raise ValueError(f"Unknown wire format version {version}")
+        if count == 0:
+            return () # empty frame
+        end = HEADER.size + count * RECORD.size
+        if len(data) < end:
+            raise ValueError(f"Truncated frame: {len(data)} bytes for {count} records")
+        first_sequence = HEADER_AND_SEQUENCE.unpack_from(data)[2] # within the first record, checked above
+        gap = 0 if self.next_sequence is None else (first_sequence - self.next_sequence) % SEQUENCE_MOD
+        if gap < SEQUENCE_MOD // 2:
+            self.lost += gap
+            self.next_sequence = (first_sequence + count) % SEQUENCE_MOD # records of a frame are numbered in a row
+        else:
+            self.out_of_order += count
+        self.received += count
+        if count == 1: # the common case, no view needed
+            return (RECORD.unpack_from(data, HEADER.size),)
+        return RECORD.iter_unpack(memoryview(data)[HEADER.size:end])
+
+    def loss_rate(self) -> float:
+        total = self.received + self.lost
+        return self.lost / total if total else 0.0
@@ -0,0 +1,90 @@
+"""Sound scheduler playing sounds at precise times from its own thread.
+
+Sounds are queued ahead of time against the monotonic time.perf_counter()
+timeline shared with the GameEngine clock. The scheduler thread sleeps until
+shortly before the next sound and spin-waits the rest, so a sound starts within
+a fraction of a millisecond of its time instead of whenever the 60 FPS loop
+comes around. The error between the scheduled and the actual play time is
+recorded per tag (e.g. the BPM) to track the jitter."""
+import heapq
+import itertools
+import threading
+import time
+import numpy as np
+from collections import deque
+from typing import Any, Hashable, Optional, Protocol
+
+SPIN_TIME = 0.002 # seconds spin-waited before a sound instead of sleeping
+MAX_ONSET_SAMPLES = 4096 # onset errors kept per tag
+
+
+class Playable(Protocol):
+    def play(self, loops: int = 0, maxtime: int = 0, fade_ms: int = 0) -> Any: ...
+
+
+class AudioScheduler:
+    """Plays sounds at given times of time.perf_counter() from a dedicated thread"""
+
+    def __init__(self, spin_time: float = SPIN_TIME, max_samples: int = MAX_ONSET_SAMPLES):
+        self.spin_time = spin_time
+        self.max_samples = max_samples
+        self.queue: list[tuple[float, int, Playable, int, Hashable]] = [] # heap of (play time, order, sound, maxtime, tag)
+        self.order = itertools.count() # keeps sounds scheduled at the same time in order
+        self.condition = threading.Condition()
+        self.onset_errors: dict[Hashable, deque[float]] = {}
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="AudioScheduler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+
+    def schedule(self, play_time: float, sound: Playable, maxtime: int = 0, tag: Hashable = None):
+        """Plays 'sound' at 'play_time' (time.perf_counter() seconds), right away if it is already past"""
+        with self.condition:
+            order = next(self.order)
+            heapq.heappush(self.queue, (play_time, order, sound, maxtime, tag))
+            if self.queue[0][1] == order: # new earliest sound, wake the thread up
+                self.condition.notify()
+
+    def onset_stats(self) -> dict[Hashable, tuple[int, float, float, float, float]]:
+        """(count, mean, p50, p99, max) of the onset errors in milliseconds, per tag"""
+        stats = {}
+        for tag, errors in list(self.onset_errors.items()):
+            errors_ms = np.array(errors) * 1e3
+            if len(errors_ms):
+                stats[tag] = (len(errors_ms), errors_ms.mean(), np.percentile(errors_ms, 50), np.percentile(errors_ms, 99), errors_ms.max())
+        return stats
+
+    def _run(self):
+        condition, queue = self.condition, self.queue
+        while True:
+            with condition:
+                if not self.running:
+                    return
+                if not queue:
+                    condition.wait()
+                    continue
+                delay = queue[0][0] - time.perf_counter()
+                if delay > self.spin_time:
+                    condition.wait(delay - self.spin_time)
+                    continue
+                play_time, _, sound, maxtime, tag = heapq.heappop(queue)
+            while time.perf_counter() < play_time:
+                pass
+            sound.play(maxtime=maxtime)
+            self._record(tag, time.perf_counter() - play_time)
+
+    def _record(self, tag: Hashable, error: float):
+        errors = self.onset_errors.get(tag)
+        if errors is None:
+            errors = self.onset_errors[tag] = deque(maxlen=self.max_samples)
+        errors.append(error)
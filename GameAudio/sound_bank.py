@@ -0,0 +1,60 @@
+"""Process-wide bank of the game sounds, each decoded once.
+
+get(path) returns the pygame Sound of an asset, decoding it on first use, and
+preload(paths) decodes a list in a thread pool without blocking, so the
+decoding overlaps the rest of the startup (pygame releases the GIL while
+SDL_mixer decodes). Decoded PCM is cached on disk, one file per asset, with the
+source's mtime and size and the mixer format in its header: later launches
+hand the cached samples straight to the mixer and skip the Vorbis decoding,
+and a changed asset or mixer format is decoded again."""
+import hashlib
+import struct
+import pygame
+from pathlib import Path
+from typing import Iterable, Optional
+from GameEngine.asset_bank import AssetBank
+
+SOUND_CACHE_PATH = Path("./.sound_cache/").absolute()
+SOUND_WORKERS = 4 # decoding threads, the cores of a Raspberry Pi
+PCM_MAGIC = b"SMPC"
+PCM_VERSION = 1
+PCM_HEADER = struct.Struct("<4sHqqiii") # magic, version, source mtime (ns) and size, mixer frequency, format and channels
+
+
+class SoundBank(AssetBank):
+    """Decoded sounds by source path, with a PCM cache in 'cache_dir' (None: no cache)"""
+
+    def __init__(self, cache_dir: Optional[Path] = SOUND_CACHE_PATH, workers: int = SOUND_WORKERS):
+        super().__init__(cache_dir, workers)
+
+    def get(self, path: Path) -> pygame.mixer.Sound:
+        """Sound of 'path', waiting for its preload or loading it now"""
+        return self._get(Path(path).absolute())
+
+    def preload(self, paths: Iterable[Path]):
+        """Starts loading 'paths' in the background"""
+        self._preload(Path(path).absolute() for path in paths)
+
+    def _cache_entry(self, path: Path) -> tuple[str, bytes, Path]:
+        stat = path.stat()
+        header = PCM_HEADER.pack(PCM_MAGIC, PCM_VERSION, stat.st_mtime_ns, stat.st_size, *pygame.mixer.get_init())
+        return f"{hashlib.sha1(str(path).encode()).hexdigest()}.pcm", header, path
+
+    def _decode(self, path: Path, source: Path) -> pygame.mixer.Sound:
+        return pygame.mixer.Sound(source)
+
+    def _serialize(self, sound: pygame.mixer.Sound) -> bytes:
+        return sound.get_raw()
+
+    def _deserialize(self, path: Path, data: memoryview) -> pygame.mixer.Sound:
+        return pygame.mixer.Sound(buffer=data)
+
+
+_shared_bank: Optional[SoundBank] = None
+
+def shared_bank() -> SoundBank:
+    """SoundBank of the process"""
+    global _shared_bank
+    if _shared_bank is None:
+        _shared_bank = SoundBank()
+    return _shared_bank
@@ -0,0 +1,105 @@
+"""Struct-of-arrays storage for the arrows and measure lines on the field.
+
+Spawn beats, target beats, lanes and colour ids are NumPy columns, so the y
+position and the on-screen mask of every object are computed in one vectorized
+pass per frame instead of one Python update() call per object. The store is
+also the pool of arrows: freed slots are recycled and every per-frame buffer is
+preallocated, so its steady-state updates do not allocate (drawing from it
+does, see Benchmarks.check_frame_allocations)."""
+import numpy as np
+from GameEngine.constants import ARROW_SIZE, HEIGHT, ZERO_Y, DESPAWN_Y
+
+DESPAWN_Y_OPERAND = np.array(DESPAWN_Y, dtype=np.float64) # 0-d, ufuncs convert Python and NumPy scalars to arrays on every call
+HEIGHT_OPERAND = np.array(HEIGHT, dtype=np.float64)
+COLUMNS = ("spawn_beat", "target_beat", "lane", "color_id", "alive", "generation", "y", "on_screen", "below_bottom")
+
+
+class ArrowStore:
+    """Arrows stored as NumPy columns, addressed by slot index
+
+    Removed slots go to a free list and are reused by the next add(), so slot
+    indices stay valid for the whole life of an arrow."""
+    __slots__ = ("half_height", "top_y", "beat_operand", "scale_operand", "size", "n_alive", "free_slots") + COLUMNS
+
+    def __init__(self, capacity: int = 256, half_height: int = ARROW_SIZE//2):
+        self.half_height = half_height
+        self.top_y = np.array(ZERO_Y - half_height, dtype=np.float64) # 0-d operands of update_positions()
+        self.beat_operand = np.zeros((), dtype=np.float64)
+        self.scale_operand = np.zeros((), dtype=np.float64)
+        self.spawn_beat = np.zeros(capacity, dtype=np.float64)
+        self.target_beat = np.zeros(capacity, dtype=np.float64)
+        self.lane = np.zeros(capacity, dtype=np.int8)
+        self.color_id = np.zeros(capacity, dtype=np.uint8)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.generation = np.zeros(capacity, dtype=np.uint32) # bumped by every add(), tells the arrows of a reused slot apart
+        # Buffers filled by update_positions()
+        self.y = np.zeros(capacity, dtype=np.float64)
+        self.on_screen = np.zeros(capacity, dtype=bool)
+        self.below_bottom = np.zeros(capacity, dtype=bool)
+        self.size = 0 # slots in use are all below this index
+        self.n_alive = 0
+        self.free_slots: list[int] = []
+
+    def __len__(self) -> int:
+        return self.n_alive
+
+    def add(self, spawn_beat: float, target_beat: float, lane: int = 0, color_id: int = 0) -> int:
+        """Adds an arrow and returns its slot"""
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            if self.size == len(self.alive):
+                self._grow()
+            slot = self.size
+            self.size += 1
+        self.spawn_beat[slot] = spawn_beat
+        self.target_beat[slot] = target_beat
+        self.lane[slot] = lane
+        self.color_id[slot] = color_id
+        self.alive[slot] = True
+        self.generation[slot] += 1
+        self.n_alive += 1
+        return slot
+
+    def remove(self, slot: int):
+        """Removes the arrow in 'slot'"""
+        self.alive[slot] = False
+        self.n_alive -= 1
+        if self.n_alive == 0: # everything is free, restart from the bottom
+            self.size = 0
+            self.free_slots.clear()
+        else:
+            self.free_slots.append(slot)
+
+    def update_positions(self, current_beat: float, pixels_per_beat: float) -> np.ndarray:
+        """Computes the y of every arrow. Returns the on-screen mask of the slots.
+
+        The mask is a buffer reused by the next call. Indexing the columns with
+        it selects the arrows on screen in slot order, extracting their slot
+        indices here would allocate the index array every frame."""
+        # Whole columns are processed, slicing would allocate views every frame
+        y, on_screen, below_bottom = self.y, self.on_screen, self.below_bottom
+        self.beat_operand[()] = current_beat
+        self.scale_operand[()] = pixels_per_beat
+        np.subtract(self.target_beat, self.beat_operand, out=y)
+        np.multiply(y, self.scale_operand, out=y)
+        np.add(y, self.top_y, out=y)
+        np.greater_equal(y, DESPAWN_Y_OPERAND, out=on_screen)
+        np.less(y, HEIGHT_OPERAND, out=below_bottom)
+        np.logical_and(on_screen, below_bottom, out=on_screen)
+        np.logical_and(on_screen, self.alive, out=on_screen)
+        return on_screen
+
+    def clear(self):
+        self.alive[:] = False
+        self.size = 0
+        self.n_alive = 0
+        self.free_slots.clear()
+
+    def _grow(self):
+        capacity = 2 * len(self.alive)
+        for name in COLUMNS:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
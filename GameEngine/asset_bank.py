@@ -0,0 +1,112 @@
+"""Bank of decoded game assets, each decoded once, with a disk cache.
+
+Base of the SoundBank and the ImageBank. An asset is loaded by key: get() waits
+for its preload or loads it now, and preload() loads a list in a thread pool
+without blocking, so the decoding overlaps the rest of the startup (pygame
+releases the GIL while SDL decodes). The decoded bytes are cached on disk, one
+file per asset, behind a header that describes the source and the format:
+later launches rebuild the asset from them and skip the decoding, and an asset
+whose header changed is decoded again.
+
+A subclass names the cache file and its header (_cache_entry), decodes the
+source (_decode), and converts the asset to and from the cached bytes
+(_serialize, _deserialize)."""
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Hashable, Iterable, Optional
+
+AssetKey = Hashable # source path, and what the subclass loads it at
+Asset = Any # pygame Sound, Surface
+
+
+class AssetBank:
+    """Decoded assets by key, with a cache of their decoded bytes in 'cache_dir' (None: no cache)"""
+
+    def __init__(self, cache_dir: Optional[Path], workers: int):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.assets: dict[AssetKey, Asset] = {}
+        self.pending: dict[AssetKey, Future] = {} # assets being preloaded
+        self.lock = threading.Lock()
+        self.executor: Optional[ThreadPoolExecutor] = None # started by the first preload
+        self.decoded = 0 # assets decoded from their source
+        self.cache_hits = 0 # assets read from the cache
+
+    def wait(self):
+        """Waits for every preload, raising the first error"""
+        with self.lock:
+            futures = list(self.pending.values())
+        for future in futures:
+            future.result()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def _get(self, key: AssetKey) -> Asset:
+        """Asset of 'key', waiting for its preload or loading it now"""
+        with self.lock:
+            asset = self.assets.get(key)
+            if asset is not None:
+                return asset
+            future = self.pending.get(key)
+        if future is not None:
+            return future.result()
+        asset = self._load(key)
+        with self.lock:
+            return self.assets.setdefault(key, asset)
+
+    def _preload(self, keys: Iterable[AssetKey]):
+        """Starts loading 'keys' in the background"""
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix=type(self).__name__)
+            for key in keys:
+                if key not in self.assets and key not in self.pending:
+                    self.pending[key] = self.executor.submit(self._load_pending, key)
+
+    def _load_pending(self, key: AssetKey) -> Asset:
+        asset = self._load(key)
+        with self.lock:
+            self.assets[key] = asset
+            del self.pending[key]
+        return asset
+
+    def _load(self, key: AssetKey) -> Asset:
+        """Rebuilds the asset of 'key' from the cache, or decodes it and caches it"""
+        name, header, source = self._cache_entry(key)
+        cache_path = self.cache_dir / name if self.cache_dir is not None else None
+        if cache_path is not None and cache_path.exists():
+            data = cache_path.read_bytes()
+            asset = self._deserialize(key, memoryview(data)[len(header):]) if data[:len(header)] == header else None
+            if asset is not None:
+                with self.lock:
+                    self.cache_hits += 1
+                return asset
+        asset = self._decode(key, source)
+        with self.lock:
+            self.decoded += 1
+        if cache_path is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_suffix(f".{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(header + self._serialize(asset))
+            tmp_path.replace(cache_path) # atomic, a concurrent launch never reads half a file
+        return asset
+
+    def _cache_entry(self, key: AssetKey) -> tuple[str, bytes, Any]:
+        """(cache file name, cache header, source handed to _decode()) of 'key'"""
+        raise NotImplementedError
+
+    def _decode(self, key: AssetKey, source: Any) -> Asset:
+        """Asset of 'key' decoded from its source"""
+        raise NotImplementedError
+
+    def _serialize(self, asset: Asset) -> bytes:
+        """Decoded bytes of 'asset', cached after the header"""
+        raise NotImplementedError
+
+    def _deserialize(self, key: AssetKey, data: memoryview) -> Optional[Asset]:
+        """Asset of 'key' rebuilt from its cached bytes, None if they do not fit"""
+        raise NotImplementedError
@@ -0,0 +1,185 @@
+"""Loader for StepMania .sm/.ssc charts with a compiled binary cache.
+
+A chart is compiled into per-lane arrays of beats, target times, colour ids and
+quantization ids. Compiled charts are written to a binary cache keyed by the
+hash of the chart file; reloading a song memory-maps the cached arrays and
+skips the parse step entirely."""
+import re
+import mmap
+import struct
+import hashlib
+import numpy as np
+from pathlib import Path
+from typing import NamedTuple, Optional
+from GameEngine.constants import COLOR_IDS, QUANTIZATIONS
+from GameEngine.chart_stream import quantization_color
+from GameEngine.tempo_map import TempoMap
+
+CHART_CACHE_PATH = Path("./.chart_cache/").absolute()
+CACHE_MAGIC = b"SMCC"
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct("<4sHHdIIIIIIII") # magic, version, lanes, offset, title and difficulty lengths, bpm and stop counts, note count per lane
+LANES = 4
+NOTE_CHARS = "124L" # tap, hold head, roll head, lift
+TAG_RE = re.compile(r"#([A-Za-z0-9]+):(.*?);", re.DOTALL)
+QUANTIZATION_IDS = {quantization: i for i, quantization in enumerate(QUANTIZATIONS)}
+
+
+class LaneChart(NamedTuple):
+    """Notes of one lane, sorted by beat"""
+    beats: np.ndarray # float64
+    times: np.ndarray # float64, seconds from the start of the music
+    color_ids: np.ndarray # uint8, index in COLORS
+    quant_ids: np.ndarray # uint8, index in QUANTIZATIONS
+
+class CompiledChart(NamedTuple):
+    """A dance-single chart ready to be played"""
+    title: str
+    difficulty: str
+    offset: float # seconds, as in #OFFSET
+    bpms: np.ndarray # (n, 2) float64 of (beat, bpm)
+    stops: np.ndarray # (n, 2) float64 of (beat, seconds)
+    lanes: tuple[LaneChart, ...]
+
+    def note_count(self) -> int:
+        return sum(len(lane.beats) for lane in self.lanes)
+
+
+def load_chart(path: "str | Path", difficulty: Optional[str] = None, cache_dir: Optional[Path] = CHART_CACHE_PATH) -> CompiledChart:
+    """Loads a chart, from the compiled cache if this file was compiled before.
+
+    'difficulty' picks the dance-single chart by name (e.g. "Hard"), the first one by default.
+    cache_dir = None disables the cache."""
+    data = Path(path).read_bytes()
+    cache_path = None
+    if cache_dir is not None:
+        key = hashlib.sha1(data + f"\0{difficulty}\0{CACHE_VERSION}".encode()).hexdigest()
+        cache_path = Path(cache_dir) / f"{key}.chart"
+        if cache_path.exists():
+            try:
+                return read_compiled_chart(cache_path)
+            except (ValueError, struct.error) as e:
+                print(f"Ignoring invalid chart cache {cache_path}: {e}")
+    chart = compile_chart(data.decode("utf-8", errors="replace"), difficulty)
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        write_compiled_chart(chart, cache_path)
+    return chart
+
+def compile_chart(text: str, difficulty: Optional[str] = None) -> CompiledChart:
+    """Parses the text of a .sm or .ssc file and compiles one of its dance-single charts"""
+    text = re.sub(r"//[^\n]*", "", text) # comments
+    song_tags: dict[str, str] = {}
+    charts: list[dict[str, str]] = [] # tags of each chart, on top of the song tags
+    for match in TAG_RE.finditer(text):
+        tag, value = match.group(1).upper(), match.group(2).strip()
+        if tag == "NOTEDATA": # .ssc: the following tags belong to a new chart
+            charts.append({})
+        elif tag == "NOTES" and (not charts or "NOTES" in charts[-1]): # .sm: one #NOTES per chart
+            fields = [field.strip() for field in value.split(":")]
+            if len(fields) < 6:
+                raise ValueError("Invalid #NOTES in .sm file, expected 6 fields")
+            charts.append({"STEPSTYPE": fields[0], "DIFFICULTY": fields[2], "NOTES": fields[5]})
+        elif charts:
+            charts[-1][tag] = value
+        else:
+            song_tags[tag] = value
+
+    candidates = [chart for chart in charts if chart.get("STEPSTYPE", "").lower() == "dance-single" and "NOTES" in chart]
+    if difficulty is not None:
+        candidates = [chart for chart in candidates if chart.get("DIFFICULTY", "").lower() == difficulty.lower()]
+    if not candidates:
+        raise ValueError(f"No dance-single chart{'' if difficulty is None else ' with difficulty ' + difficulty} found")
+    chart_tags = {**song_tags, **candidates[0]}
+
+    offset = float(chart_tags.get("OFFSET", "0") or 0)
+    bpms = _parse_beat_pairs(chart_tags.get("BPMS", ""))
+    if len(bpms) == 0:
+        raise ValueError("Chart has no #BPMS")
+    stops = _parse_beat_pairs(chart_tags.get("STOPS", ""))
+
+    lane_beats: list[list[float]] = [[] for _ in range(LANES)]
+    lane_quants: list[list[int]] = [[] for _ in range(LANES)]
+    for measure_index, measure in enumerate(chart_tags["NOTES"].split(",")):
+        rows = [row.strip() for row in measure.split() if row.strip()]
+        for row_index, row in enumerate(rows):
+            beat = 4 * measure_index + 4 * row_index / len(rows)
+            for lane, char in enumerate(row[:LANES]):
+                if char in NOTE_CHARS:
+                    lane_beats[lane].append(beat)
+                    lane_quants[lane].append(_row_quantization(row_index, len(rows)))
+
+    tempo_map = TempoMap(bpms.tolist(), stops.tolist(), origin_time=-offset)
+    lanes = []
+    for beats, quants in zip(lane_beats, lane_quants):
+        beats = np.array(beats, dtype=np.float64)
+        quant_ids = np.array([QUANTIZATION_IDS[quantization] for quantization in quants], dtype=np.uint8)
+        color_ids = np.array([COLOR_IDS[quantization_color(int(round(beat * 48)) % 48)] for beat in beats.tolist()], dtype=np.uint8)
+        lanes.append(LaneChart(beats, tempo_map.beats_to_times(beats), color_ids, quant_ids))
+    return CompiledChart(chart_tags.get("TITLE", ""), chart_tags.get("DIFFICULTY", ""), offset, bpms, stops, tuple(lanes))
+
+def write_compiled_chart(chart: CompiledChart, path: Path):
+    """Writes a compiled chart to the binary cache format"""
+    title, difficulty = chart.title.encode(), chart.difficulty.encode()
+    parts = [CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, LANES, chart.offset, len(title), len(difficulty),
+                               len(chart.bpms), len(chart.stops), *(len(lane.beats) for lane in chart.lanes))]
+    parts.append(_pad8(title + difficulty))
+    parts.append(np.ascontiguousarray(chart.bpms, dtype=np.float64).tobytes())
+    parts.append(np.ascontiguousarray(chart.stops, dtype=np.float64).tobytes())
+    for lane in chart.lanes:
+        parts.append(lane.beats.astype(np.float64).tobytes())
+        parts.append(lane.times.astype(np.float64).tobytes())
+        parts.append(_pad8(lane.color_ids.astype(np.uint8).tobytes()))
+        parts.append(_pad8(lane.quant_ids.astype(np.uint8).tobytes()))
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_bytes(b"".join(parts))
+    tmp_path.replace(path) # atomic, a concurrent reader never sees half a file
+
+def read_compiled_chart(path: Path) -> CompiledChart:
+    """Memory-maps a compiled chart; the arrays are read-only views on the file"""
+    with open(path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, lanes, offset, title_len, difficulty_len, n_bpms, n_stops, *counts = CACHE_HEADER.unpack_from(buffer, 0)
+    if magic != CACHE_MAGIC or version != CACHE_VERSION or lanes != LANES:
+        raise ValueError("unknown chart cache format")
+    position = CACHE_HEADER.size
+    title = bytes(buffer[position:position + title_len]).decode()
+    difficulty = bytes(buffer[position + title_len:position + title_len + difficulty_len]).decode()
+    position += _padded_len(title_len + difficulty_len)
+
+    def take(dtype, count: int) -> np.ndarray:
+        nonlocal position
+        array = np.frombuffer(buffer, dtype=dtype, count=count, offset=position)
+        position += _padded_len(array.nbytes)
+        return array
+
+    bpms = take(np.float64, 2 * n_bpms).reshape(n_bpms, 2)
+    stops = take(np.float64, 2 * n_stops).reshape(n_stops, 2)
+    lane_charts = tuple(LaneChart(take(np.float64, count), take(np.float64, count), take(np.uint8, count), take(np.uint8, count))
+                        for count in counts)
+    return CompiledChart(title, difficulty, offset, bpms, stops, lane_charts)
+
+
+def _parse_beat_pairs(value: str) -> np.ndarray:
+    """Parses "beat=value,beat=value" into a (n, 2) array sorted by beat"""
+    pairs = []
+    for item in value.split(","):
+        if "=" in item:
+            beat, amount = item.split("=")[:2]
+            pairs.append((float(beat), float(amount)))
+    pairs.sort()
+    return np.array(pairs, dtype=np.float64).reshape(len(pairs), 2)
+
+def _row_quantization(row_index: int, rows: int) -> int:
+    """Notes per measure needed to place this row, same 48ths of a beat as spawn_arrow_block()"""
+    ticks = row_index * 192 // rows if 192 % rows == 0 else round(row_index * 192 / rows)
+    for quantization in QUANTIZATIONS:
+        if ticks % (192 // quantization) == 0:
+            return quantization
+    return QUANTIZATIONS[-1]
+
+def _padded_len(length: int) -> int:
+    return (length + 7) // 8 * 8
+
+def _pad8(data: bytes) -> bytes:
+    return data + b"\0" * (_padded_len(len(data)) - len(data))
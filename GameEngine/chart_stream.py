@@ -0,0 +1,132 @@
+"""Streaming chart sources and the scheduler turning them into arrows.
+
+A chart source is any iterable of ChartNotes sorted by beat: the endless random
+generator, a compiled chart file or notes received from the network. The
+ChartScheduler pulls notes lazily and only materializes the ones inside a
+lookahead window as arrows, a few per step, so memory stays constant however
+long the song is and spawning is spread over the frames."""
+import heapq
+import numpy as np
+from typing import TYPE_CHECKING, Iterable, Iterator, NamedTuple, Optional
+from GameEngine.constants import COLOR_IDS, MEASURE_MARGIN
+
+if TYPE_CHECKING:
+    from GameEngine.chart_loader import CompiledChart
+    from GameEngine.game_engine import GameEngine
+
+LOOKAHEAD_TIME = 0.5 # seconds of notes materialized past the bottom of the screen
+MAX_SPAWNS_PER_STEP = 16 # the notes left over are spawned by the next steps
+
+
+def random_arrow_line(count: int, rng=np.random):
+    """Gets a random arrow line with 'count' arrows"""
+    arrow_line = np.zeros(4, dtype=bool)
+    arrow_line[:count] = True  # Set the first 'count' elements to True
+    rng.shuffle(arrow_line)  # Shuffle to randomize order
+    return tuple(arrow_line)
+
+def random_arrow_block(rng=np.random) -> "list[ tuple[ bool, bool, bool, bool] ]":
+    """Gets a random block of arrow lines for one measure"""
+    choices_p = { # num of arrows : probability
+        1: 1/12,
+        2: 1/3,
+        4: 1/2,
+        8: 1/12,}
+    keys = [i for i in choices_p.keys()]
+    values = [i for i in choices_p.values()]
+    return [random_arrow_line(rng.randint(1, 2), rng) for _ in range(rng.choice(keys, p=values))] # 4 beats
+
+
+def quantization_color(beat_offset: int) -> str:
+    """Gets the colour of an arrow from its offset inside the beat, in 48ths of a beat"""
+    if beat_offset == 0: # i % 48 == 0
+        return "red" # beat
+    elif beat_offset % 24 == 0:
+        return "blue" # 1/2 beat
+    elif beat_offset % 16 == 0:
+        return "purple" # 1/3 beat
+    elif beat_offset % 12 == 0:
+        return "green" # 1/4 beat
+    elif beat_offset % 8 == 0:
+        return "pink" # 1/6 beat
+    elif beat_offset % 6 == 0:
+        return "yellow" # 1/8 beat
+    elif beat_offset % 4 == 0:
+        return "cyan" # 1/16 beat
+    elif beat_offset % 3 == 0:
+        return "magenta" # 1/12 beat
+    return "white"
+
+class ChartNote(NamedTuple):
+    """A note of a chart source"""
+    beat: float # target beat
+    dir_index: int
+    color_id: int
+
+def random_notes(rng=np.random, start_beat: float = 4 * MEASURE_MARGIN) -> Iterator[ChartNote]:
+    """Endless chart of random_arrow_block() measures, generated one measure at a time"""
+    measure_beat = start_beat
+    while True:
+        arrow_lines = random_arrow_block(rng)
+        for i, arrow_line in enumerate(arrow_lines):
+            beat_offset = (i * (48 * 4 // len(arrow_lines))) % 48
+            color_id = COLOR_IDS[quantization_color(beat_offset)]
+            for dir_index in range(4):
+                if arrow_line[dir_index]:
+                    yield ChartNote(measure_beat + 4 * i / len(arrow_lines), dir_index, color_id)
+        measure_beat += 4
+
+def chart_notes(chart: "CompiledChart") -> Iterator[ChartNote]:
+    """Notes of a compiled chart, merged from its lanes in beat order"""
+    def lane_notes(dir_index: int) -> Iterator[ChartNote]:
+        lane = chart.lanes[dir_index]
+        for i in range(len(lane.beats)):
+            yield ChartNote(float(lane.beats[i]), dir_index, int(lane.color_ids[i]))
+    return heapq.merge(*(lane_notes(dir_index) for dir_index in range(len(chart.lanes))))
+
+
+class ChartScheduler:
+    """Pulls notes from a chart source and spawns them in a GameEngine as they come near
+
+    A source may yield None when it has no note ready yet (e.g. waiting for the
+    network); it is polled again on the next step."""
+
+    def __init__(self, notes: Iterable[Optional[ChartNote]], lookahead: float = LOOKAHEAD_TIME, max_spawns_per_step: int = MAX_SPAWNS_PER_STEP):
+        self.notes = iter(notes)
+        self.lookahead = lookahead
+        self.max_spawns_per_step = max_spawns_per_step
+        self.pending: Optional[ChartNote] = None # next note, pulled but not spawned yet
+        self.finished = False
+        self.spawned = 0
+
+    def spawn_until(self, engine: "GameEngine", horizon_beat: float) -> int:
+        """Spawns the notes with a target beat up to 'horizon_beat'. Returns the number of notes spawned."""
+        spawned = 0
+        while spawned < self.max_spawns_per_step:
+            note = self._peek()
+            if note is None or note.beat > horizon_beat:
+                break
+            self.pending = None
+            engine.spawn_note(note)
+            spawned += 1
+        self.spawned += spawned
+        return spawned
+
+    def skip_until(self, horizon_beat: float) -> int:
+        """Drops the notes with a target beat up to 'horizon_beat' without spawning them"""
+        skipped = 0
+        while skipped < self.max_spawns_per_step:
+            note = self._peek()
+            if note is None or note.beat > horizon_beat:
+                break
+            self.pending = None
+            skipped += 1
+        return skipped
+
+    def _peek(self) -> Optional[ChartNote]:
+        if self.pending is None and not self.finished:
+            try:
+                self.pending = next(self.notes)
+            except StopIteration:
+                self.finished = True
+        return self.pending
@@ -0,0 +1,15 @@
+"""Layout and timing constants shared by the engine and the pygame front-end."""
+
+DIR_DICT = {0: "left", 1: "down", 2: "up", 3: "right"}
+DIR_DICT_INV = {"left": 0, "down": 1, "up": 2, "right": 3}
+ARROW_SIZE = 100
+WIDTH, HEIGHT = 600, 800
+MEASURE_MARGIN = 1 # number of measures to summon the arrows before they reach the markers at ZERO_Y
+ZERO_Y = 80
+SCROLL_BPM = 120 # BPM at which the arrows scroll at the scroll speed, in pixels per second
+MIN_BPM = 1 # live BPM changes stop there
+DESPAWN_Y = -50 # arrows and measure lines above this y are removed
+MEASURE_LINE_H = 10
+COLORS = ("red", "blue", "purple", "green", "pink", "yellow", "cyan", "magenta", "white") # indexed by colour id
+COLOR_IDS = {color: i for i, color in enumerate(COLORS)}
+QUANTIZATIONS = (4, 8, 12, 16, 24, 32, 48, 64, 192) # notes per measure of each colour id
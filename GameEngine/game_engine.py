@@ -0,0 +1,373 @@
+"""Headless game-state engine for the stepmania game.
+
+Beat timing, measure spawning, arrow updates, miss detection and hit judgement
+live here. Nothing in this module touches the display or the mixer, so the
+engine can be stepped faster than realtime with an injected clock."""
+import time
+import math
+import numpy as np
+from collections import deque
+from typing import TYPE_CHECKING, Literal, Callable, Iterable, NamedTuple, Optional
+from GameEngine.lane_timeline import LaneTimeline
+from GameEngine.arrow_store import ArrowStore
+from GameEngine.tempo_map import TempoMap
+from GameEngine.judgement import Judge, JudgementStats
+from GameEngine.chart_stream import (ChartNote, ChartScheduler, chart_notes, random_notes, random_arrow_line, random_arrow_block,
+                                     quantization_color)
+from GameEngine.constants import (DIR_DICT, DIR_DICT_INV, ARROW_SIZE, WIDTH, HEIGHT, MEASURE_MARGIN, ZERO_Y, DESPAWN_Y,
+                                  MEASURE_LINE_H, COLORS, COLOR_IDS, SCROLL_BPM, MIN_BPM)
+if TYPE_CHECKING:
+    from GameEngine.replay import ReplayWriter
+
+FIXED_DT = 1 / 60 # default headless timestep
+LANE_INDICES = (0, 1, 2, 3) # range(4) would allocate a range object every frame on top of the iterator
+SCROLL_BEATS_PER_SECOND = SCROLL_BPM / 60 # a float, SCROLL_SPEED * 60 would allocate an int every call
+
+
+class ManualClock:
+    """Deterministic clock that only moves when advanced, for headless runs"""
+
+    def __init__(self, start_time: float = 0.0):
+        self.t = start_time
+
+    def now(self) -> float:
+        return self.t
+
+    def advance(self, dt: float) -> float:
+        self.t += dt
+        return self.t
+
+class PerfCounterClock:
+    """Realtime clock backed by time.perf_counter()"""
+
+    def now(self) -> float:
+        return time.perf_counter()
+
+
+class GameInput(NamedTuple):
+    """An input fed to GameEngine.step()
+
+    kind "hit": player 1 hits lane 'dir_index'
+    kind "spawn": player 2 spawns an arrow in lane 'dir_index', costing 'value' points
+    kind "bpm": adds 'value' to the BPM
+    kind "speed": multiplies the scroll speed by 'value'
+    kind "toggle_random": toggles random arrow generation
+
+    'time' is when the input was captured, on the engine's clock. Hits are judged
+    at that time instead of the time of the step; None means the time of the step."""
+    kind: Literal["hit", "spawn", "bpm", "speed", "toggle_random"]
+    dir_index: int = 0
+    value: float = 0.0
+    time: Optional[float] = None
+
+class GameEvent(NamedTuple):
+    """An event produced by GameEngine.step(), for the front-end to play sounds and effects"""
+    kind: Literal["measure", "hit", "miss", "spawn"]
+    dir_index: int
+    time: float
+
+
+class ScoreRecorder:
+    """Class to record the score of a player"""
+
+    def __init__(self, initial_score: int = 0, judge: Optional[Judge] = None):
+        """Class to record the score of a player, judging its hits with 'judge'"""
+        self.score = initial_score
+        self.combo = 0
+        self.judge = judge if judge is not None else Judge()
+        self.stats = JudgementStats(self.judge)
+
+    def judge_hit(self, dir_index: int, offset: float) -> int:
+        """Judges and scores a hit 'offset' seconds after its arrow's target. Returns the tier, judge.miss if not a hit."""
+        tier = self.judge.judge(offset)
+        if tier != self.judge.miss:
+            self.register_hit(self.judge.points[tier])
+            self.stats.record(dir_index, tier, offset)
+        return tier
+
+    def register_missed_arrow(self, dir_index: int):
+        """Scores an arrow of lane 'dir_index' that nobody hit"""
+        self.register_miss(-self.judge.points[self.judge.miss])
+        self.stats.record_miss(dir_index)
+
+    def register_hit(self, points: int = 1):
+        """Registers a hit"""
+        self.score += points
+        self.combo += 1
+
+    def register_miss(self, points: int = 1):
+        """Registers a miss"""
+        self.score -= points
+        self.combo = 0
+
+
+def despawn_delay(scroll_speed: float, half_height: int = ARROW_SIZE//2) -> float:
+    """Time after its target at which an object scrolls above DESPAWN_Y, in beats if 'scroll_speed' is in pixels per beat"""
+    return (ZERO_Y - half_height - DESPAWN_Y) / scroll_speed
+
+def spawn_lead(scroll_speed: float, half_height: int = ARROW_SIZE//2) -> float:
+    """Time before its target at which an object enters the screen from the bottom, in beats if 'scroll_speed' is in pixels per beat"""
+    return (HEIGHT - ZERO_Y + half_height) / scroll_speed
+
+
+class GameEngine:
+    """Pure game state of a stepmania game, advanced with step(dt, inputs)
+
+    Arrows and measure lines live in ArrowStores; each lane's LaneTimeline holds
+    the store slots of its arrows sorted by target beat for judgement. Arrows
+    scroll with the beat of the TempoMap, so a BPM change changes their speed
+    but neither their position nor their target beat."""
+
+    def __init__(self, clock=None):
+        self.clock = clock if clock is not None else ManualClock()
+
+        self.is_p2 = False # whether p2 is playing
+        self.score_recorder = ScoreRecorder(10)
+        self.score_recorder_p2 = ScoreRecorder(10)
+
+        self.SCROLL_SPEED = 350 # pixels per second at SCROLL_BPM
+        self.tempo_map = TempoMap(((0, 120),))
+        self.is_gen_random = True # whether to generate random arrow blocks
+
+        self.arrow_store = ArrowStore()
+        self.measure_line_store = ArrowStore(16, MEASURE_LINE_H//2)
+        self.arrows: tuple[LaneTimeline, ...] = tuple(LaneTimeline() for _ in range(4)) # Arrow slots for each direction
+        self.measure_lines = LaneTimeline() # measure_line_store slots
+        self.events: list[GameEvent] = [] # reused by every step
+        self._expired: list[int] = []
+
+        self.time = 0
+        self.beat = 0 # beat at self.time
+        self.start_time = 0
+        self.next_measure_beat = 0
+
+        self.chart_scheduler: Optional[ChartScheduler] = None # streams the notes of the chart being played
+        self.arrow_block_queue = deque() # blocks spawned at the next measures, on top of the chart
+        self.do_measure : Callable[[], None] = None # Function to call when a measure is reached
+        self.recorder: Optional["ReplayWriter"] = None # records the session when set, see replay.py
+
+    @property
+    def BPM(self) -> float:
+        return self.tempo_map.bpm_at(self.time)
+
+    @BPM.setter
+    def BPM(self, bpm: float):
+        """Changes the BPM from now on, never below MIN_BPM"""
+        self.tempo_map.set_bpm(self.time, max(bpm, MIN_BPM))
+
+    def pixels_per_beat(self) -> float:
+        return self.SCROLL_SPEED / SCROLL_BEATS_PER_SECOND
+
+    def start(self):
+        """Resets the timeline to the clock's current time, beat 0 being now"""
+        bpm = self.BPM
+        self.time = self.clock.now()
+        self.start_time = self.time
+        self.tempo_map = TempoMap(((0, bpm),), origin_time=self.start_time)
+        self.beat = 0
+        self.next_measure_beat = 0
+        if self.recorder is not None:
+            self.recorder.record_start(self.time)
+
+    def update(self, inputs: Iterable[GameInput] = ()) -> list[GameEvent]:
+        """Steps the engine up to the clock's current time"""
+        return self.step(self.clock.now() - self.time, inputs)
+
+    def step(self, dt: float, inputs: Iterable[GameInput] = ()) -> list[GameEvent]:
+        """Advances the game by 'dt' seconds then applies 'inputs'. Returns the events that happened.
+
+        The returned list is reused by the next step, consume it before stepping again."""
+        self.time += dt
+        current_time = self.time
+        tempo_map = self.tempo_map
+        self.beat = current_beat = tempo_map.time_to_beat(current_time)
+        events = self.events
+        events.clear()
+
+        # Spawn new arrows at whole measures (4 beats)
+        while current_beat >= self.next_measure_beat:
+            measure_beat = self.next_measure_beat
+            self.next_measure_beat += 4
+            if not self.is_gen_random:
+                continue
+            if len(self.arrow_block_queue) > 0:
+                block = self.arrow_block_queue.popleft()
+                self.spawn_arrow_block(measure_beat, block)
+            if self.do_measure:
+                self.do_measure()
+            target_beat = measure_beat + 4 * MEASURE_MARGIN
+            self.measure_lines.insert(target_beat, self.measure_line_store.add(measure_beat, target_beat)) # spawn measure line
+            events.append(GameEvent("measure", 0, tempo_map.beat_to_time(measure_beat)))
+
+        # Chart notes entering the lookahead window, at least up to the bottom of the screen
+        pixels_per_beat = self.pixels_per_beat()
+        if self.chart_scheduler is not None:
+            horizon_beat = max(tempo_map.time_to_beat(current_time + self.chart_scheduler.lookahead), current_beat + spawn_lead(pixels_per_beat))
+            if self.is_gen_random:
+                self.chart_scheduler.spawn_until(self, horizon_beat)
+            else:
+                self.chart_scheduler.skip_until(horizon_beat)
+
+        # Misses
+        expired = self._expired
+        self.measure_lines.expire_before(current_beat - despawn_delay(pixels_per_beat, MEASURE_LINE_H//2), expired)
+        if expired: # iterating an empty list still allocates its iterator
+            for slot in expired:
+                self.measure_line_store.remove(slot)
+            expired.clear()
+        arrow_limit = current_beat - despawn_delay(pixels_per_beat)
+        for dir_index in LANE_INDICES:
+            self.arrows[dir_index].expire_before(arrow_limit, expired)
+            if not expired:
+                continue
+            for slot in expired:
+                self.arrow_store.remove(slot)
+                self.score_recorder.register_missed_arrow(dir_index)
+                self.score_recorder_p2.register_hit(2)
+                events.append(GameEvent("miss", dir_index, current_time))
+            expired.clear()
+
+        # Inputs
+        recorder = self.recorder
+        for game_input in inputs:
+            if recorder is not None:
+                recorder.record_input(game_input)
+            if game_input.kind == "hit":
+                hit_time = current_time if game_input.time is None else min(game_input.time, current_time) # never judge in the future
+                if self.do_arrow_hit(game_input.dir_index, hit_time):
+                    events.append(GameEvent("hit", game_input.dir_index, hit_time))
+            elif game_input.kind == "spawn":
+                self.spawn_arrow_now(game_input.dir_index)
+                self.is_p2 = True
+                if game_input.value:
+                    self.score_recorder_p2.register_miss(game_input.value)
+                events.append(GameEvent("spawn", game_input.dir_index, current_time))
+            elif game_input.kind == "bpm":
+                self.BPM += game_input.value
+            elif game_input.kind == "speed":
+                self.SCROLL_SPEED = self.SCROLL_SPEED * game_input.value
+            elif game_input.kind == "toggle_random":
+                self.is_gen_random = not self.is_gen_random
+            else:
+                raise ValueError(f"Invalid input kind {game_input.kind}")
+        if recorder is not None:
+            recorder.record_step(dt)
+        return events
+
+    def run(self, duration: float, dt: float = FIXED_DT, input_source: Optional[Callable[["GameEngine"], Iterable[GameInput]]] = None):
+        """Runs the engine headless for 'duration' seconds of game time with a fixed timestep.
+
+        'input_source' is called before each step and returns the inputs for that step."""
+        end_time = self.time + duration
+        while self.time < end_time:
+            inputs = input_source(self) if input_source else ()
+            self.step(dt, inputs)
+
+    def do_arrow_hit(self, dir_index: int, current_time: float) -> bool:
+        """Judges a hit on lane 'dir_index'. Returns True if an arrow was hit."""
+        lane = self.arrows[dir_index]
+        tempo_map = self.tempo_map
+        window = self.score_recorder.judge.window
+        end_beat = tempo_map.time_to_beat(current_time + window)
+        index = lane.find_first_between(tempo_map.time_to_beat(current_time - window), end_beat)
+        # Arrows on the beat of a stop stay in the beat window during the whole stop, skip the ones too old
+        while index is not None and tempo_map.beat_to_time(lane.times[index]) <= current_time - window:
+            index = lane.find_first_between(math.nextafter(lane.times[index], math.inf), end_beat)
+        if index is None or self.score_recorder.judge_hit(dir_index, current_time - tempo_map.beat_to_time(lane.times[index])) == self.score_recorder.judge.miss:
+            return False
+        self.arrow_store.remove(lane.remove_at(index)) # only hit one arrow
+        self.score_recorder_p2.register_miss()
+        return True
+
+    def visible_arrows(self) -> np.ndarray:
+        """Updates the arrow positions and returns the on-screen mask of the arrow_store slots"""
+        return self.arrow_store.update_positions(self.beat, self.pixels_per_beat())
+
+    def visible_measure_lines(self) -> np.ndarray:
+        """Updates the measure line positions and returns the on-screen mask of the measure_line_store slots"""
+        return self.measure_line_store.update_positions(self.beat, self.pixels_per_beat())
+
+    def spawn_arrow(self, direction: Literal["left","up","right","down"], color: Literal["blue","red","green","yellow","purple","orange","cyan","white"], spawn_beat: float):
+        """Spawns an arrow at a given beat, reaching the markers MEASURE_MARGIN measures later"""
+        target_beat = spawn_beat + 4 * MEASURE_MARGIN
+        dir_index = DIR_DICT_INV[direction]
+        slot = self.arrow_store.add(spawn_beat, target_beat, dir_index, COLOR_IDS[color])
+        self.arrows[dir_index].insert(target_beat, slot)
+
+    def spawn_arrow_block(self, measure_begin_beat: float, arrow_lines: "list[ tuple[ bool, bool, bool, bool] ]"):
+        """Spawns a block of arrows at a given beat"""
+        if len(arrow_lines) == 0:
+            return
+
+        beat_offset_step = 4 / len(arrow_lines)
+
+        for i, arrow_line in enumerate(arrow_lines):
+            # Supported up to 24 beats per tempo
+            if (48*4) % len(arrow_lines) != 0:
+                raise ValueError(f"Invalid number of arrows {len(arrow_lines)} for a measure, should divide 48*4.")
+
+            beat_offset = (i * (48 * 4 // len(arrow_lines))) % 48
+            color = quantization_color(beat_offset)
+
+            if arrow_line[0]:
+                self.spawn_arrow("left", color, measure_begin_beat + beat_offset_step * i)
+            if arrow_line[1]:
+                self.spawn_arrow("down", color, measure_begin_beat + beat_offset_step * i)
+            if arrow_line[2]:
+                self.spawn_arrow("up", color, measure_begin_beat + beat_offset_step * i)
+            if arrow_line[3]:
+                self.spawn_arrow("right", color, measure_begin_beat + beat_offset_step * i)
+
+    def schedule_chart(self, chart, music_start_time: Optional[float] = None):
+        """Schedules every note of a CompiledChart (see chart_loader), the music starting at 'music_start_time'
+
+        The tempo map is replaced by the chart's BPM changes and stops, so the beats
+        and measure lines follow the chart's beats. The notes are streamed by a ChartScheduler."""
+        if music_start_time is None:
+            music_start_time = self.time
+        if self.recorder is not None:
+            self.recorder.record_chart(music_start_time)
+        self.tempo_map = TempoMap(chart.bpms.tolist(), chart.stops.tolist(), origin_time=music_start_time - chart.offset)
+        self.beat = self.tempo_map.time_to_beat(self.time)
+        self.next_measure_beat = 4 * math.ceil(self.beat / 4)
+        self.chart_scheduler = ChartScheduler(chart_notes(chart))
+
+    def spawn_note(self, note: ChartNote):
+        """Spawns the arrow of a chart note"""
+        target_beat = note.beat
+        slot = self.arrow_store.add(target_beat - 4 * MEASURE_MARGIN, target_beat, note.dir_index, note.color_id)
+        self.arrows[note.dir_index].insert(target_beat, slot)
+
+    def spawn_arrow_now(self, dir_index: int):
+        """Spawns an arrow now"""
+        self.spawn_arrow(DIR_DICT[dir_index], "white", self.beat + 1)
+
+
+def autoplay_inputs(engine: GameEngine) -> list[GameInput]:
+    """Input source hitting every arrow that reaches the markers, for headless runs"""
+    inputs = []
+    for dir_index, lane in enumerate(engine.arrows):
+        index = lane.peek()
+        if index is not None and lane.times[index] <= engine.beat:
+            inputs.append(GameInput("hit", dir_index))
+    return inputs
+
+
+if __name__ == "__main__":
+    # Soak test: one hour of streamed random notes played by the autoplayer
+    np.random.seed(0)
+    engine = GameEngine(ManualClock())
+    engine.chart_scheduler = ChartScheduler(random_notes())
+    engine.start()
+    max_arrows = 0
+    def track_arrows(engine: GameEngine) -> list[GameInput]:
+        global max_arrows
+        max_arrows = max(max_arrows, len(engine.arrow_store))
+        return autoplay_inputs(engine)
+    t0 = time.perf_counter()
+    engine.run(3600, FIXED_DT, track_arrows)
+    elapsed = time.perf_counter() - t0
+    print(f"Simulated 3600s in {elapsed:.2f}s ({3600/elapsed:.0f}x realtime)")
+    print(f"Spawned {engine.chart_scheduler.spawned} notes, at most {max_arrows} arrows alive at once (store capacity {len(engine.arrow_store.alive)})")
+    print(f"Score P1: {engine.score_recorder.score} (combo: {engine.score_recorder.combo}), score P2: {engine.score_recorder_p2.score}")
+    print(f"Judgements P1: {engine.score_recorder.stats.summary()}")
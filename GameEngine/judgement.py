@@ -0,0 +1,175 @@
+"""Tiered hit judgement and streaming statistics of the hit offsets.
+
+A hit is judged by its offset (hit time - target time, negative when early)
+against tiers of growing windows; beyond the last one it is not a hit. Each
+player has a JudgementStats keeping, in fixed memory however long the session,
+the count of every tier, the mean and standard deviation of the offsets
+(Welford), the early/late bias of each lane and a histogram of the offsets in
+fixed buckets.
+
+Judge.match_hits() judges a whole lane at once against its precomputed target
+times, with the same rule as the live engine, for headless re-scoring."""
+import math
+import numpy as np
+from typing import NamedTuple
+
+OFFSET_BUCKET = 0.002 # seconds, width of a histogram bucket
+LANES = 4
+
+
+class Tier(NamedTuple):
+    """Hits with |offset| < window (seconds) get this tier, unless a narrower one matches"""
+    name: str
+    window: float
+    points: int
+
+TIERS = (
+    Tier("Marvelous", 0.0225, 4),
+    Tier("Perfect", 0.045, 3),
+    Tier("Great", 0.070, 2),
+    Tier("Good", 0.100, 1), # the former single hit window
+)
+MISS_POINTS = 1 # taken from the score by an arrow nobody hit
+
+
+class Judge:
+    """Turns hit offsets into tier indices, len(tiers) being a miss"""
+
+    def __init__(self, tiers: tuple[Tier, ...] = TIERS, miss_points: int = MISS_POINTS):
+        if any(a.window >= b.window for a, b in zip(tiers, tiers[1:])):
+            raise ValueError("Tier windows must be increasing")
+        self.tiers = tiers
+        self.miss = len(tiers) # tier index of a miss
+        self.names = tuple(tier.name for tier in tiers) + ("Miss",)
+        self.windows = np.array([tier.window for tier in tiers])
+        self.points = tuple(tier.points for tier in tiers) + (-miss_points,)
+        self.window = tiers[-1].window # outer window, no hit beyond
+        self._window_list = self.windows.tolist()
+
+    def judge(self, offset: float) -> int:
+        """Tier index of a hit 'offset' seconds after its target, self.miss if outside every window"""
+        distance = abs(offset)
+        for tier, window in enumerate(self._window_list):
+            if distance < window:
+                return tier
+        return self.miss
+
+    def judge_many(self, offsets: np.ndarray) -> np.ndarray:
+        """judge() of every offset (NaN is a miss)"""
+        distances = np.abs(np.asarray(offsets, dtype=np.float64))
+        tiers = np.searchsorted(self.windows, distances, side="right")
+        tiers[np.isnan(distances)] = self.miss
+        return tiers
+
+    def match_hits(self, target_times: np.ndarray, hit_times: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Matches the hits of one lane to its arrows as GameEngine.do_arrow_hit() does live
+
+        Both arrays are sorted times in seconds. Each hit takes the earliest arrow not
+        hit yet within the outer window. Returns the index of the arrow taken by each
+        hit (-1 for none) and the offset of each hit (NaN for none).
+
+        Hits further apart than two windows never compete for an arrow, so the hits
+        are split into such clusters, all matched at once: in every pass each pending
+        hit proposes its earliest free arrow, and in each cluster the proposals are
+        accepted up to the first one already taken by an earlier hit, from which the
+        next pass goes on. Passes are as many as the longest chain of conflicts."""
+        target_times = np.asarray(target_times, dtype=np.float64)
+        hit_times = np.asarray(hit_times, dtype=np.float64)
+        window = self.window
+        free_arrows = np.ones(len(target_times), dtype=bool)
+        matched = np.full(len(hit_times), -1, dtype=np.intp)
+        clusters = np.concatenate(([0], np.cumsum(np.diff(hit_times) >= 2 * window)))
+        pending = np.arange(len(hit_times))
+        while len(pending):
+            hits = hit_times[pending]
+            free = np.flatnonzero(free_arrows)
+            free_times = target_times[free]
+            candidates = np.searchsorted(free_times, hits - window, side="right") # earliest free arrow after the window start
+            hitting = np.flatnonzero(candidates < len(free))
+            hitting = hitting[free_times[candidates[hitting]] < hits[hitting] + window]
+            proposals = candidates[hitting] # non-decreasing, a repeat means an earlier hit of the cluster took that arrow
+            losers = hitting[np.flatnonzero(proposals[1:] == proposals[:-1]) + 1]
+            first_loser = np.full(clusters[-1] + 1 if len(clusters) else 0, len(hits)) # position in 'pending' of the first loser of each cluster
+            first_loser[clusters[pending[losers[::-1]]]] = losers[::-1] # the earliest one is written last
+            accepted = hitting[hitting < first_loser[clusters[pending[hitting]]]]
+            arrows = free[candidates[accepted]]
+            matched[pending[accepted]] = arrows
+            free_arrows[arrows] = False
+            positions = np.arange(len(pending))
+            pending = pending[positions >= first_loser[clusters[pending]]]
+        offsets = np.full(len(hit_times), np.nan)
+        hit = matched >= 0
+        offsets[hit] = hit_times[hit] - target_times[matched[hit]]
+        return matched, offsets
+
+
+class JudgementStats:
+    """Streaming statistics of the judgements of one player, in O(1) memory"""
+
+    def __init__(self, judge: Judge, lanes: int = LANES, bucket: float = OFFSET_BUCKET):
+        self.judge = judge
+        self.bucket = bucket
+        self.tier_counts = [0] * (len(judge.tiers) + 1) # the last one counts the misses
+        self.count = 0 # hits
+        self.mean = 0.0 # of the hit offsets
+        self.m2 = 0.0 # sum of squared deviations from the mean
+        self.lane_counts = [0] * lanes
+        self.lane_sums = [0.0] * lanes # of the offsets, for the bias
+        self.histogram = [0] * (2 * math.ceil(judge.window / bucket)) # offsets from -window to +window
+        self.half_buckets = len(self.histogram) // 2
+
+    def record(self, lane: int, tier: int, offset: float):
+        """Records a hit of 'tier' on 'lane', 'offset' seconds late"""
+        self.tier_counts[tier] += 1
+        self.count += 1
+        delta = offset - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (offset - self.mean)
+        self.lane_counts[lane] += 1
+        self.lane_sums[lane] += offset
+        bucket = min(max(math.floor(offset / self.bucket) + self.half_buckets, 0), len(self.histogram) - 1)
+        self.histogram[bucket] += 1
+
+    def record_miss(self, lane: int):
+        self.tier_counts[self.judge.miss] += 1
+
+    def record_many(self, lanes: np.ndarray, tiers: np.ndarray, offsets: np.ndarray):
+        """record() of a batch of hits, and record_miss() of the entries of tier judge.miss"""
+        lanes, tiers = np.asarray(lanes), np.asarray(tiers)
+        offsets = np.asarray(offsets, dtype=np.float64)
+        for tier, count in enumerate(np.bincount(tiers, minlength=len(self.tier_counts)).tolist()):
+            self.tier_counts[tier] += count
+        hit = tiers != self.judge.miss
+        lanes, offsets = lanes[hit], offsets[hit]
+        if not len(offsets):
+            return
+        count, mean = len(offsets), float(offsets.mean()) # merged with Chan's parallel formula
+        delta = mean - self.mean
+        total = self.count + count
+        self.m2 += float(((offsets - mean) ** 2).sum()) + delta * delta * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+        lane_counts = np.bincount(lanes, minlength=len(self.lane_counts)).tolist()
+        lane_sums = np.bincount(lanes, offsets, minlength=len(self.lane_counts)).tolist()
+        for lane in range(len(self.lane_counts)):
+            self.lane_counts[lane] += lane_counts[lane]
+            self.lane_sums[lane] += lane_sums[lane]
+        buckets = np.clip(np.floor(offsets / self.bucket).astype(np.intp) + self.half_buckets, 0, len(self.histogram) - 1)
+        for bucket, count in enumerate(np.bincount(buckets, minlength=len(self.histogram)).tolist()):
+            self.histogram[bucket] += count
+
+    def stddev(self) -> float:
+        return math.sqrt(self.m2 / self.count) if self.count else 0.0
+
+    def lane_bias(self) -> list[float]:
+        """Mean offset of each lane, negative when the player is early"""
+        return [total / count if count else 0.0 for total, count in zip(self.lane_sums, self.lane_counts)]
+
+    def bucket_bounds(self, bucket: int) -> tuple[float, float]:
+        low = (bucket - self.half_buckets) * self.bucket
+        return low, low + self.bucket
+
+    def summary(self) -> str:
+        tiers = ", ".join(f"{name} {count}" for name, count in zip(self.judge.names, self.tier_counts))
+        bias = " ".join(f"{bias * 1e3:+.1f}" for bias in self.lane_bias())
+        return f"{tiers}; offset {self.mean * 1e3:+.1f} ± {self.stddev() * 1e3:.1f} ms, lane bias {bias} ms"
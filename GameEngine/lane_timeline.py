@@ -0,0 +1,103 @@
+"""Sorted per-lane timeline of arrows.
+
+Target beats are kept sorted in a flat array so a hit is one binary search
+inside the judgement window, and misses expire from the head of the lane by
+moving an index instead of removing list elements."""
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Any, Iterator, Optional
+
+COMPACT_MIN_HEAD = 1024 # don't bother compacting short lanes
+
+
+class LaneTimeline:
+    """Arrows of one lane sorted by target beat
+
+    Hit arrows are tombstoned (their item set to None) and skipped, expired arrows
+    are dropped by advancing 'head'. The dead prefix is compacted once it makes up
+    half of the storage, so every operation is amortized O(1) apart from the search."""
+    __slots__ = ("times", "items", "head", "n_alive")
+
+    def __init__(self):
+        self.times = array("d") # target beats, sorted
+        self.items: list[Any] = [] # arrow attached to each time, None once hit
+        self.head = 0 # index of the first entry not expired
+        self.n_alive = 0
+
+    def __len__(self) -> int:
+        return self.n_alive
+
+    def insert(self, target_time: float, item: Any):
+        """Inserts an arrow, O(1) when it is the latest one of the lane"""
+        if len(self.times) == 0 or target_time >= self.times[-1]:
+            self.times.append(target_time)
+            self.items.append(item)
+        else:
+            i = bisect_right(self.times, target_time, self.head)
+            self.times.insert(i, target_time)
+            self.items.insert(i, item)
+        self.n_alive += 1
+
+    def find_first_between(self, start_time: float, end_time: float) -> Optional[int]:
+        """Index of the earliest alive arrow with start_time <= time <= end_time, or None"""
+        times, items = self.times, self.items
+        i = bisect_left(times, start_time, self.head)
+        n = len(times)
+        while i < n and times[i] <= end_time:
+            if items[i] is not None:
+                return i
+            i += 1
+        return None
+
+    def remove_at(self, index: int) -> Any:
+        """Removes the arrow at 'index' (from find_first_between) and returns it"""
+        item = self.items[index]
+        self.items[index] = None
+        self.n_alive -= 1
+        return item
+
+    def peek(self) -> Optional[int]:
+        """Index of the earliest alive arrow, or None"""
+        items = self.items
+        for i in range(self.head, len(items)):
+            if items[i] is not None:
+                self.head = i # skip the hit arrows for the next lookups
+                return i
+        return None
+
+    def expire_before(self, time_limit: float, expired: list[Any]):
+        """Drops the arrows with a target time before 'time_limit', appending the ones not hit to 'expired'"""
+        times, items = self.times, self.items
+        i = self.head
+        n = len(times)
+        if i == n or times[i] >= time_limit: # nothing to expire, the common case
+            return
+        while i < n and times[i] < time_limit:
+            if items[i] is not None:
+                expired.append(items[i])
+                items[i] = None
+                self.n_alive -= 1
+            i += 1
+        self.head = i
+        if self.head >= COMPACT_MIN_HEAD and 2 * self.head >= n:
+            self._compact()
+
+    def iter_between(self, start_time: float, end_time: float) -> Iterator[Any]:
+        """Iterates over the alive arrows with start_time <= time < end_time"""
+        times, items = self.times, self.items
+        begin = bisect_left(times, start_time, self.head)
+        end = bisect_left(times, end_time, begin)
+        for i in range(begin, end):
+            if items[i] is not None:
+                yield items[i]
+
+    def clear(self):
+        del self.times[:]
+        self.items.clear()
+        self.head = 0
+        self.n_alive = 0
+
+    def _compact(self):
+        del self.times[:self.head]
+        del self.items[:self.head]
+        self.head = 0
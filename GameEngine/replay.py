@@ -0,0 +1,190 @@
+"""Append-only binary replay log of a session, and headless re-scoring.
+
+A replay is a header (magic, version, record size, seed of the random chart,
+chart path and difficulty) followed by fixed-size records (kind, lane, time,
+value): the inputs applied by each engine step, then the step itself with its
+dt, plus the engine start and the chart scheduling. Stepping a GameEngine
+through the records replays the session exactly, far faster than realtime.
+
+ReplayWriter packs the records into a bytearray in the frame loop and hands
+full blocks to a writer thread, so the frame loop never waits for the disk. A
+file cut short by a crash replays up to its last complete record.
+
+Run from the repository root to re-score replays across the CPU cores, e.g.
+with a stricter Marvelous window:
+    python -m GameEngine.replay replays/*.smr --tiers Marvelous:0.015:4 Perfect:0.045:3 Great:0.07:2 Good:0.1:1"""
+import argparse
+import math
+import os
+import queue
+import struct
+import threading
+import time
+import numpy as np
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+from GameEngine.game_engine import GameEngine, GameInput, ManualClock, ScoreRecorder
+from GameEngine.chart_stream import ChartScheduler, random_notes
+from GameEngine.chart_loader import load_chart
+from GameEngine.judgement import Judge, Tier, TIERS
+
+REPLAY_DIR = Path("./replays/").absolute()
+REPLAY_MAGIC = b"SMRP"
+REPLAY_VERSION = 1
+REPLAY_HEADER = struct.Struct("<4sHHqHH") # magic, version, record size, seed, chart path and difficulty lengths
+RECORD = struct.Struct("<BBdd") # kind, lane, time (NaN: none), value
+RECORD_DTYPE = np.dtype([("kind", "u1"), ("lane", "u1"), ("time", "<f8"), ("value", "<f8")]) # RECORD, for np.frombuffer
+FLUSH_BYTES = 64 * 1024 # buffered before a block goes to the writer thread
+
+START, STEP, CHART, HIT, SPAWN, BPM, SPEED, TOGGLE_RANDOM = range(8)
+INPUT_KINDS = {"hit": HIT, "spawn": SPAWN, "bpm": BPM, "speed": SPEED, "toggle_random": TOGGLE_RANDOM}
+INPUT_NAMES = {kind: name for name, kind in INPUT_KINDS.items()}
+INTEGER_KINDS = (SPAWN,) # their value is points, an int stored in the float of the record
+
+
+class ReplayHeader(NamedTuple):
+    seed: int
+    chart_path: str # "" for the random chart of 'seed'
+    difficulty: str
+
+
+class ReplayWriter:
+    """Records a session into a replay file, attached to GameEngine.recorder"""
+
+    def __init__(self, path: Path, seed: int, chart_path: Optional[Path] = None, difficulty: str = ""):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, "wb")
+        chart = str(Path(chart_path).absolute()).encode() if chart_path is not None else b""
+        difficulty_bytes = (difficulty or "").encode()
+        self.file.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, RECORD.size, seed, len(chart), len(difficulty_bytes)) + chart + difficulty_bytes)
+        self.buffer = bytearray()
+        self.records = 0
+        self.blocks: queue.SimpleQueue[Optional[bytes]] = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._write_blocks, name="ReplayWriter", daemon=True)
+        self.thread.start()
+
+    def record_start(self, start_time: float):
+        self._append(START, 0, start_time, 0.0)
+
+    def record_chart(self, music_start_time: float):
+        self._append(CHART, 0, music_start_time, 0.0)
+
+    def record_input(self, game_input: GameInput):
+        self._append(INPUT_KINDS[game_input.kind], game_input.dir_index, math.nan if game_input.time is None else game_input.time, game_input.value)
+
+    def record_step(self, dt: float):
+        """Closes a step, after the inputs it applied"""
+        self._append(STEP, 0, math.nan, dt)
+        if len(self.buffer) >= FLUSH_BYTES:
+            self.flush()
+
+    def flush(self):
+        """Hands the buffered records to the writer thread"""
+        if self.buffer:
+            self.blocks.put(bytes(self.buffer))
+            self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.blocks.put(None)
+        self.thread.join()
+        self.file.close()
+
+    def _append(self, kind: int, lane: int, record_time: float, value: float):
+        self.buffer += RECORD.pack(kind, lane, record_time, value)
+        self.records += 1
+
+    def _write_blocks(self):
+        while (block := self.blocks.get()) is not None:
+            self.file.write(block)
+            self.file.flush()
+
+
+def read_replay(path: Path) -> tuple[ReplayHeader, np.ndarray]:
+    """Header and records (RECORD_DTYPE array) of a replay file"""
+    data = Path(path).read_bytes()
+    magic, version, record_size, seed, chart_len, difficulty_len = REPLAY_HEADER.unpack_from(data, 0)
+    if magic != REPLAY_MAGIC or version != REPLAY_VERSION or record_size != RECORD.size:
+        raise ValueError(f"{path} is not a replay of a known format")
+    position = REPLAY_HEADER.size
+    chart_path = data[position:position + chart_len].decode()
+    difficulty = data[position + chart_len:position + chart_len + difficulty_len].decode()
+    position += chart_len + difficulty_len
+    count = (len(data) - position) // RECORD.size # a truncated last record is dropped
+    return ReplayHeader(seed, chart_path, difficulty), np.frombuffer(data, RECORD_DTYPE, count, position)
+
+def replay(path: Path, judge: Optional[Judge] = None) -> GameEngine:
+    """Replays a session headless and returns the engine in its final state, judged by 'judge' if given"""
+    header, records = read_replay(path)
+    engine = GameEngine(ManualClock())
+    if judge is not None:
+        engine.score_recorder = ScoreRecorder(engine.score_recorder.score, judge)
+    if header.chart_path:
+        chart = load_chart(header.chart_path, header.difficulty or None)
+    else:
+        engine.chart_scheduler = ChartScheduler(random_notes(np.random.RandomState(header.seed)))
+    inputs = []
+    for kind, lane, record_time, value in records.tolist():
+        if kind == STEP:
+            engine.step(value, inputs)
+            inputs.clear()
+        elif kind >= HIT:
+            if kind in INTEGER_KINDS:
+                value = int(value)
+            inputs.append(GameInput(INPUT_NAMES[kind], lane, value, None if math.isnan(record_time) else record_time))
+        elif kind == START:
+            engine.clock.t = record_time
+            engine.start()
+        elif kind == CHART:
+            engine.schedule_chart(chart, record_time)
+    return engine
+
+def rescore(path: Path, tiers: tuple[Tier, ...] = TIERS) -> dict:
+    """Score and judgement statistics of a replay under 'tiers'"""
+    engine = replay(path, Judge(tiers))
+    stats = engine.score_recorder.stats
+    return {
+        "path": str(path),
+        "score": engine.score_recorder.score,
+        "score_p2": engine.score_recorder_p2.score,
+        "duration": engine.time - engine.start_time,
+        "tier_counts": dict(zip(stats.judge.names, stats.tier_counts)),
+        "mean_offset": stats.mean,
+        "stddev_offset": stats.stddev(),
+        "lane_bias": stats.lane_bias(),
+    }
+
+def _rescore_job(job: tuple[Path, tuple[Tier, ...]]) -> dict:
+    return rescore(*job)
+
+def rescore_many(paths: Iterable[Path], tiers: tuple[Tier, ...] = TIERS, processes: Optional[int] = None) -> list[dict]:
+    """rescore() of every replay, spread over 'processes' worker processes (one per CPU core by default)"""
+    jobs = [(path, tiers) for path in paths]
+    processes = processes or os.cpu_count()
+    if processes == 1:
+        return [_rescore_job(job) for job in jobs]
+    with Pool(processes) as pool:
+        return pool.map(_rescore_job, jobs, chunksize=max(1, len(jobs) // (4 * processes))) # a few chunks per worker balance the load
+
+def parse_tier(value: str) -> Tier:
+    """Tier from "name:window:points", the window in seconds"""
+    name, window, points = value.split(":")
+    return Tier(name, float(window), int(points))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score replays headless")
+    parser.add_argument("replays", type=Path, nargs="+")
+    parser.add_argument("--tiers", type=parse_tier, nargs="+", default=TIERS, help="judgement tiers as name:window:points, narrowest first")
+    parser.add_argument("--processes", type=int, help="worker processes, one per CPU core by default")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    results = rescore_many(args.replays, tuple(args.tiers), args.processes)
+    elapsed = time.perf_counter() - start
+    for result in results:
+        tiers = ", ".join(f"{name} {count}" for name, count in result["tier_counts"].items())
+        print(f"{result['path']}: score {result['score']} ({tiers}), offset {result['mean_offset'] * 1e3:+.1f} ± {result['stddev_offset'] * 1e3:.1f} ms")
+    played = sum(result["duration"] for result in results)
+    print(f"Re-scored {len(results)} replays ({played:.0f} s of play) in {elapsed:.2f} s, {played / elapsed:.0f}x realtime")
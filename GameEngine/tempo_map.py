@@ -0,0 +1,102 @@
+"""Tempo map converting between beats and seconds.
+
+The tempo is a list of segments, one per BPM change and two per stop (the
+stop itself, where the beat does not move, then the resumed tempo). The start
+beat and start time of every segment are precomputed, so a lookup is one binary
+search plus one multiply-add whatever the number of BPM changes."""
+import numpy as np
+from bisect import bisect_left, bisect_right
+from typing import Iterable
+
+
+class TempoMap:
+    """BPM segments and stops, with beat 0 at 'origin_time'
+
+    'bpms' are (beat, bpm) pairs and 'stops' are (beat, seconds) pairs, as in the
+    #BPMS and #STOPS tags of a chart. Notes on the beat of a stop are at the start
+    of the stop. Times before the first segment extrapolate its tempo."""
+    __slots__ = ("beats", "times", "seconds_per_beat", "beats_per_second", "_beats", "_times", "_seconds_per_beat", "_beats_per_second")
+
+    def __init__(self, bpms: Iterable[tuple[float, float]] = ((0.0, 120.0),), stops: Iterable[tuple[float, float]] = (), origin_time: float = 0.0):
+        changes = sorted((float(beat), 0, float(value)) for beat, value in bpms) # bpm changes before the stops on the same beat
+        changes += sorted((float(beat), 1, float(value)) for beat, value in stops)
+        changes.sort()
+        if not any(kind == 0 for _, kind, _ in changes):
+            raise ValueError("TempoMap needs at least one BPM")
+        bpm = next(value for _, kind, value in changes if kind == 0)
+        self.beats: list[float] = [0.0] # start beat of each segment
+        self.times: list[float] = [origin_time] # start time of each segment
+        self.seconds_per_beat: list[float] = [60 / bpm] # also kept on stops, for extrapolation before the first segment
+        self.beats_per_second: list[float] = [bpm / 60] # 0 on stops
+        for beat, kind, value in changes:
+            if beat <= 0 and kind == 0: # tempo of beat 0
+                self.seconds_per_beat[0] = 60 / value
+                self.beats_per_second[0] = value / 60
+                continue
+            beat = max(beat, 0.0)
+            time = self.beat_to_time(beat)
+            if kind == 0:
+                self._append(beat, time, 60 / value, value / 60)
+            else:
+                seconds_per_beat = self.seconds_per_beat[-1]
+                self._append(beat, time, seconds_per_beat, 0.0)
+                self._append(beat, time + value, seconds_per_beat, 1 / seconds_per_beat)
+        self._build_arrays()
+
+    def __len__(self) -> int:
+        return len(self.beats)
+
+    def beat_to_time(self, beat: float) -> float:
+        """Time at which 'beat' is reached"""
+        i = bisect_left(self.beats, beat) - 1 # segment ending on 'beat' when it starts another one
+        if i < 0:
+            i = 0
+        return self.times[i] + (beat - self.beats[i]) * self.seconds_per_beat[i]
+
+    def time_to_beat(self, time: float) -> float:
+        """Beat at 'time'"""
+        i = bisect_right(self.times, time) - 1
+        if i < 0:
+            i = 0
+        return self.beats[i] + (time - self.times[i]) * self.beats_per_second[i]
+
+    def beats_to_times(self, beats: np.ndarray) -> np.ndarray:
+        """Vectorized beat_to_time()"""
+        i = np.searchsorted(self._beats, beats, side="left")
+        np.subtract(i, 1, out=i)
+        np.maximum(i, 0, out=i)
+        return self._times[i] + (beats - self._beats[i]) * self._seconds_per_beat[i]
+
+    def times_to_beats(self, times: np.ndarray) -> np.ndarray:
+        """Vectorized time_to_beat()"""
+        i = np.searchsorted(self._times, times, side="right")
+        np.subtract(i, 1, out=i)
+        np.maximum(i, 0, out=i)
+        return self._beats[i] + (times - self._times[i]) * self._beats_per_second[i]
+
+    def bpm_at(self, time: float) -> float:
+        """BPM of the segment playing at 'time', also during a stop"""
+        i = max(bisect_right(self.times, time) - 1, 0)
+        return 60 / self.seconds_per_beat[i]
+
+    def set_bpm(self, time: float, bpm: float):
+        """Changes the BPM from 'time' on, for live tempo changes. The segments after 'time' are dropped."""
+        if bpm <= 0:
+            raise ValueError(f"Invalid BPM {bpm}, should be positive")
+        beat = self.time_to_beat(time)
+        i = bisect_right(self.times, time)
+        del self.beats[i:], self.times[i:], self.seconds_per_beat[i:], self.beats_per_second[i:]
+        self._append(beat, time, 60 / bpm, bpm / 60)
+        self._build_arrays()
+
+    def _append(self, beat: float, time: float, seconds_per_beat: float, beats_per_second: float):
+        self.beats.append(beat)
+        self.times.append(time)
+        self.seconds_per_beat.append(seconds_per_beat)
+        self.beats_per_second.append(beats_per_second)
+
+    def _build_arrays(self):
+        self._beats = np.array(self.beats, dtype=np.float64)
+        self._times = np.array(self.times, dtype=np.float64)
+        self._seconds_per_beat = np.array(self.seconds_per_beat, dtype=np.float64)
+        self._beats_per_second = np.array(self.beats_per_second, dtype=np.float64)
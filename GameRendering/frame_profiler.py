@@ -0,0 +1,105 @@
+"""Per-phase timers of the frame loop.
+
+The loop calls lap(phase) after each of its phases; the time since the previous
+lap is added to that phase in the row of the current frame. Rows live in a ring
+buffer of the last PROFILE_FRAMES frames, so the profiler can run for a whole
+session in fixed memory. A frame longer than SPIKE_TIME is a spike, kept with
+its slowest phase.
+
+The profiler does not exist unless it is enabled: the loop tests
+'profiler is not None' before each lap, which is all that disabled
+instrumentation costs. That is the accepted cost, about 0.1 us for the 14 tests
+of a frame; no-op profiler methods would cost more, each call being several
+times slower than a test (see Benchmarks/bench_frame_profiler.py)."""
+import json
+import time
+import numpy as np
+from collections import deque
+from pathlib import Path
+from typing import Callable
+
+FRAME_PHASES = ("clear", "events", "simulation", "sound", "upload", "text", "markers", "measure_lines", "arrows", "overlay", "present", "tick")
+CLEAR, EVENTS, SIMULATION, SOUND, UPLOAD, TEXT, MARKERS, MEASURE_LINES, ARROWS, OVERLAY, PRESENT, TICK = range(len(FRAME_PHASES))
+PROFILE_FRAMES = 1024 # frames kept in the ring buffer
+SPIKE_TIME = 1.5 / 60 # seconds, frames longer than this are spikes
+MAX_SPIKES = 64 # most recent spikes kept
+OVERLAY_REFRESH = 30 # frames between two updates of the overlay text
+
+
+class FrameProfiler:
+    """Durations of the phases of the last 'frames' frames"""
+
+    def __init__(self, phases: tuple[str, ...] = FRAME_PHASES, frames: int = PROFILE_FRAMES, spike_time: float = SPIKE_TIME,
+                 clock: Callable[[], float] = time.perf_counter):
+        self.phases = phases
+        self.spike_time = spike_time
+        self.clock = clock
+        self.durations = np.zeros((frames, len(phases))) # seconds, row frame % frames
+        self.frame_times = np.zeros(frames)
+        self.frames = 0 # frames recorded
+        self.spikes: deque[tuple[int, float, str]] = deque(maxlen=MAX_SPIKES) # (frame, duration, slowest phase)
+        self.spike_count = 0
+        self.row = self.durations[0]
+        self.frame_start = self.last = clock()
+        self.overlay_lines: list[str] = []
+
+    def begin_frame(self):
+        self.row = self.durations[self.frames % len(self.durations)]
+        self.row[:] = 0.0
+        self.frame_start = self.last = self.clock()
+
+    def lap(self, phase: int):
+        """Adds the time since the last lap to 'phase' (an index of 'phases')"""
+        now = self.clock()
+        self.row[phase] += now - self.last
+        self.last = now
+
+    def end_frame(self):
+        frame_time = self.last - self.frame_start
+        self.frame_times[self.frames % len(self.frame_times)] = frame_time
+        if frame_time > self.spike_time:
+            self.spikes.append((self.frames, frame_time, self.phases[int(np.argmax(self.row))]))
+            self.spike_count += 1
+        self.frames += 1
+
+    def recorded(self) -> tuple[np.ndarray, np.ndarray]:
+        """(durations, frame times) of the frames in the ring buffer, oldest first"""
+        if self.frames <= len(self.frame_times):
+            return self.durations[:self.frames], self.frame_times[:self.frames]
+        oldest = self.frames % len(self.frame_times)
+        return np.roll(self.durations, -oldest, axis=0), np.roll(self.frame_times, -oldest)
+
+    def percentiles(self, q: tuple[float, ...] = (50, 99)) -> dict[str, list[float]]:
+        """Percentiles 'q' (seconds) of every phase and of the whole frame ("frame")"""
+        durations, frame_times = self.recorded()
+        if not len(frame_times):
+            return {}
+        stats = dict(zip(self.phases, np.percentile(durations, q, axis=0).T.tolist()))
+        stats["frame"] = np.percentile(frame_times, q).tolist()
+        return stats
+
+    def overlay_text(self) -> list[str]:
+        """Lines of the on-screen overlay, recomputed every OVERLAY_REFRESH frames"""
+        if self.frames % OVERLAY_REFRESH == 0 or not self.overlay_lines:
+            lines = ["phase            p50     p99 ms"]
+            for phase, (p50, p99) in self.percentiles().items():
+                lines.append(f"{phase:<14} {p50 * 1e3:6.2f}  {p99 * 1e3:6.2f}")
+            lines.append(f"spikes > {self.spike_time * 1e3:.0f} ms: {self.spike_count}")
+            for frame, duration, phase in list(self.spikes)[-3:]:
+                lines.append(f"  #{frame}: {duration * 1e3:.1f} ms ({phase})")
+            self.overlay_lines = lines
+        return self.overlay_lines
+
+    def dump(self, path: Path):
+        """Writes the percentiles, the spikes and the raw ring buffer (ms) to a JSON file"""
+        durations, frame_times = self.recorded()
+        with open(path, "w") as f:
+            json.dump({
+                "frames": self.frames,
+                "phases": list(self.phases),
+                "percentiles_ms": {phase: {"p50": p50 * 1e3, "p99": p99 * 1e3} for phase, (p50, p99) in self.percentiles().items()},
+                "spike_time_ms": self.spike_time * 1e3,
+                "spike_count": self.spike_count,
+                "spikes": [{"frame": frame, "ms": duration * 1e3, "phase": phase} for frame, duration, phase in self.spikes],
+                "last_frames_ms": np.round(np.column_stack((durations, frame_times)) * 1e3, 4).tolist(), # phases..., frame
+            }, f)
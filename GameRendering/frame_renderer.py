@@ -0,0 +1,70 @@
+"""Frame presentation with an opt-in dirty-rectangle mode.
+
+In full mode every frame clears the whole screen and flips it. In dirty-rect
+mode only the rects drawn last frame are cleared and only the rects touched
+this frame or last frame are pushed with pygame.display.update(rects), which
+saves most of the frame budget on low-power displays. When the dirty area gets
+too large a full flip is cheaper and is used instead."""
+import pygame
+
+MAX_DIRTY_FRACTION = 0.5 # above this fraction of the screen, fall back to a full flip
+
+
+class FrameRenderer:
+    """Clears and presents the frames of a screen, counting the pixels pushed"""
+
+    def __init__(self, screen: pygame.Surface, dirty_rects: bool = False, max_dirty_fraction: float = MAX_DIRTY_FRACTION, background: tuple[int, int, int] = (0, 0, 0)):
+        self.screen = screen
+        self.dirty_rects = dirty_rects
+        self.max_dirty_fraction = max_dirty_fraction
+        self.background = background
+        self.screen_area = screen.get_width() * screen.get_height()
+
+        self.rects: list[pygame.Rect] = [] # drawn this frame
+        self.prev_rects: list[pygame.Rect] = [] # drawn last frame, to be cleared
+        self.pixels_pushed = 0 # pixels sent to the display by the last frame
+        self.total_pixels_pushed = 0
+        self.frames = 0
+        self.full_flips = 0
+
+    def begin_frame(self):
+        """Clears what the last frame drew"""
+        if not self.dirty_rects:
+            self.screen.fill(self.background)
+            return
+        for rect in self.prev_rects:
+            self.screen.fill(self.background, rect)
+
+    def add(self, rect: pygame.Rect):
+        """Marks a rect drawn this frame"""
+        if rect is not None:
+            self.rects.append(rect)
+
+    def add_all(self, rects: list[pygame.Rect]):
+        """Marks several rects drawn this frame"""
+        self.rects.extend(rects)
+
+    def end_frame(self):
+        """Pushes the frame to the display"""
+        if not self.dirty_rects:
+            pygame.display.flip()
+            pixels = self.screen_area
+            self.full_flips += 1
+        else:
+            rects = self.prev_rects + self.rects
+            pixels = sum(rect.width * rect.height for rect in rects) # overlaps are counted twice
+            if pixels > self.max_dirty_fraction * self.screen_area:
+                pygame.display.flip()
+                pixels = self.screen_area
+                self.full_flips += 1
+            else:
+                pygame.display.update(rects)
+            self.prev_rects = self.rects
+            self.rects = []
+        self.pixels_pushed = pixels
+        self.total_pixels_pushed += pixels
+        self.frames += 1
+
+    def mean_pixels_pushed(self) -> float:
+        """Average number of pixels pushed per frame"""
+        return self.total_pixels_pushed / self.frames if self.frames else 0.0
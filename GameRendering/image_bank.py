@@ -0,0 +1,68 @@
+"""Process-wide bank of the game images, decoded and scaled once.
+
+get(path, size) returns the image of an asset scaled to 'size', and
+preload(paths, size) decodes and scales a list in a thread pool without
+blocking, so it overlaps the pygame and display startup (no display is needed
+until the sprites are converted). The scaled pixels are cached on disk as raw
+RGBA, one file per asset and size, named after the hash of the source file:
+later launches read them with pygame.image.frombuffer() and skip the PNG
+decoding and the scaling, and a changed asset gets a new cache file."""
+import hashlib
+import io
+import struct
+import pygame
+from pathlib import Path
+from typing import Iterable, Optional
+from GameEngine.asset_bank import AssetBank
+
+IMAGE_CACHE_PATH = Path("./.image_cache/").absolute()
+IMAGE_WORKERS = 4 # decoding threads, the cores of a Raspberry Pi
+RGBA_MAGIC = b"SMIM"
+RGBA_VERSION = 1
+RGBA_HEADER = struct.Struct("<4sHii") # magic, version, width, height
+
+ImageKey = tuple[Path, tuple[int, int]] # source path, scaled size
+
+
+class ImageBank(AssetBank):
+    """Scaled images by source path and size, with an RGBA cache in 'cache_dir' (None: no cache)"""
+
+    def __init__(self, cache_dir: Optional[Path] = IMAGE_CACHE_PATH, workers: int = IMAGE_WORKERS):
+        super().__init__(cache_dir, workers)
+
+    def get(self, path: Path, size: tuple[int, int]) -> pygame.Surface:
+        """Image of 'path' scaled to 'size', waiting for its preload or loading it now"""
+        return self._get((Path(path).absolute(), tuple(size)))
+
+    def preload(self, paths: Iterable[Path], size: tuple[int, int]):
+        """Starts loading 'paths' scaled to 'size' in the background"""
+        self._preload((Path(path).absolute(), tuple(size)) for path in paths)
+
+    def _cache_entry(self, key: ImageKey) -> tuple[str, bytes, bytes]:
+        path, size = key
+        source = path.read_bytes() # read once, hashed here and decoded on a cache miss
+        header = RGBA_HEADER.pack(RGBA_MAGIC, RGBA_VERSION, *size)
+        return f"{hashlib.sha1(source).hexdigest()}-{size[0]}x{size[1]}.rgba", header, source
+
+    def _decode(self, key: ImageKey, source: bytes) -> pygame.Surface:
+        path, size = key
+        return pygame.transform.scale(pygame.image.load(io.BytesIO(source), path.name), size)
+
+    def _serialize(self, image: pygame.Surface) -> bytes:
+        return pygame.image.tobytes(image, "RGBA")
+
+    def _deserialize(self, key: ImageKey, data: memoryview) -> Optional[pygame.Surface]:
+        _, size = key
+        if len(data) != 4 * size[0] * size[1]:
+            return None
+        return pygame.image.frombuffer(data, size, "RGBA") # the Surface keeps the cached bytes alive
+
+
+_shared_image_bank: Optional[ImageBank] = None
+
+def shared_image_bank() -> ImageBank:
+    """ImageBank of the process"""
+    global _shared_image_bank
+    if _shared_image_bank is None:
+        _shared_image_bank = ImageBank()
+    return _shared_image_bank
@@ -0,0 +1,28 @@
+"""Sprite atlas holding every arrow and marker image the game blits.
+
+Each (colour, direction) arrow, the rotated markers and the spawn marker are
+rotated once at startup and converted to the display pixel format, so blits
+take SDL's fast path and spawning an arrow never allocates a Surface."""
+import pygame
+from GameEngine.constants import COLORS
+
+ROTATIONS = (0, 90, 270, 180) # rotation of the left arrow image for each dir_index
+
+
+class SpriteAtlas:
+    """Pre-rotated, display-converted sprites. Needs pygame.display.set_mode() to have been called."""
+
+    def __init__(self, arrow_imgs: dict[str, pygame.Surface], marker_img: pygame.Surface, spawn_img: pygame.Surface):
+        # arrows[color_id][dir_index]
+        self.arrows: list[list[pygame.Surface]] = [
+            [pygame.transform.rotate(arrow_imgs[color], angle).convert_alpha() for angle in ROTATIONS]
+            for color in COLORS
+        ]
+        self.markers: list[pygame.Surface] = [pygame.transform.rotate(marker_img, angle).convert_alpha() for angle in ROTATIONS]
+        self.spawn: pygame.Surface = spawn_img.convert_alpha()
+
+    def arrow(self, color_id: int, dir_index: int) -> pygame.Surface:
+        return self.arrows[color_id][dir_index]
+
+    def marker(self, dir_index: int) -> pygame.Surface:
+        return self.markers[dir_index]
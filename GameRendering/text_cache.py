@@ -0,0 +1,45 @@
+"""LRU cache of rendered text surfaces for the HUD.
+
+Font rasterization is one of the most expensive calls of the frame loop, and
+the HUD lines barely change between frames. Rendered surfaces are cached by
+(text, colour), so an unchanged string only costs a blit."""
+import pygame
+from collections import OrderedDict
+
+MAX_CACHED_TEXTS = 256
+
+
+class TextCache:
+    """Renders text with a font, keeping the most recently used surfaces"""
+
+    def __init__(self, font: pygame.font.Font, max_size: int = MAX_CACHED_TEXTS, antialias: bool = True):
+        self.font = font
+        self.max_size = max_size
+        self.antialias = antialias
+        self.surfaces: OrderedDict[tuple[str, tuple[int, int, int]], pygame.Surface] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, text: str, color: tuple[int, int, int] = (255, 255, 255)) -> pygame.Surface:
+        """Gets the rendered surface of 'text', rendering it only if it is not cached"""
+        key = (text, color)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+        self.misses += 1
+        surface = self.font.render(text, self.antialias, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False) # evict the least recently used
+        return surface
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def clear(self):
+        self.surfaces.clear()
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,319 @@
+"""Pipelined round-trip latency benchmark over the controller transports.
+
+Pings carry a sequence number, and the send time when the transport echoes the
+payload back (MQTT). Up to --concurrency pings are in flight at once, sent at
+most --rate per second (0: as fast as the window allows), and a ping without
+reply after --timeout seconds is counted lost. The round-trip times go into a
+fixed-memory LogHistogram, so long runs do not grow.
+
+Transports:
+    loopback  in-process emulated controller (BluetoothImplementation.loopback), clock sync pings
+    ble       a player1.ino controller at --address, clock sync pings ('P' + sequence -> "PONG ...")
+    mqtt      esp_mqtt_client1.ino through the broker at --broker, or through a local
+              stand-in (PingTest.mqtt_echo_broker) with --local-broker
+    player    the same, with clock sync pings on the player topics used by the game
+              (BluetoothImplementation.mqtt_transport), directly comparable with ble
+
+Run from the repository root, e.g.:
+    python -m PingTest.latency_bench mqtt --local-broker --concurrency 1 8 64 --json mqtt.json
+    python -m PingTest.latency_bench player --local-broker --json player.json
+    python -m PingTest.latency_bench ble --compare player.json"""
+import argparse
+import asyncio
+import json
+import struct
+import time
+import numpy as np
+from typing import Callable, Optional
+from PingTest.latency_histogram import LogHistogram
+
+PING_PAYLOAD = struct.Struct("<IQ") # sequence number, host send time (perf_counter_ns)
+GATT_PING = struct.Struct("<cI") # as BluetoothImplementation.clock_sync
+RING_SIZE = 4096 # send times of the pings in flight, indexed by sequence number
+CHARACTERISTIC_UUID_RX = "19B10001-E8F2-537E-4F6C-D104768A1214" # TX of ESP32
+CHARACTERISTIC_UUID_TX = "19B10002-E8F2-537E-4F6C-D104768A1214" # RX of ESP32
+
+ReplyCallback = Callable[[int, Optional[int], int], None] # (sequence, send time ns if echoed, receipt time ns)
+
+
+class EchoTransport:
+    """Sends pings and reports their replies"""
+    name = "echo"
+
+    async def open(self, on_reply: ReplyCallback):
+        raise NotImplementedError
+
+    async def send(self, sequence: int, send_time_ns: int):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class GattPingEcho(EchoTransport):
+    """Clock sync pings to a player1.ino controller, whose PONG carries the sequence number"""
+
+    def __init__(self):
+        self.client = None
+        self.on_reply: Optional[ReplyCallback] = None
+
+    def make_client(self):
+        raise NotImplementedError
+
+    async def open(self, on_reply: ReplyCallback):
+        self.on_reply = on_reply
+        self.client = self.make_client()
+        await self.client.connect()
+        await self.client.start_notify(CHARACTERISTIC_UUID_RX, self._notification)
+
+    async def send(self, sequence: int, send_time_ns: int):
+        await self.client.write_gatt_char(CHARACTERISTIC_UUID_TX, GATT_PING.pack(b"P", sequence), response=False)
+
+    async def close(self):
+        await self.client.disconnect()
+
+    def _notification(self, sender, data: bytearray):
+        receipt_time = time.perf_counter_ns()
+        if data.startswith(b"PONG "):
+            self.on_reply(int(data.split(b" ")[1]), None, receipt_time)
+
+
+class LoopbackEcho(GattPingEcho):
+    name = "loopback"
+
+    def make_client(self):
+        from BluetoothImplementation.loopback import ControllerEmulator, LoopbackTransport
+        return LoopbackTransport(ControllerEmulator())
+
+
+class BleEcho(GattPingEcho):
+    name = "ble"
+
+    def __init__(self, address: str):
+        super().__init__()
+        self.address = address
+
+    def make_client(self):
+        from bleak import BleakClient
+        return BleakClient(self.address)
+
+
+class MqttEcho(EchoTransport):
+    """Pings published on 'ping_topic' and echoed on 'pong_topic' by esp_mqtt_client1.ino"""
+    name = "mqtt"
+
+    def __init__(self, broker: str, port: int, ping_topic: str = "ping", pong_topic: str = "pong"):
+        self.broker = broker
+        self.port = port
+        self.ping_topic = ping_topic
+        self.pong_topic = pong_topic
+        self.client = None
+
+    async def open(self, on_reply: ReplyCallback):
+        from paho.mqtt import client as mqtt_client
+        loop = asyncio.get_running_loop()
+        connected = asyncio.Event()
+
+        def on_connect(client, userdata, flags, reason_code, properties):
+            client.subscribe(self.pong_topic)
+
+        def on_subscribe(client, userdata, mid, reason_codes, properties):
+            loop.call_soon_threadsafe(connected.set)
+
+        def on_message(client, userdata, msg):
+            receipt_time = time.perf_counter_ns() # stamped in the network thread
+            reply = self.decode(msg.payload)
+            if reply is not None:
+                loop.call_soon_threadsafe(on_reply, *reply, receipt_time)
+
+        self.client = mqtt_client.Client(mqtt_client.CallbackAPIVersion.VERSION2)
+        self.client.on_connect = on_connect
+        self.client.on_subscribe = on_subscribe
+        self.client.on_message = on_message
+        self.client.connect(self.broker, self.port)
+        self.client.loop_start()
+        await connected.wait()
+
+    async def send(self, sequence: int, send_time_ns: int):
+        self.client.publish(self.ping_topic, self.encode(sequence, send_time_ns), qos=0)
+
+    async def close(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def encode(self, sequence: int, send_time_ns: int) -> bytes:
+        return PING_PAYLOAD.pack(sequence, send_time_ns)
+
+    def decode(self, payload: bytes) -> Optional[tuple[int, Optional[int]]]:
+        """(sequence, send time ns if echoed) of a reply, None if it is not one"""
+        if len(payload) == PING_PAYLOAD.size:
+            return PING_PAYLOAD.unpack(payload)
+        return None
+
+
+class PlayerMqttEcho(MqttEcho):
+    """Clock sync pings on the topics of 'player', answered with a PONG as over BLE"""
+    name = "player"
+
+    def __init__(self, broker: str, port: int, player: str = "player1"):
+        from BluetoothImplementation.mqtt_transport import TOPIC_PREFIX
+        super().__init__(broker, port, f"{TOPIC_PREFIX}/{player}/rx", f"{TOPIC_PREFIX}/{player}/tx")
+
+    def encode(self, sequence: int, send_time_ns: int) -> bytes:
+        return GATT_PING.pack(b"P", sequence)
+
+    def decode(self, payload: bytes) -> Optional[tuple[int, Optional[int]]]:
+        if payload.startswith(b"PONG "):
+            return int(payload.split(b" ")[1]), None
+        return None
+
+
+class LatencyBenchmark:
+    """Sends 'count' pings through 'transport', at most 'concurrency' in flight"""
+
+    def __init__(self, transport: EchoTransport, count: int, concurrency: int = 1, rate: float = 0.0, timeout: float = 1.0):
+        if not 1 <= concurrency <= RING_SIZE:
+            raise ValueError(f"Concurrency must be between 1 and {RING_SIZE}")
+        self.transport = transport
+        self.count = count
+        self.concurrency = concurrency
+        self.rate = rate
+        self.timeout = timeout
+        self.histogram = LogHistogram()
+        self.ring_sequences = np.full(RING_SIZE, -1, np.int64) # sequence number in flight in each slot, -1 if free
+        self.ring_times = np.zeros(RING_SIZE, np.int64) # its send time (ns)
+        self.sent = 0
+        self.received = 0
+        self.lost = 0
+        self.unmatched = 0 # replies to pings already answered or timed out
+        self.window: Optional[asyncio.Semaphore] = None
+        self.done: Optional[asyncio.Event] = None
+
+    async def run(self) -> dict:
+        loop = asyncio.get_running_loop()
+        self.window = asyncio.Semaphore(self.concurrency)
+        self.done = asyncio.Event()
+        await self.transport.open(self._reply)
+        start = time.perf_counter()
+        for sequence in range(self.count):
+            if self.rate > 0:
+                await asyncio.sleep(max(0.0, start + sequence / self.rate - time.perf_counter()))
+            await self.window.acquire()
+            slot = sequence % RING_SIZE
+            send_time = time.perf_counter_ns()
+            self.ring_sequences[slot], self.ring_times[slot] = sequence, send_time
+            loop.call_later(self.timeout, self._expire, sequence)
+            self.sent += 1
+            await self.transport.send(sequence, send_time)
+        if self.count:
+            await self.done.wait()
+        elapsed = time.perf_counter() - start
+        await self.transport.close()
+        return {
+            "transport": self.transport.name,
+            "count": self.count,
+            "concurrency": self.concurrency,
+            "rate": self.rate,
+            "timeout": self.timeout,
+            "sent": self.sent,
+            "received": self.received,
+            "lost": self.lost,
+            "unmatched": self.unmatched,
+            "elapsed": elapsed,
+            "throughput": self.received / elapsed if elapsed > 0 else 0.0,
+            "latency": self.histogram.to_dict(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+
+    def _reply(self, sequence: int, send_time_ns: Optional[int], receipt_time_ns: int):
+        slot = sequence % RING_SIZE
+        if self.ring_sequences[slot] != sequence:
+            self.unmatched += 1
+            return
+        send_time = send_time_ns if send_time_ns is not None else int(self.ring_times[slot])
+        self.histogram.record((receipt_time_ns - send_time) * 1e-9)
+        self.received += 1
+        self._release(slot)
+
+    def _expire(self, sequence: int):
+        slot = sequence % RING_SIZE
+        if self.ring_sequences[slot] == sequence:
+            self.lost += 1
+            self._release(slot)
+
+    def _release(self, slot: int):
+        self.ring_sequences[slot] = -1
+        self.window.release()
+        if self.received + self.lost == self.count:
+            self.done.set()
+
+
+def format_result(result: dict) -> str:
+    latency = result["latency"]
+    ms = {q: (p * 1e3 if p is not None else float("nan")) for q, p in latency["percentiles"].items()}
+    max_ms = latency["max"] * 1e3 if latency["max"] is not None else float("nan")
+    return (f"{result['transport']:>8} x{result['concurrency']:<4} {result['received']:>7}/{result['sent']:<7} {result['lost']:>5} lost"
+            f" {result['throughput']:>9,.0f}/s  p50 {ms['50']:7.3f}  p99 {ms['99']:7.3f}  p99.9 {ms['99.9']:7.3f}  max {max_ms:7.3f} ms")
+
+def compare(results: list[dict], previous: list[dict]):
+    """Prints the change of p50, p99 and throughput from the matching runs of 'previous'"""
+    by_key = {(r["transport"], r["concurrency"], r["rate"]): r for r in previous}
+    for result in results:
+        old = by_key.get((result["transport"], result["concurrency"], result["rate"]))
+        if old is None:
+            continue
+        changes = []
+        for q in ("50", "99"):
+            before, after = old["latency"]["percentiles"][q], result["latency"]["percentiles"][q]
+            if before and after:
+                changes.append(f"p{q} {before * 1e3:.3f} -> {after * 1e3:.3f} ms ({(after / before - 1):+.0%})")
+        changes.append(f"throughput {old['throughput']:,.0f} -> {result['throughput']:,.0f}/s")
+        print(f"{result['transport']:>8} x{result['concurrency']:<4} " + ", ".join(changes))
+
+async def main(args: argparse.Namespace) -> list[dict]:
+    broker = None
+    if args.transport in ("mqtt", "player") and args.local_broker:
+        from PingTest.mqtt_echo_broker import MqttEchoBroker
+        broker = MqttEchoBroker(echo_delay=args.echo_delay)
+        args.broker, args.port = "127.0.0.1", await broker.start()
+    results = []
+    for concurrency in args.concurrency:
+        if args.transport == "loopback":
+            transport = LoopbackEcho()
+        elif args.transport == "ble":
+            transport = BleEcho(args.address)
+        elif args.transport == "player":
+            transport = PlayerMqttEcho(args.broker, args.port, args.player)
+        else:
+            transport = MqttEcho(args.broker, args.port)
+        result = await LatencyBenchmark(transport, args.count, concurrency, args.rate, args.timeout).run()
+        print(format_result(result))
+        results.append(result)
+    if broker is not None:
+        await broker.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipelined round-trip latency benchmark")
+    parser.add_argument("transport", choices=("loopback", "ble", "mqtt", "player"))
+    parser.add_argument("--count", type=int, default=2000, help="pings per run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8], help="pings in flight, one run per value")
+    parser.add_argument("--rate", type=float, default=0.0, help="pings per second, 0 for as fast as the window allows")
+    parser.add_argument("--timeout", type=float, default=1.0, help="seconds before a ping is counted lost")
+    parser.add_argument("--address", default="E8:31:CD:CB:2F:EE", help="BLE address of the controller")
+    parser.add_argument("--broker", default="192.168.0.103", help="MQTT broker address")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--player", default="player1", help="topics of the controller for the player transport")
+    parser.add_argument("--local-broker", action="store_true", help="run against a local MQTT stand-in instead of --broker")
+    parser.add_argument("--echo-delay", type=float, default=0.0, help="seconds the local stand-in waits before echoing")
+    parser.add_argument("--json", help="file to write the results to")
+    parser.add_argument("--compare", help="results file of a previous run to compare with")
+    args = parser.parse_args()
+    results = asyncio.run(main(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
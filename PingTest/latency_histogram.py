@@ -0,0 +1,94 @@
+"""Fixed-memory latency histogram with logarithmic buckets.
+
+Bucket i > 0 holds the values in [min_value * growth^(i-1), min_value * growth^i),
+bucket 0 the values below min_value and the last bucket the values above
+max_value, so every percentile is known within 'precision' (relative) whatever
+the number of samples, in a few kilobytes."""
+import math
+import numpy as np
+from typing import Optional
+
+HISTOGRAM_MIN = 1e-6 # seconds
+HISTOGRAM_MAX = 100.0
+HISTOGRAM_PRECISION = 0.01 # relative width of a bucket
+
+
+class LogHistogram:
+    """Counts of positive values (e.g. latencies in seconds) in logarithmic buckets"""
+
+    def __init__(self, min_value: float = HISTOGRAM_MIN, max_value: float = HISTOGRAM_MAX, precision: float = HISTOGRAM_PRECISION):
+        self.min_value = min_value
+        self.max_value = max_value
+        self.precision = precision
+        self.log_growth = math.log1p(precision)
+        self.counts = np.zeros(int(math.ceil(math.log(max_value / min_value) / self.log_growth)) + 2, np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def record(self, value: float):
+        if value < self.min_value:
+            index = 0
+        else:
+            index = min(int(math.log(value / self.min_value) / self.log_growth) + 1, len(self.counts) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "LogHistogram"):
+        if len(other.counts) != len(self.counts) or other.min_value != self.min_value:
+            raise ValueError("Histograms with different buckets")
+        self.counts += other.counts
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def bucket_bounds(self, index: int) -> tuple[float, float]:
+        if index == 0:
+            return 0.0, self.min_value
+        if index == len(self.counts) - 1:
+            return self.max_value, math.inf
+        return self.min_value * math.exp((index - 1) * self.log_growth), self.min_value * math.exp(index * self.log_growth)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Value under which 'q' percent of the samples are, the middle of its bucket; None without samples"""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(q / 100 * self.count))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        low, high = self.bucket_bounds(index)
+        value = math.sqrt(low * high) if 0 < low and high < math.inf else (low if high == math.inf else high)
+        return min(max(value, self.min), self.max)
+
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def to_dict(self) -> dict:
+        """Summary and non-empty buckets, JSON serializable"""
+        nonzero = np.flatnonzero(self.counts)
+        return {
+            "count": self.count,
+            "mean": self.mean(),
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "percentiles": {str(q): self.percentile(q) for q in (50, 90, 99, 99.9)},
+            "min_value": self.min_value,
+            "max_value": self.max_value,
+            "precision": self.precision,
+            "buckets": {int(i): int(self.counts[i]) for i in nonzero},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LogHistogram":
+        histogram = cls(data["min_value"], data["max_value"], data["precision"])
+        for index, count in data["buckets"].items():
+            histogram.counts[int(index)] = count
+        histogram.count = data["count"]
+        histogram.total = (data["mean"] or 0.0) * data["count"]
+        if data["count"]:
+            histogram.min, histogram.max = data["min"], data["max"]
+        return histogram
@@ -0,0 +1,186 @@
+"""Local stand-in for the MQTT broker and the ESP32 of esp_mqtt_client1.ino.
+
+A minimal MQTT 3.1.1 broker (CONNECT, SUBSCRIBE, UNSUBSCRIBE, PUBLISH at QoS 0
+and 1 with retained messages, PINGREQ, DISCONNECT; exact topic names only, no
+last wills) that also plays the controller: every message published on an
+echo topic ("ping") is published back on its reply topic ("pong") with the same
+payload, after 'echo_delay' seconds, and clock sync pings on the topics of the
+'players' ("stepmania/player1/rx") are answered with a PONG, as
+esp_mqtt_client1.ino does. The retained status of each
+emulated controller reads "online <boot id>"; reboot() and go_offline() change
+it as a rebooting or vanishing controller would. This lets the MQTT code,
+benchmarks and the game (stepmania.py --mqtt 127.0.0.1) run offline.
+
+Run from the repository root: python -m PingTest.mqtt_echo_broker --port 1883"""
+import argparse
+import asyncio
+import random
+import struct
+import time
+from typing import Optional
+
+ECHO_TOPICS = {"ping": "pong"}
+PLAYERS = ("player1", "player2")
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def encode_remaining_length(length: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        length, digit = divmod(length, 128)
+        encoded.append(digit | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+def encode_packet(packet_type: int, flags: int, body: bytes) -> bytes:
+    return bytes((packet_type << 4 | flags,)) + encode_remaining_length(len(body)) + body
+
+def encode_publish(topic: str, payload: bytes, retain: bool = False) -> bytes:
+    """QoS 0 PUBLISH"""
+    topic_bytes = topic.encode("utf-8")
+    return encode_packet(PUBLISH, int(retain), struct.pack("!H", len(topic_bytes)) + topic_bytes + payload)
+
+async def read_packet(reader: asyncio.StreamReader) -> tuple[int, int, bytes]:
+    """(packet type, flags, body) of the next packet"""
+    first = (await reader.readexactly(1))[0]
+    length, shift = 0, 0
+    while True:
+        digit = (await reader.readexactly(1))[0]
+        length |= (digit & 0x7F) << shift
+        if not digit & 0x80:
+            break
+        shift += 7
+    return first >> 4, first & 0x0F, await reader.readexactly(length)
+
+def read_string(body: bytes, offset: int) -> tuple[str, int]:
+    (length,) = struct.unpack_from("!H", body, offset)
+    return body[offset + 2:offset + 2 + length].decode("utf-8"), offset + 2 + length
+
+
+class MqttEchoBroker:
+    """MQTT broker echoing the ping topic, see the module docstring"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, echo_topics: Optional[dict[str, str]] = None, echo_delay: float = 0.0,
+                 players: tuple[str, ...] = PLAYERS):
+        self.host = host
+        self.port = port # 0: any free port, set by start()
+        self.echo_topics = ECHO_TOPICS if echo_topics is None else echo_topics
+        self.ping_topics = {f"stepmania/{player}/rx": f"stepmania/{player}/tx" for player in players} # as BluetoothImplementation.mqtt_transport
+        self.retained: dict[str, bytes] = {} # topic -> retained payload
+        self.boot_time = time.perf_counter()
+        self.echo_delay = echo_delay
+        self.subscribers: dict[str, set[asyncio.StreamWriter]] = {}
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.connections: dict[asyncio.Task, asyncio.StreamWriter] = {}
+        self.published = 0
+        self.echoed = 0
+        for player in players:
+            self.reboot(player)
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for writer in self.connections.values():
+            writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+
+    def reboot(self, player: str):
+        """The controller of 'player' comes (back) online with a new boot id"""
+        self.publish(f"stepmania/{player}/status", f"online {random.getrandbits(32):08x}".encode(), retain=True)
+
+    def go_offline(self, player: str):
+        """The controller of 'player' drops, the broker publishes its last will"""
+        self.publish(f"stepmania/{player}/status", b"offline", retain=True)
+
+    def publish(self, topic: str, payload: bytes, retain: bool = False):
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else: # an empty retained message clears the topic
+                self.retained.pop(topic, None)
+        packet = encode_publish(topic, payload)
+        for writer in list(self.subscribers.get(topic, ())):
+            writer.write(packet)
+        reply_topic = self.echo_topics.get(topic)
+        if reply_topic is None and len(payload) == 5 and payload[:1] == b"P":
+            reply_topic = self.ping_topics.get(topic)
+            if reply_topic is not None:
+                sequence = struct.unpack_from("<I", payload, 1)[0]
+                payload = f"PONG {sequence} {int((time.perf_counter() - self.boot_time) * 1e6)}".encode()
+        if reply_topic is not None:
+            self.echoed += 1
+            if self.echo_delay > 0:
+                asyncio.get_running_loop().call_later(self.echo_delay, self.publish, reply_topic, payload)
+            else:
+                self.publish(reply_topic, payload)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self.connections[task] = writer
+        try:
+            while True:
+                packet_type, flags, body = await read_packet(reader)
+                if packet_type == CONNECT:
+                    writer.write(encode_packet(CONNACK, 0, b"\x00\x00"))
+                elif packet_type == PUBLISH:
+                    topic, offset = read_string(body, 0)
+                    qos = (flags >> 1) & 3
+                    if qos:
+                        (packet_id,) = struct.unpack_from("!H", body, offset)
+                        offset += 2
+                        writer.write(encode_packet(PUBACK, 0, struct.pack("!H", packet_id))) # QoS 2 is not supported
+                    self.published += 1
+                    self.publish(topic, body[offset:], retain=bool(flags & 1))
+                elif packet_type == SUBSCRIBE:
+                    (packet_id,), offset, topics = struct.unpack_from("!H", body), 2, []
+                    while offset < len(body):
+                        topic, offset = read_string(body, offset)
+                        offset += 1 # requested QoS, everything is delivered at QoS 0
+                        self.subscribers.setdefault(topic, set()).add(writer)
+                        topics.append(topic)
+                    writer.write(encode_packet(SUBACK, 0, struct.pack("!H", packet_id) + bytes(len(topics))))
+                    for topic in topics:
+                        if topic in self.retained:
+                            writer.write(encode_publish(topic, self.retained[topic], retain=True))
+                elif packet_type == UNSUBSCRIBE:
+                    (packet_id,), offset = struct.unpack_from("!H", body), 2
+                    while offset < len(body):
+                        topic, offset = read_string(body, offset)
+                        self.subscribers.get(topic, set()).discard(writer)
+                    writer.write(encode_packet(UNSUBACK, 0, struct.pack("!H", packet_id)))
+                elif packet_type == PINGREQ:
+                    writer.write(encode_packet(PINGRESP, 0, b""))
+                elif packet_type == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for writers in self.subscribers.values():
+                writers.discard(writer)
+            writer.close()
+            del self.connections[task]
+
+
+async def serve(host: str, port: int, echo_delay: float):
+    broker = MqttEchoBroker(host, port, echo_delay=echo_delay)
+    print(f"MQTT echo broker listening on {host}:{await broker.start()}, echoing {broker.echo_topics} and the pings of {list(broker.ping_topics)}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local MQTT broker echoing the ping topic like the ESP32")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--echo-delay", type=float, default=0.0, help="seconds before echoing, to emulate the controller")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.echo_delay))
@@ -6,6 +6,7 @@
 
 #include <WiFi.h>
 #include <PubSubClient.h>
+#include "esp_timer.h"
 
 // Replace the SSID/Password details as per your wifi router
 const char* ssid = "wifi-robot";
@@ -14,6 +15,12 @@ const char* password = "";
 // Replace your MQTT Broker IP address here:
 const char* mqtt_server = "192.168.0.103";
 
+// Topics of this player, see BluetoothImplementation/mqtt_transport.py
+const char* tx_topic = "stepmania/player1/tx"; // to the game: HIT frames, PONGs
+const char* rx_topic = "stepmania/player1/rx"; // from the game: clock sync pings, arrow times
+const char* status_topic = "stepmania/player1/status"; // retained: "online <boot id>", or the "offline" last will set by the broker
+char online_status[24]; // "online <boot id>", a new id at every boot tells the game our heaps are empty
+
 WiFiClient espClient;
 PubSubClient client(espClient);
 
@@ -69,11 +76,13 @@ void connect_mqttServer() {
         //now attemt to connect to MQTT server
         Serial.print("Attempting MQTT connection...");
         // Attempt to connect
-        if (client.connect("ESP32_client1")) { // Change the name of client here if multiple ESP32 are connected
+        if (client.connect("ESP32_client1", status_topic, 0, true, "offline")) { // Change the name of client here if multiple ESP32 are connected
           //attempt successful
           Serial.println("connected");
+          client.publish(status_topic, online_status, true); // the game only counts us as connected from here
           // Subscribe to topics here
           client.subscribe("ping");
+          client.subscribe(rx_topic);
           //client.subscribe("rpi/xyz"); //subscribe more topics here
           
         } 
@@ -106,10 +115,16 @@ void callback(char* topic, byte* message, unsigned int length) {
 
   // Check if a message is received on the topic "rpi/broadcast"
   if (String(topic) == "ping") {
-      client.publish("pong", "ping");
-      Serial.println("Action: blink LED");
-      blink_led(1,1250); //blink LED once (for 1250ms ON time)
-      
+      client.publish("pong", message, length); //echo the payload, it carries the sequence number and send time of the ping
+      digitalWrite(ledPin, !digitalRead(ledPin)); //toggle the LED, blinking would block the loop and delay the next pings
+  }
+
+  if (String(topic) == rx_topic && length == 5 && message[0] == 'P') { // clock sync ping: 'P' + uint32 sequence number, as over BLE
+      uint32_t sequence;
+      memcpy(&sequence, message + 1, sizeof(uint32_t));
+      char pong[48];
+      snprintf(pong, sizeof(pong), "PONG %lu %lld", (unsigned long)sequence, (long long)esp_timer_get_time());
+      client.publish(tx_topic, pong);
   }
 
   //Similarly add more if statements to check for other subscribed topics 
@@ -119,6 +134,7 @@ void setup() {
   pinMode(ledPin, OUTPUT);
   Serial.begin(115200);
 
+  snprintf(online_status, sizeof(online_status), "online %08lx", (unsigned long)esp_random());
   setup_wifi();
   client.setServer(mqtt_server,1883);//1883 is the default port for MQTT server
   client.setCallback(callback);
@@ -39,6 +39,15 @@ class MyCharacteristicCallbacks : public BLECharacteristicCallbacks {
     uint8_t* receivedBytes = (uint8_t*)rxCharacteristic->getData(); // Get raw byte array
     size_t length = rxCharacteristic->getLength(); // Get data length
 
+    if (length == 5 && receivedBytes[0] == 'P') { // clock sync ping: 'P' + uint32 sequence number
+      uint32_t sequence;
+      memcpy(&sequence, receivedBytes + 1, sizeof(uint32_t));
+      char pong[48];
+      snprintf(pong, sizeof(pong), "PONG %lu %lld", (unsigned long)sequence, (long long)esp_timer_get_time());
+      sendMessage(pong);
+      return;
+    }
+
     if (length % 4 != 0) {
       Serial.println("Error: Received data length is not a multiple of 4!");
       return;
@@ -73,9 +82,34 @@ void sendMessage(const char* message) {
   }
 }
 
+// Binary frames, see BluetoothImplementation/wire_codec.py
+#define WIRE_VERSION 1
+#define MSG_HIT 1
+struct __attribute__((packed)) WireRecord {
+  uint8_t type;
+  uint8_t lane;
+  uint16_t sequence;
+  uint32_t time_us; // low 32 bits of esp_timer_get_time()
+};
+uint16_t wireSequence = 0;
+
+// Function to send a frame of records using TX_UUID, in one notification
+void sendFrame(const WireRecord* records, uint8_t count) {
+  uint8_t frame[2 + 4 * sizeof(WireRecord)];
+  frame[0] = WIRE_VERSION;
+  frame[1] = count;
+  memcpy(frame + 2, records, count * sizeof(WireRecord));
+  if (deviceConnected) {
+    txCharacteristic->setValue(frame, 2 + count * sizeof(WireRecord));
+    txCharacteristic->notify();
+  }
+}
+
 void IRAM_ATTR ButtonEvent() {
   Serial.println("INTERRUPT WAS TRIGGERED!");
 
+  WireRecord records[4]; // presses of this interrupt, sent together
+  uint8_t count = 0;
   for(int i=0; i<4; i++){
     int buttonState = digitalRead(buttonOutputPins[i]);
     if(buttonState == 0){ //button pressed
@@ -85,8 +119,7 @@ void IRAM_ATTR ButtonEvent() {
       float arrowTime = arrowsColumns[i].extractMin();
 
       if(abs(reactionTime - arrowTime) < 2 || true){
-        String message = "HIT " + String(i) + " " + String(arrowTime) + " " + String(reactionTime);
-        sendMessage(message.c_str());//arrow has been popped from heap! we send message and move on!
+        records[count++] = {MSG_HIT, (uint8_t)i, wireSequence++, (uint32_t)esp_time}; //arrow has been popped from heap! we send the hit and move on!
       }else{
         arrowsColumns[i].insert(arrowTime); //insert time back into minHeap
       }
@@ -96,6 +129,9 @@ void IRAM_ATTR ButtonEvent() {
       digitalWrite(ledInputPins[i], LOW);
     }
   }
+  if(count > 0){
+    sendFrame(records, count);
+  }
 }
 
 void setup() {
@@ -122,7 +158,8 @@ void setup() {
   // Create a BLE Characteristic for RX
   rxCharacteristic = pService->createCharacteristic(
                       RX_UUID,
-                      BLECharacteristic::PROPERTY_WRITE
+                      BLECharacteristic::PROPERTY_WRITE |
+                      BLECharacteristic::PROPERTY_WRITE_NR // the clock sync pings and the chart upload frames are written without response
                     );
 
   // Register callback for RX_UUID
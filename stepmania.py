@@ -1,21 +1,39 @@
 import pygame
 import time
+import math
+import struct
+import argparse
 import numpy as np
 from pathlib import Path
-from typing import Literal, Callable
+from typing import Literal
 from collections import deque
-import threading
 from itertools import chain
-from BluetoothImplementation import bluetooth_definition as bt
-
-BTCLIENTS = ["E8:31:CD:CB:2F:EE", "44:17:93:E0:D8:A2"]
+from BluetoothImplementation.client_manager import ControllerClient
+from BluetoothImplementation.chart_upload import ChartUploader
+from BluetoothImplementation.clock_sync import ClockSyncService
+from BluetoothImplementation.wire_codec import FrameDecoder, MSG_HIT, MSG_SPAWN, is_wire_frame, unwrap_time_us
+from GameEngine.game_engine import GameEngine, GameInput, PerfCounterClock
+from GameEngine.chart_stream import ChartScheduler, random_notes
+from GameEngine.arrow_store import ArrowStore
+from GameEngine.chart_loader import CompiledChart, load_chart
+from GameEngine.replay import REPLAY_DIR, ReplayWriter
+from GameEngine.constants import DIR_DICT, DIR_DICT_INV, ARROW_SIZE, WIDTH, HEIGHT, ZERO_Y, MEASURE_LINE_H
+from GameRendering.sprite_atlas import SpriteAtlas
+from GameRendering.frame_renderer import FrameRenderer
+from GameRendering.text_cache import TextCache
+from GameRendering import frame_profiler as fp
+from GameRendering.image_bank import shared_image_bank
+from GameAudio.audio_scheduler import AudioScheduler
+from GameAudio.sound_bank import shared_bank
+
+BTCLIENTS = ["STEPMANIAplayer1", "44:17:93:E0:D8:A2"] # advertised names (found by scanning, then cached) or addresses
+MQTT_PLAYERS = ["player1", "player2"] # topics of the controllers with --mqtt
 RESOURCE_PATH = Path("./Resources/").absolute()
-DIR_DICT = {0: "left", 1: "down", 2: "up", 3: "right"}
-DIR_DICT_INV = {"left": 0, "down": 1, "up": 2, "right": 3}
-ARROW_SIZE = 100
-WIDTH, HEIGHT = 600, 800
-MEASURE_MARGIN = 1 # number of measures to summon the arrows before they reach the markers at ZERO_Y
-ZERO_Y = 80
+CHART_LEAD_IN = 2 # seconds before the chart's music starts
+BEAT_LOOKAHEAD = 0.1 # seconds of beat sounds queued ahead, more than a frame
+KEY_HIT_DIR = {pygame.K_LEFT: 0, pygame.K_DOWN: 1, pygame.K_UP: 2, pygame.K_RIGHT: 3}
+KEY_SPAWN_DIR = {pygame.K_u: 0, pygame.K_i: 1, pygame.K_o: 2, pygame.K_p: 3}
+PROFILE_PATH = Path("./frame_profile.json").absolute() # where the frame timings are written at exit
 
 def get_arrow_x(direction: str, screen_width: int, arrow_width: int, area_width: int):
     """Gets the x position of an arrow given its direction"""
@@ -28,45 +46,53 @@ def get_arrow_x(direction: str, screen_width: int, arrow_width: int, area_width:
     elif direction == "right":
         return arrow_width * 4
 
-def random_arrow_line(count: int):
-    """Gets a random arrow line with 'count' arrows"""    
-    arrow_line = np.zeros(4, dtype=bool)
-    arrow_line[:count] = True  # Set the first 'count' elements to True
-    np.random.shuffle(arrow_line)  # Shuffle to randomize order
-    return tuple(arrow_line)
-
 class Stepmania:
-    """Class to simulate a stepmania game"""
-
-    def __init__(self):
-        """Class to simulate a stepmania game"""
-        print(f"Setting up bluetooth connections for {BTCLIENTS}")
-        self.bluetooth_clients = [ bt.setup_bluetooth(BTCLIENTS[i], use_mac_addresses=True) for i in range(2)]
-        self.bluetooth_clients[0][0].recv_message_callback = self._bluetooth_player1_callback
-        self.bluetooth_clients[1][0].recv_message_callback = self._bluetooth_player2_callback
-
+    """Class to simulate a stepmania game, rendering a GameEngine with pygame"""
+
+    def __init__(self, dirty_rects: bool = False, mqtt_broker: str = None, profile_path: Path = None):
+        """Class to simulate a stepmania game
+
+        If dirty_rects = True: only the parts of the screen that changed are redrawn and pushed to the display
+        If mqtt_broker ("host" or "host:port") is given, the controllers are reached through it instead of bluetooth
+        If profile_path is given, the phases of every frame are timed and written there at exit (F3 shows them)"""
+        start_time = time.perf_counter()
+        image_bank = shared_image_bank() # decoded and scaled in the background while pygame and the display start
+        image_bank.preload(chain(Arrow.IMAGE_PATHS.values(), (MarkerArrow.IMAGE_PATH, MarkerSpawn.IMAGE_PATH)), (ARROW_SIZE, ARROW_SIZE))
+        image_bank.preload(PlayerBtMarker.IMAGE_PATHS.values(), (PlayerBtMarker.SIZE, PlayerBtMarker.SIZE))
         print("Initializing pygame...")
         pygame.init()
         self.screen = pygame.display.set_mode((WIDTH, HEIGHT))
         self.clock = pygame.time.Clock()
+        self.renderer = FrameRenderer(self.screen, dirty_rects)
         
         print("Loading resources...")
+        shared_bank().preload(chain(HitSoundPlayer.SOUND_PATHS.values(), BeatSoundMaker.SOUND_PATHS.values())) # decoded in the background meanwhile
         Arrow._load_images()
+        MeasureLine._load_image()
         MarkerArrow._load_image()
         BeatSoundMaker._load_beat_sounds()
         MarkerSpawn._load_image()
         PlayerBtMarker._load_images()
+        Arrow._build_atlas()
+        print(f"Resources loaded {(time.perf_counter() - start_time) * 1e3:.0f} ms after startup ({image_bank.cache_hits} of {len(image_bank.assets)} images from the cache)")
 
         print("Final setups...")
-        self.is_p2 = False # whether p2 is playing
-        self.score_recorder = ScoreRecorder(10)
-        self.score_recorder_p2 = ScoreRecorder(10)
+        self.engine = GameEngine(PerfCounterClock())
+        self.hit_sound_player = HitSoundPlayer()
         self.font = pygame.font.Font(None, 36)
+        self.text_cache = TextCache(self.font)
+        self.profiler: fp.FrameProfiler = fp.FrameProfiler() if profile_path is not None else None # None: no timers at all
+        self.profile_path = profile_path or PROFILE_PATH
+        self.show_profiler = False # F3 toggles the overlay, starting the profiler if needed
+        self.profiler_text_cache = TextCache(pygame.font.Font(None, 20))
         self.beat_sound_maker = BeatSoundMaker()
+        self.audio_scheduler = AudioScheduler() # plays the beat and hit sounds on time, off the frame loop
+        self.pending_inputs: deque[GameInput] = deque() # inputs pushed from the bluetooth threads
+        self.wire_decoders = [FrameDecoder() for _ in range(2)] # binary frames of each player
+        self.chart: CompiledChart = None # chart to play instead of random blocks
 
         # Arrow properties
         self.bottom_y = HEIGHT - 100  # Where arrows should be hit
-        self.SCROLL_SPEED = 350
         
         self.running = False
         self.playerbtmarkers : tuple[PlayerBtMarker, PlayerBtMarker] = (
@@ -85,217 +111,229 @@ class Stepmania:
             MarkerSpawn("up"),
             MarkerSpawn("right")
         )
-        self.arrows: tuple[list[Arrow]] = ([], [], [], []) # Arrows for each direction
-        self.measure_lines: list[MeasureLine] = []
-
-        self.next_measure_time= 0
-        self.start_time = 0
-        self.BPM = 120
-        self.is_gen_random = True # whether to generate random arrow blocks
-
-        self.arrow_block_queue = deque()
-        self.do_measure : Callable[[], None] = None # Function to call when a measure is reached
 
+        # Controllers last: their callbacks run on the transport thread as soon as they connect, and use everything above
+        if mqtt_broker is not None:
+            from BluetoothImplementation.mqtt_transport import MQTT_PORT, setup_mqtt # paho is only needed with --mqtt
+            host, _, port = mqtt_broker.partition(":")
+            self.bluetooth_clients = setup_mqtt(*MQTT_PLAYERS, host=host, port=int(port or MQTT_PORT))
+        else:
+            from BluetoothImplementation import bluetooth_definition as bt # bleak is only needed without --mqtt
+            print(f"Setting up bluetooth connections for {BTCLIENTS}")
+            self.bluetooth_clients = bt.setup_bluetooth(*BTCLIENTS) # controllers join whenever they connect
+        self.bluetooth_clients[0].recv_message_callback = self._bluetooth_player1_callback
+        self.bluetooth_clients[1].recv_message_callback = self._bluetooth_player2_callback
+        self.clock_syncs = [ClockSyncService(self.bluetooth_clients[i]) for i in range(2)] # consume the PONGs, forward the rest
+        self.chart_uploader = ChartUploader(self.bluetooth_clients[0], self.clock_syncs[0]) # player 1 judges its hits on the device
+        for client in self.bluetooth_clients:
+            client.on_connected = self._bluetooth_connected_callback # set after the services it resets, a connection before finds them new
+
+    def load_chart(self, path: Path, difficulty: str = None):
+        """Loads a .sm/.ssc chart to play when the game starts"""
+        self.chart = load_chart(path, difficulty)
+        print(f"Loaded chart {self.chart.title} ({self.chart.difficulty}): {self.chart.note_count()} notes")
 
     def start(self):
         """Starts the game loop"""
         print("Starting game loop...")
         self.running = True
-        self.start_time = time.perf_counter()
-        self.next_measure_time = self.start_time
-        self.next_beat_time = self.start_time
+        self.engine.start()
+        if self.chart is not None:
+            self.engine.schedule_chart(self.chart, self.engine.time + CHART_LEAD_IN)
+        self.audio_scheduler.start()
+        for clock_sync in self.clock_syncs:
+            clock_sync.start()
+        self.chart_uploader.start()
 
         while self.running: # Main loop
-            self.screen.fill((0, 0, 0))
-            current_time = time.perf_counter()
-            
-            # Play beat sound at each beat
-            if current_time >= self.next_beat_time:
-                self.next_beat_time += 60 / self.BPM
-                self.beat_sound_maker.play_beat_sound()   
-
-            # Spawn new arrows at whole measures (4 beats)
-            if current_time >= self.next_measure_time and self.is_gen_random:
-                self.next_measure_time += 4*60 / self.BPM
-                if len(self.arrow_block_queue) > 0:
-                    block = self.arrow_block_queue.popleft()
-                    self.spawn_arrow_block(current_time, block)
-                if self.do_measure:
-                    self.do_measure()
-                
-                # spawn measure line
-                self.measure_lines.append(MeasureLine(current_time))
-                         
-            
-            # Draw and updates
-            self.draw_text(f"Score: {self.score_recorder.score} (combo: {self.score_recorder.combo})", 10, 10)
-            self.draw_text(f"BPM: {self.BPM:.2f}", 10, 40)
-            self.draw_text(f"Speed: {self.SCROLL_SPEED:.2f}", 10, 70)
-            if self.is_p2:
-                self.draw_text(f"Score P2: {self.score_recorder_p2.score} (combo: {self.score_recorder_p2.combo})", 10, 100)
+            profiler = self.profiler # every 'if profiler is not None' is skipped when profiling is off
+            if profiler is not None:
+                profiler.begin_frame()
+            self.renderer.begin_frame()
+            if profiler is not None:
+                profiler.lap(fp.CLEAR)
+
+            # Simulation
+            inputs = self.handle_events()
+            if profiler is not None:
+                profiler.lap(fp.EVENTS)
+            events = self.engine.update(inputs)
+            if profiler is not None:
+                profiler.lap(fp.SIMULATION)
+            for event in events:
+                if event.kind == "hit": # played now: event.time is when the press happened, already past
+                    self.hit_sound_player.play_sound(event.dir_index, self.audio_scheduler, self.engine.clock.now())
+                elif event.kind == "spawn":
+                    self.spawn_markers[event.dir_index].schedule_draw()
+            self.beat_sound_maker.schedule_beats(self.engine, self.audio_scheduler)
+            if profiler is not None:
+                profiler.lap(fp.SOUND)
+            self.chart_uploader.update(self.engine)
+            if profiler is not None:
+                profiler.lap(fp.UPLOAD)
+
+            # Draw
+            engine, renderer = self.engine, self.renderer
+            self.draw_text_parts(("Score: ", str(engine.score_recorder.score), " (combo: ", str(engine.score_recorder.combo), ")"), 10, 10)
+            self.draw_text_parts(("BPM: ", f"{engine.BPM:.2f}"), 10, 40)
+            self.draw_text_parts(("Speed: ", f"{engine.SCROLL_SPEED:.2f}"), 10, 70)
+            if engine.is_p2:
+                self.draw_text_parts(("Score P2: ", str(engine.score_recorder_p2.score), " (combo: ", str(engine.score_recorder_p2.combo), ")"), 10, 100)
+            if profiler is not None:
+                profiler.lap(fp.TEXT)
             for marker_arrow in self.arrow_markers: # Draw arrow markers
-                marker_arrow.draw(self.screen)
+                renderer.add(marker_arrow.draw(self.screen))
             for marker_arrow in self.arrow_markers: # Reset arrow markers
                 marker_arrow.is_pressed = False
             for marker_spawn in self.spawn_markers: # Draw arrow spawn markers
-                marker_spawn.draw(self.screen)
-            for measure_line in self.measure_lines: # Draw measure lines
-                measure_line.update(current_time, HEIGHT, self.SCROLL_SPEED, self.BPM)
-                if measure_line.y < -50:
-                    self.measure_lines.remove(measure_line)
-                else:
-                    measure_line.draw(self.screen)
+                renderer.add(marker_spawn.draw(self.screen))
+            if profiler is not None:
+                profiler.lap(fp.MARKERS)
+            renderer.add_all(MeasureLine.draw_store(self.screen, engine.measure_line_store, engine.visible_measure_lines())) # Draw measure lines
+            if profiler is not None:
+                profiler.lap(fp.MEASURE_LINES)
             for i in range(len(self.bluetooth_clients)): # Draw bluetooth markers
-                if self.bluetooth_clients[i][0].client.is_connected:
-                    self.playerbtmarkers[i].draw(self.screen)
-
-            def do_arrow_draw(dir_index: int) -> None: # for all arrows
-                for arrow in self.arrows[dir_index]:
-                    arrow.update(current_time, HEIGHT, self.SCROLL_SPEED, self.BPM)
-                    if arrow.y < -50:
-                        self.arrows[dir_index].remove(arrow)
-                        self.score_recorder.register_miss()
-                        self.score_recorder_p2.register_hit(2)
-                    else:
-                        arrow.draw(self.screen)    
-            for dir_index in range(len(self.arrows)):
-                do_arrow_draw(dir_index)
-
-            # Event handling
-            for event in pygame.event.get():
-                def do_arrow_hit(dir_index: int) -> None:
-                    to_remove = []
-                    time_1_measure = 4*60/self.BPM
-                    for arrow in self.arrows[dir_index]:
-                        arrow_0_time = arrow.spawn_time + time_1_measure * MEASURE_MARGIN
-                        if self.score_recorder.check_hit(current_time, arrow_0_time, dir_index):
-                            self.score_recorder.register_hit()
-                            self.score_recorder_p2.register_miss()
-                            to_remove.append(arrow)
-                            break # only hit one arrow
-                    for arrow in to_remove:
-                        self.arrows[dir_index].remove(arrow)
-                if event.type == pygame.QUIT:
-                    self.running = False
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_z:
-                        self.SCROLL_SPEED = self.SCROLL_SPEED * 1.1
-                    elif event.key == pygame.K_s:
-                        self.SCROLL_SPEED = self.SCROLL_SPEED * 0.9
-                    elif event.key == pygame.K_a:
-                        self.BPM += 20
-                    elif event.key == pygame.K_q:
-                        self.BPM -= 20
-                    elif event.key == pygame.K_r:
-                        self.is_gen_random = not self.is_gen_random # toggle random generation
-                    else:
-                        if event.key == pygame.K_LEFT:
-                            do_arrow_hit(DIR_DICT_INV["left"])
-                            self.arrow_markers[0].is_pressed = True
-                        elif event.key == pygame.K_DOWN:
-                            do_arrow_hit(DIR_DICT_INV["down"])
-                            self.arrow_markers[1].is_pressed = True
-                        elif event.key == pygame.K_UP:
-                            do_arrow_hit(DIR_DICT_INV["up"])
-                            self.arrow_markers[2].is_pressed = True
-                        elif event.key == pygame.K_RIGHT:
-                            do_arrow_hit(DIR_DICT_INV["right"])
-                            self.arrow_markers[3].is_pressed = True
-                        elif event.key == pygame.K_ESCAPE:
-                            self.running = False
-                        elif event.key == pygame.K_u:
-                            self._spawn_arrow_now(0)
-                            self.is_p2 = True
-                            self.score_recorder_p2.register_miss() # cost 1
-                        elif event.key == pygame.K_i:
-                            self._spawn_arrow_now(1)
-                            self.is_p2 = True
-                            self.score_recorder_p2.register_miss() # cost 1
-                        elif event.key == pygame.K_o:
-                            self._spawn_arrow_now(2)
-                            self.is_p2 = True
-                            self.score_recorder_p2.register_miss() # cost 1
-                        elif event.key == pygame.K_p:
-                            self._spawn_arrow_now(3)
-                            self.is_p2 = True
-                            self.score_recorder_p2.register_miss() # cost 1
-                        # else:
-                        #     print(f"Key pressed: {event.key}, {pygame.key.name(event.key)}, {pygame.K_LEFT}")
-                elif event.type == pygame.USEREVENT:
-                    if "dir_index" in event.dict:
-                        dir_index = event.dict["dir_index"]
-                        print(f"Received event: dir_index={dir_index}")
-                        self.arrow_markers[dir_index].is_pressed = True
-                        # self.score_recorder.check_hit(current_time, event.dict["arrow_timestamp"], event.dict["dir_index"])
-                        do_arrow_hit(dir_index)
-            pygame.display.flip()
+                if self.bluetooth_clients[i].is_connected():
+                    renderer.add(self.playerbtmarkers[i].draw(self.screen))
+            if profiler is not None:
+                profiler.lap(fp.MARKERS) # laps add up, the bluetooth markers count with the other markers
+            renderer.add_all(Arrow.draw_store(self.screen, engine.arrow_store, engine.visible_arrows())) # Draw arrows
+            if profiler is not None:
+                profiler.lap(fp.ARROWS)
+                if self.show_profiler:
+                    self.draw_profiler_overlay(profiler)
+                    profiler.lap(fp.OVERLAY)
+
+            renderer.end_frame()
+            if profiler is not None:
+                profiler.lap(fp.PRESENT)
             self.clock.tick(60)
+            if profiler is not None:
+                profiler.lap(fp.TICK)
+                profiler.end_frame()
+        print(f"Pushed {renderer.mean_pixels_pushed():.0f} pixels per frame on average ({renderer.full_flips}/{renderer.frames} full flips)")
+        print(f"HUD text cache: {self.text_cache.hits} hits, {self.text_cache.misses} misses")
+        print(f"Judgements P1: {self.engine.score_recorder.stats.summary()}")
+        if self.profiler is not None:
+            self.profiler.dump(self.profile_path)
+            frame_p50, frame_p99 = self.profiler.percentiles()["frame"]
+            print(f"Frame time p50 {frame_p50 * 1e3:.2f} ms, p99 {frame_p99 * 1e3:.2f} ms, {self.profiler.spike_count} spikes; phase timings written to {self.profile_path}")
+        self.audio_scheduler.stop()
+        recorder = self.engine.recorder
+        if recorder is not None:
+            recorder.close()
+            print(f"Replay: {recorder.records} records written to {recorder.path}")
+        for i, clock_sync in enumerate(self.clock_syncs):
+            clock_sync.stop()
+            print(f"Player {i+1} clock: offset {clock_sync.estimator.offset():.6f} s, drift {clock_sync.estimator.drift_ppm():+.1f} ppm")
+        uploader = self.chart_uploader
+        uploader.stop()
+        if uploader.frames_sent:
+            print(f"Chart upload: {uploader.times_sent} arrows in {uploader.frames_sent} frames ({uploader.bytes_sent} bytes), write latency p99 {np.percentile(uploader.latencies, 99) * 1e3:.2f} ms")
+        if uploader.frames_failed:
+            print(f"Chart upload: {uploader.frames_failed} frames failed")
+        for i, decoder in enumerate(self.wire_decoders):
+            if decoder.received:
+                print(f"Player {i+1} link: {decoder.received} records received, {decoder.lost} lost ({decoder.loss_rate():.2%}), {decoder.out_of_order} out of order")
+        for tag, (count, mean, p50, p99, max_error) in self.audio_scheduler.onset_stats().items():
+            print(f"Sound onset error ({tag}): {count} sounds, mean {mean:.3f} ms, p50 {p50:.3f} ms, p99 {p99:.3f} ms, max {max_error:.3f} ms")
+
+    def handle_events(self) -> list[GameInput]:
+        """Turns the pending pygame events into engine inputs"""
+        inputs = []
+        while self.pending_inputs:
+            inputs.append(self.pending_inputs.popleft())
+        now = self.engine.clock.now() # pygame events carry no timestamp, keys are stamped when they are read
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_z:
+                    inputs.append(GameInput("speed", value=1.1))
+                elif event.key == pygame.K_s:
+                    inputs.append(GameInput("speed", value=0.9))
+                elif event.key == pygame.K_a:
+                    inputs.append(GameInput("bpm", value=20))
+                elif event.key == pygame.K_q:
+                    inputs.append(GameInput("bpm", value=-20))
+                elif event.key == pygame.K_r:
+                    inputs.append(GameInput("toggle_random")) # toggle random generation
+                elif event.key in KEY_HIT_DIR:
+                    dir_index = KEY_HIT_DIR[event.key]
+                    inputs.append(GameInput("hit", dir_index, time=now))
+                    self.arrow_markers[dir_index].is_pressed = True
+                elif event.key == pygame.K_ESCAPE:
+                    self.running = False
+                elif event.key == pygame.K_F3:
+                    self.toggle_profiler_overlay()
+                elif event.key in KEY_SPAWN_DIR:
+                    inputs.append(GameInput("spawn", KEY_SPAWN_DIR[event.key], 1)) # cost 1
+                # else:
+                #     print(f"Key pressed: {event.key}, {pygame.key.name(event.key)}, {pygame.K_LEFT}")
+            elif event.type == pygame.USEREVENT:
+                if "dir_index" in event.dict:
+                    dir_index = event.dict["dir_index"]
+                    print(f"Received event: dir_index={dir_index}")
+                    self.arrow_markers[dir_index].is_pressed = True
+                    inputs.append(GameInput("hit", dir_index, time=event.dict.get("time", now)))
+        return inputs
 
     def stop(self):
         """Stops the game loop"""
         self.running = False
-
-    def spawn_arrow(self, direction: Literal["left","up","right","down"], color: Literal["blue","red","green","yellow","purple","orange","cyan","white"], spawn_time: float):
-        """Spawns an arrow at a given time"""
-        arrow = Arrow(spawn_time, direction, color)
-        self.arrows[DIR_DICT_INV[direction]].append(arrow)
-    
-    def spawn_arrow_block(self, measure_begin_time: float, arrow_lines: "list[ tuple[ bool, bool, bool, bool] ]"):
-        """Spawns a block of arrows at a given time"""
-        if len(arrow_lines) == 0:
-            return
-        
-        time_offset = 60 / self.BPM * 4 / len(arrow_lines)       
-
-        for i, arrow_line in enumerate(arrow_lines):
-            # Supported up to 24 beats per tempo
-            if (48*4) % len(arrow_lines) != 0:
-                raise ValueError(f"Invalid number of arrows {len(arrow_lines)} for a measure, should divide 48*4.")
-            
-            color = "white" # default color
-            beat_offset = (i * (48 * 4 // len(arrow_lines))) % 48
-
-            if beat_offset == 0: # i % 48 == 0
-                color = "red" # beat
-            elif beat_offset % 24 == 0:
-                color = "blue" # 1/2 beat
-            elif beat_offset % 16 == 0: 
-                color = "purple" # 1/3 beat
-            elif beat_offset % 12 == 0:
-                color = "green" # 1/4 beat
-            elif beat_offset % 8 == 0:
-                color = "pink" # 1/6 beat
-            elif beat_offset % 6 == 0:
-                color = "yellow" # 1/8 beat
-            elif beat_offset % 4 == 0:
-                color = "cyan" # 1/16 beat
-            elif beat_offset % 3 == 0:
-                color = "magenta" # 1/12 beat
-            else:
-                color = "white"            
-            
-            if arrow_line[0]:
-                self.spawn_arrow("left", color, measure_begin_time + time_offset * i)
-            if arrow_line[1]:
-                self.spawn_arrow("down", color, measure_begin_time + time_offset * i)
-            if arrow_line[2]:
-                self.spawn_arrow("up", color, measure_begin_time + time_offset * i)
-            if arrow_line[3]:
-                self.spawn_arrow("right", color, measure_begin_time + time_offset * i)
                 
-    def draw_text(self, text: str, x: int, y: int):
+    def draw_text(self, text: str, x: int, y: int) -> pygame.Rect:
         """Draws text on the screen"""
-        text_surface = self.font.render(text, True, (255, 255, 255))
-        self.screen.blit(text_surface, (x, y))
+        text_surface = self.text_cache.render(text)
+        rect = self.screen.blit(text_surface, (x, y))
+        self.renderer.add(rect)
+        return rect
+
+    def draw_text_parts(self, parts: tuple[str, ...], x: int, y: int):
+        """Draws text pieces one after the other, so static labels and changing numbers are cached separately"""
+        for part in parts:
+            x = self.draw_text(part, x, y).right
+
+    def draw_profiler_overlay(self, profiler: fp.FrameProfiler):
+        """Draws the p50/p99 of every phase and the last spikes in the top right corner"""
+        y = 10
+        for line in profiler.overlay_text():
+            surface = self.profiler_text_cache.render(line, (255, 255, 0))
+            self.renderer.add(self.screen.blit(surface, (WIDTH - surface.get_width() - 10, y)))
+            y += surface.get_height()
+
+    def toggle_profiler_overlay(self):
+        if self.profiler is None:
+            self.profiler = fp.FrameProfiler()
+        self.show_profiler = not self.show_profiler
+
+    def _bluetooth_connected_callback(self, client: ControllerClient):
+        """Called from the bluetooth thread when a controller (re)connects"""
+        player = self.bluetooth_clients.index(client)
+        print(f"Player {player+1} connected")
+        self.clock_syncs[player].reset()
+        if player == 0:
+            self.chart_uploader.reset()
 
     def _bluetooth_player1_callback(self, data: bytearray):
         """Callback for bluetooth messages"""
+        receipt_time = self.engine.clock.now()
         print(f"Received message from player 1: {data}")
-        EventBT_parse_message_and_send_events(data, self)
+        EventBT_parse_message_and_send_events(data, self, receipt_time, self.clock_syncs[0], self.wire_decoders[0])
         
     def _bluetooth_player2_callback(self, data: bytearray):
         """Callback for bluetooth messages"""
         print(f"Received message from player 2: {data}")
+        if is_wire_frame(data):
+            try:
+                records = self.wire_decoders[1].decode(data)
+            except (ValueError, struct.error) as e:
+                print(f"Error parsing frame: {e}")
+                return
+            for record in records:
+                if record.message_type == MSG_SPAWN:
+                    self.pending_inputs.append(GameInput("spawn", record.lane))
+            return
         try:
             message_str = data.decode("ascii")
             hit_str_, i = message_str.split(" ")
@@ -303,43 +341,24 @@ class Stepmania:
         except Exception as e:
             print(f"Error parsing message: {e}")
             return
-        self._spawn_arrow_now(i)
-
-    def _spawn_arrow_now(self, dir_index: int):
-        """Spawns an arrow now"""
-        time_offset = 60 / self.BPM * 4 / 4 
-        time_now = time.perf_counter()
-
-        self.spawn_arrow(DIR_DICT[dir_index], "white", time_now + time_offset)
-        self.spawn_markers[dir_index].schedule_draw()
+        self.pending_inputs.append(GameInput("spawn", i))
         
 
-class ScoreRecorder:
-    """Class to record the score of a player"""
+class HitSoundPlayer:
+    """Class to play the piano sounds of a player's hits"""
     ACCEPTABLE_SOUNDS = [28, 35, 40, 44, 47, 52, 56, 59, 64]
+    SOUND_PATHS = {"clap": RESOURCE_PATH / "GameplayAssist clap.ogg",
+                   **{f"piano_{i:03}": RESOURCE_PATH / "piano" / f"jobro__piano-ff-{i:03}.ogg" for i in ACCEPTABLE_SOUNDS}}
 
-    def __init__(self, initial_score: int = 0):
-        """Class to record the score of a player"""
-        self.score = initial_score
-        self.combo = 0
-        # self.tap_sound = pygame.mixer.Sound(RESOURCE_PATH / "GameplayAssist clap.ogg")
+    def __init__(self):
+        """Class to play the piano sounds of a player's hits"""
         self.current_sound_index = 0
         self.last_dir_index = 0
-        self.tap_sounds = {"clap": pygame.mixer.Sound(RESOURCE_PATH / "GameplayAssist clap.ogg")}
-        for i in self.ACCEPTABLE_SOUNDS:
-            self.tap_sounds[f"piano_{i:03}"] = pygame.mixer.Sound(RESOURCE_PATH / "piano" / f"jobro__piano-ff-{i:03}.ogg")
-            # print(f"Loaded piano_{i:03} at {RESOURCE_PATH / 'piano' / f'jobro__piano-ff-{i:03}.ogg'}")
-    
-    def check_hit(self, current_time: float, arrow_0_time: float, dir_index: int) -> bool:
-        """Checks if the player hit an arrow. Returns True if the arrow was hit."""
-        print(f"current_time: {current_time}, arrow_0_time: {arrow_0_time}")
-        if abs(current_time - arrow_0_time) < 0.1:
-            self.play_sound(dir_index)
-            return True
-        return False
-
-    def play_sound(self, dir_index: int):
-        """Plays a sound"""
+        bank = shared_bank() # every player shares the decoded sounds
+        self.tap_sounds = {name: bank.get(path) for name, path in self.SOUND_PATHS.items()}
+
+    def play_sound(self, dir_index: int, audio_scheduler: AudioScheduler = None, play_time: float = None):
+        """Plays a sound, through 'audio_scheduler' at 'play_time' if given"""
         new_index = 0
         if dir_index == self.last_dir_index: # same
             new_index = self.current_sound_index
@@ -357,88 +376,60 @@ class ScoreRecorder:
                 new_index = np.random.randint(min_index, max_index)
 
         sound = self.tap_sounds[f"piano_{self.ACCEPTABLE_SOUNDS[new_index]:03}"]
-        sound.play(maxtime=500)
+        if audio_scheduler is None:
+            sound.play(maxtime=500)
+        else:
+            audio_scheduler.schedule(play_time, sound, maxtime=500, tag="hit")
         # print(f"======\ndir_index: {dir_index}\nlast_dir_index: {self.last_dir_index},\ncurrent_sound_index: {self.current_sound_index},\nnew_index: {new_index}")
         self.last_dir_index = dir_index # update
         self.current_sound_index = new_index
 
-    def register_hit(self, points: int = 1):
-        """Registers a hit"""
-        self.score += points
-        self.combo += 1
-    
-    def register_miss(self, points: int = 1):
-        """Registers a miss"""
-        self.score -= points
-        self.combo = 0
-
 class Arrow:
-    """Class to represent an arrow asset"""
+    """Class to draw the arrows of an ArrowStore"""
+    IMAGE_PATHS = {color: RESOURCE_PATH / f"Arrow{color.capitalize()}.png" for color in ("blue", "red", "green", "yellow", "purple", "magenta", "cyan", "pink", "white")}
     arrow_imgs : dict[str, pygame.Surface]= {}
-    def __init__(self, spawn_time: float, direction: Literal["left","up","right","down"] = "left", color: Literal["blue","red","green","yellow","purple","orange","cyan","white"] = "red"):
-        self.x = get_arrow_x(direction, WIDTH, ARROW_SIZE, WIDTH//2)
-        self.y = 0
-        self.spawn_time = spawn_time
-        if direction == "left":
-            self.img = Arrow.arrow_imgs[color]
-        elif direction == "down":
-            self.img = pygame.transform.rotate(Arrow.arrow_imgs[color], 90)
-        elif direction == "right":
-            self.img = pygame.transform.rotate(Arrow.arrow_imgs[color], 180)
-        elif direction == "up":
-            self.img = pygame.transform.rotate(Arrow.arrow_imgs[color], 270)
-        else:
-            raise ValueError(f"Invalid direction {direction}")
-        
-    def update(self, current_time, height: int, scroll_speed: int, BPM: int):
-        time_1_measure = 4*60/BPM
-        speed = scroll_speed
-        spawn_y = ZERO_Y + MEASURE_MARGIN * time_1_measure * speed
-
-        t = current_time - self.spawn_time
-        self.y = ZERO_Y + (spawn_y - ZERO_Y)*(1 - t / (MEASURE_MARGIN * time_1_measure)) - ARROW_SIZE//2
+    atlas: SpriteAtlas = None # sprites shared by Arrow, MarkerArrow and MarkerSpawn
+    LANE_X = tuple(get_arrow_x(DIR_DICT[i], WIDTH, ARROW_SIZE, WIDTH//2) for i in range(4))
 
-    def draw(self, screen: pygame.Surface):
-        screen.blit(self.img, (self.x, self.y))
+    @staticmethod
+    def draw_store(screen: pygame.Surface, store: ArrowStore, on_screen: np.ndarray) -> list[pygame.Rect]:
+        """Draws the arrows of the slots selected by the 'on_screen' mask, reading their positions from the store. Returns the drawn rects."""
+        sprites, lane_x = Arrow.atlas.arrows, Arrow.LANE_X
+        return screen.blits([(sprites[color_id][lane], (lane_x[lane], y)) for y, lane, color_id
+                      in zip(store.y[on_screen].tolist(), store.lane[on_screen].tolist(), store.color_id[on_screen].tolist())])
 
     @staticmethod
     def _load_images():
+        bank = shared_image_bank()
         Arrow.arrow_imgs.clear()
-        Arrow.arrow_imgs["blue"] = pygame.image.load(RESOURCE_PATH / "ArrowBlue.png")
-        Arrow.arrow_imgs["red"] = pygame.image.load(RESOURCE_PATH / "ArrowRed.png")
-        Arrow.arrow_imgs["green"] = pygame.image.load(RESOURCE_PATH / "ArrowGreen.png")
-        Arrow.arrow_imgs["yellow"] = pygame.image.load(RESOURCE_PATH / "ArrowYellow.png")
-        Arrow.arrow_imgs["purple"] = pygame.image.load(RESOURCE_PATH / "ArrowPurple.png")
-        Arrow.arrow_imgs["magenta"] = pygame.image.load(RESOURCE_PATH / "ArrowMagenta.png")
-        Arrow.arrow_imgs["cyan"] = pygame.image.load(RESOURCE_PATH / "ArrowCyan.png")
-        Arrow.arrow_imgs["pink"] = pygame.image.load(RESOURCE_PATH / "ArrowPink.png")
-        Arrow.arrow_imgs["white"] = pygame.image.load(RESOURCE_PATH / "ArrowWhite.png")
-        for arrow_name in Arrow.arrow_imgs:
-            Arrow.arrow_imgs[arrow_name] = pygame.transform.scale(Arrow.arrow_imgs[arrow_name], (ARROW_SIZE, ARROW_SIZE))
+        for arrow_name, path in Arrow.IMAGE_PATHS.items():
+            Arrow.arrow_imgs[arrow_name] = bank.get(path, (ARROW_SIZE, ARROW_SIZE))
 
+    @staticmethod
+    def _build_atlas():
+        """Builds the sprite atlas once all the images are loaded and the display is set"""
+        Arrow.atlas = SpriteAtlas(Arrow.arrow_imgs, MarkerArrow.marker_img, MarkerSpawn.marker_img)
 
-class MeasureLine:
-    H = 10
-    def __init__(self, spawn_time: float):
-        self.spawn_time = spawn_time
-        self.x = 0
-        self.y = 0
-        # # red
-        self.img = pygame.Surface((WIDTH, MeasureLine.H))
-        self.img.fill((255, 0, 0))
 
-    def update(self, current_time, height: int, scroll_speed: int, BPM: int):
-        time_1_measure = 4*60/BPM
-        speed = scroll_speed
-        spawn_y = ZERO_Y + MEASURE_MARGIN * time_1_measure * speed
+class MeasureLine:
+    """Class to draw the measure lines of an ArrowStore"""
+    img: pygame.Surface = None
 
-        t = current_time - self.spawn_time
-        self.y = ZERO_Y + (spawn_y - ZERO_Y)*(1 - t / (MEASURE_MARGIN * time_1_measure)) - MeasureLine.H//2
+    @staticmethod
+    def draw_store(screen: pygame.Surface, store: ArrowStore, on_screen: np.ndarray) -> list[pygame.Rect]:
+        """Draws the measure lines of the slots selected by the 'on_screen' mask, reading their positions from the store. Returns the drawn rects."""
+        img = MeasureLine.img
+        return screen.blits([(img, (0, y)) for y in store.y[on_screen].tolist()])
 
-    def draw(self, screen: pygame.Surface):
-        screen.blit(self.img, (self.x, self.y))
+    @staticmethod
+    def _load_image():
+        # # red
+        MeasureLine.img = pygame.Surface((WIDTH, MEASURE_LINE_H))
+        MeasureLine.img.fill((255, 0, 0))
+        MeasureLine.img = MeasureLine.img.convert()
 
 class MarkerArrow:
+    IMAGE_PATH = RESOURCE_PATH / "ArrowMarker.png"
     marker_img: pygame.Surface = None
     """Class to represent an marker arrow asset"""
     arrow_imgs : dict[str, pygame.Surface]= {}
@@ -446,29 +437,22 @@ class MarkerArrow:
         self.x = get_arrow_x(direction, WIDTH, ARROW_SIZE, WIDTH//2)
         self.y = ZERO_Y - ARROW_SIZE//2
         self.is_pressed = False
-        if direction == "left":
-            self.img = MarkerArrow.marker_img
-        elif direction == "down":
-            self.img = pygame.transform.rotate(MarkerArrow.marker_img, 90)
-        elif direction == "right":
-            self.img = pygame.transform.rotate(MarkerArrow.marker_img, 180)
-        elif direction == "up":
-            self.img = pygame.transform.rotate(MarkerArrow.marker_img, 270)
-        else:
+        if direction not in DIR_DICT_INV:
             raise ValueError(f"Invalid direction {direction}")
+        self.img = Arrow.atlas.marker(DIR_DICT_INV[direction])
         
-    def draw(self, screen: pygame.Surface):
+    def draw(self, screen: pygame.Surface) -> pygame.Rect:
         if self.is_pressed:
             pygame.draw.rect(screen, (255, 255, 255), (self.x, self.y, ARROW_SIZE, ARROW_SIZE), 3)
-        screen.blit(self.img, (self.x, self.y))
+        return screen.blit(self.img, (self.x, self.y))
 
     @staticmethod
     def _load_image():
-        MarkerArrow.marker_img = pygame.image.load(RESOURCE_PATH / "ArrowMarker.png")
-        MarkerArrow.marker_img = pygame.transform.scale(MarkerArrow.marker_img, (ARROW_SIZE, ARROW_SIZE))
+        MarkerArrow.marker_img = shared_image_bank().get(MarkerArrow.IMAGE_PATH, (ARROW_SIZE, ARROW_SIZE))
 
 class MarkerSpawn:
     """Class to represent an marker arrow spawn asset"""
+    IMAGE_PATH = RESOURCE_PATH / "ArrowSpawn.png"
     marker_img: pygame.Surface = None
     SHOWN_FRAMES = 5
     def __init__(self, direction: Literal["left","up","right","down"] = "left"):
@@ -480,19 +464,20 @@ class MarkerSpawn:
     def schedule_draw(self):
         self.draw_counter = MarkerSpawn.SHOWN_FRAMES
     
-    def draw(self, screen: pygame.Surface):
+    def draw(self, screen: pygame.Surface) -> pygame.Rect:
         if self.draw_counter > 0:
             self.draw_counter -= 1
-            screen.blit(MarkerSpawn.marker_img, (self.x, self.y))
+            return screen.blit(Arrow.atlas.spawn, (self.x, self.y))
+        return None
     
     @staticmethod
     def _load_image():
-        MarkerSpawn.marker_img = pygame.image.load(RESOURCE_PATH / "ArrowSpawn.png")
-        MarkerSpawn.marker_img = pygame.transform.scale(MarkerSpawn.marker_img, (ARROW_SIZE, ARROW_SIZE))
+        MarkerSpawn.marker_img = shared_image_bank().get(MarkerSpawn.IMAGE_PATH, (ARROW_SIZE, ARROW_SIZE))
 
 class PlayerBtMarker:
     player1_img: pygame.Surface = None
     player2_img: pygame.Surface = None
+    IMAGE_PATHS = {"player1": RESOURCE_PATH / "Player1.png", "player2": RESOURCE_PATH / "Player2.png"}
     SIZE = 50
     def __init__(self, player: Literal["player1", "player2"]):
         self.x = 0
@@ -506,74 +491,111 @@ class PlayerBtMarker:
         else:
             raise ValueError(f"Invalid player {player}")
         
-    def draw(self, screen: pygame.Surface):
-        screen.blit(self.img, (self.x, self.y))
+    def draw(self, screen: pygame.Surface) -> pygame.Rect:
+        return screen.blit(self.img, (self.x, self.y))
     
     @staticmethod
     def _load_images():
-        PlayerBtMarker.player1_img = pygame.image.load(RESOURCE_PATH / "Player1.png")
-        PlayerBtMarker.player1_img = pygame.transform.scale(PlayerBtMarker.player1_img, (PlayerBtMarker.SIZE, PlayerBtMarker.SIZE))
-        PlayerBtMarker.player2_img = pygame.image.load(RESOURCE_PATH / "Player2.png")
-        PlayerBtMarker.player2_img = pygame.transform.scale(PlayerBtMarker.player2_img, (PlayerBtMarker.SIZE, PlayerBtMarker.SIZE))
+        bank = shared_image_bank()
+        size = (PlayerBtMarker.SIZE, PlayerBtMarker.SIZE)
+        PlayerBtMarker.player1_img = bank.get(PlayerBtMarker.IMAGE_PATHS["player1"], size).convert_alpha()
+        PlayerBtMarker.player2_img = bank.get(PlayerBtMarker.IMAGE_PATHS["player2"], size).convert_alpha()
         
 
 class BeatSoundMaker:
+    SOUND_PATHS = {"tic": RESOURCE_PATH / "Tic.ogg", "tac": RESOURCE_PATH / "Tac.ogg"}
     beatTic: pygame.mixer.Sound = None
     beatTac: pygame.mixer.Sound = None
     def __init__(self):
-        self.count = 0
-    
-    def play_beat_sound(self):
-        """Plays a beat sound"""
-        if self.count % 4 == 0:
-            self.beatTac.play()
-        else:
-            self.beatTic.play()
-        self.count += 1
+        self.next_beat = 0 # next beat to queue in the audio scheduler
+        self.tempo_map = None # tempo map next_beat refers to
+
+    def schedule_beats(self, engine: GameEngine, audio_scheduler: AudioScheduler, lookahead: float = BEAT_LOOKAHEAD):
+        """Queues the beat sounds of the next 'lookahead' seconds, tac on the first beat of each measure"""
+        tempo_map = engine.tempo_map
+        if tempo_map is not self.tempo_map: # new timeline, restart from the engine's next beat
+            self.tempo_map = tempo_map
+            self.next_beat = math.ceil(engine.beat)
+        horizon = engine.time + lookahead
+        beat_time = tempo_map.beat_to_time(self.next_beat)
+        while beat_time <= horizon:
+            sound = self.beatTac if self.next_beat % 4 == 0 else self.beatTic
+            audio_scheduler.schedule(beat_time, sound, tag=f"{tempo_map.bpm_at(beat_time):.0f} BPM") # the tempo of that beat, not the current one
+            self.next_beat += 1
+            beat_time = tempo_map.beat_to_time(self.next_beat)
 
     @staticmethod
     def _load_beat_sounds():
-        BeatSoundMaker.beatTic = pygame.mixer.Sound(RESOURCE_PATH / "Tic.ogg")
-        BeatSoundMaker.beatTac = pygame.mixer.Sound(RESOURCE_PATH / "Tac.ogg")
+        bank = shared_bank()
+        BeatSoundMaker.beatTic = bank.get(BeatSoundMaker.SOUND_PATHS["tic"])
+        BeatSoundMaker.beatTac = bank.get(BeatSoundMaker.SOUND_PATHS["tac"])
 
 
 
-def EventBT_parse_message_and_send_events(message: bytearray, game) -> None:
-    """Parses a bluetooth message to spawn the relevant events."""
+def device_time_to_engine(clock_sync: ClockSyncService, device_time_us: float, receipt_time: float, wrapped: bool = False) -> float:
+    """Engine time of a device timestamp, 'receipt_time' while the device clock is not synchronized.
+
+    If wrapped = True: 'device_time_us' is the low 32 bits of the device time"""
+    if clock_sync is None or not clock_sync.estimator.ready():
+        return receipt_time
+    if wrapped:
+        device_time_us = unwrap_time_us(device_time_us, clock_sync.estimator.host_to_device(receipt_time) * 1e6)
+    return clock_sync.device_to_host(device_time_us * 1e-6)
+
+def post_hit_event(dir_index: int, hit_time: float = None):
+    """Posts a player 1 hit as a pygame event"""
+    dict_ = {"dir_index": dir_index}
+    if hit_time is not None:
+        dict_["time"] = hit_time
+    pygame.event.post(pygame.event.Event(pygame.USEREVENT, dict_))
+
+def EventBT_parse_message_and_send_events(message: bytearray, game, receipt_time: float = None, clock_sync: ClockSyncService = None,
+                                          decoder: FrameDecoder = None) -> None:
+    """Parses a bluetooth message to spawn the relevant events.
+
+    Binary frames (see wire_codec) are decoded with 'decoder'; the older ASCII format is "HIT <i> <arrowTime> <reactionTime>".
+    Hits are stamped with the device's own time translated by 'clock_sync' once synchronized, with 'receipt_time' otherwise."""
+    if decoder is not None and is_wire_frame(message):
+        try:
+            records = decoder.decode(message)
+        except (ValueError, struct.error) as e:
+            print(f"Error parsing frame: {e}")
+            return
+        for record in records:
+            if record.message_type == MSG_HIT:
+                post_hit_event(record.lane, device_time_to_engine(clock_sync, record.time_us, receipt_time, wrapped=True))
+        return
     # decode bluetooth message as string as ascii
     try:
         message_str = message.decode("ascii")
-        hit_str_, i = message_str.split(" ")
+        hit_str_, i, *times_us = message_str.split(" ")
         i = int(i) - 1
+        if times_us and receipt_time is not None:
+            receipt_time = device_time_to_engine(clock_sync, float(times_us[-1]), receipt_time)
     except Exception as e:
         print(f"Error parsing message: {e}")
         return 
-    type_ = pygame.USEREVENT
-    dict_ = {"dir_index": i}
-    event = pygame.event.Event(type_, dict_)
-    pygame.event.post(event)
+    post_hit_event(i, receipt_time)
 
 if __name__ == "__main__":
-    game = Stepmania()
-
-    block1 = []
-    for i in range(np.random.randint(1,5)):
-        block1.append(random_arrow_line(np.random.randint(1,2)))
-
-    game.arrow_block_queue.append(block1)
-    def do_measure_make_new_block():
-        block = []
-        choices_p = { # num of arrows : probability
-            1: 1/12,
-            2: 1/3,
-            4: 1/2,
-            8: 1/12,}
-        keys = [i for i in choices_p.keys()]
-        values = [i for i in choices_p.values()]
-        for i in range(np.random.choice(keys, p=values)): # 4 beats
-            block.append(random_arrow_line(np.random.randint(1,2)))
-        game.arrow_block_queue.append(block)
-    game.do_measure = do_measure_make_new_block
+    parser = argparse.ArgumentParser(description="Stepmania game")
+    parser.add_argument("--dirty-rects", action="store_true", help="only redraw the parts of the screen that changed")
+    parser.add_argument("--chart", type=Path, help=".sm or .ssc chart to play instead of random arrows")
+    parser.add_argument("--difficulty", help="difficulty of the chart to play (e.g. Hard), the first one by default")
+    parser.add_argument("--mqtt", metavar="BROKER[:PORT]", help="reach the controllers through this MQTT broker instead of bluetooth")
+    parser.add_argument("--profile", type=Path, nargs="?", const=PROFILE_PATH, help=f"time the phases of every frame and write them to this file at exit ({PROFILE_PATH.name} by default)")
+    parser.add_argument("--seed", type=int, help="seed of the random arrows, from the clock by default")
+    parser.add_argument("--no-replay", action="store_true", help=f"do not record the session in {REPLAY_DIR.name}/")
+    args = parser.parse_args()
+    game = Stepmania(dirty_rects=args.dirty_rects, mqtt_broker=args.mqtt, profile_path=args.profile)
+
+    seed = args.seed if args.seed is not None else int(time.time())
+    if args.chart is not None:
+        game.load_chart(args.chart, args.difficulty)
+    else:
+        game.engine.chart_scheduler = ChartScheduler(random_notes(np.random.RandomState(seed))) # own generator, so a replay draws the same arrows
+    if not args.no_replay:
+        game.engine.recorder = ReplayWriter(REPLAY_DIR / time.strftime("%Y%m%d-%H%M%S.smr"), seed, args.chart, game.chart.difficulty if game.chart else "")
 
     game.start()
-    pygame.quit()
\ No newline at end of file
+    pygame.quit()